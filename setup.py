@@ -25,6 +25,12 @@ try:
 except ImportError:
     install_requires.append('uuid')
 
+try:
+    # os.sendfile is new in Python 3.3
+    from os import sendfile
+except ImportError:
+    install_requires.append('pysendfile')
+
 
 setup(
     name = 'squeal',
@@ -20,8 +20,9 @@ class TrackJSON(Adapter):
 
     def length(self):
         """ Return a human representation of a length in seconds """
-        minutes = self.original.duration / 60000
-        seconds = (self.original.duration - (minutes * 60000))/1000
+        duration = self.original.duration or 0
+        minutes = duration / 60000
+        seconds = (duration - (minutes * 60000))/1000
         return u"%d:%02d" % (minutes, seconds)
 
 registerAdapter(TrackJSON, isqueal.ITrack, IJsonAdapter)
@@ -0,0 +1,36 @@
+
+"""
+Benchmark the queries behind the library browse pages, and the pathname
+lookups used when updating a collection. With the indexes in place the time
+taken should barely change with the size of the library.
+
+    python benchmark_browse.py [tracks]
+"""
+
+import sys
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+
+from squeal.library.record import Collection, Track, Artist, Album, TrackImporter
+
+from fixtures import examined
+
+def main(tracks=100000):
+    s = Store("TEMPORARY.axiom")
+    c = Collection(store=s, pathname=u"/music")
+    TrackImporter(c).create(examined(tracks))
+    artist = s.findFirst(Artist, Artist.name == u"artist %d" % (tracks / 200))
+    benchmark.start()
+    for i in xrange(100):
+        list(s.query(Track, sort=Track.title.asc, limit=50))
+        list(s.query(Artist, sort=Artist.name.asc, limit=50))
+        list(s.query(Album, sort=Album.name.asc, limit=50))
+        list(artist.tracks())
+        s.findFirst(Track, Track.pathname == u"/music/%d.mp3" % (tracks / 2))
+    benchmark.stop()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,58 @@
+
+"""
+Benchmark dispatching events to many subscribers, most of which are not
+interested in any one event, as when many browser tabs are open.
+
+    python benchmark_events.py [subscribers] [events]
+"""
+
+import sys
+
+from zope.interface import Interface, implements
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+
+from squeal.event import EventReactor
+
+class IHeartbeat(Interface):
+    pass
+
+class IPlaylistChange(Interface):
+    pass
+
+class IMetadataChange(Interface):
+    pass
+
+class IVolumeChange(Interface):
+    pass
+
+interfaces = [IPlaylistChange, IMetadataChange, IVolumeChange, IHeartbeat]
+
+class Heartbeat(object):
+    implements(IHeartbeat)
+
+class MetadataChange(object):
+    implements(IMetadataChange)
+
+def handler(ev):
+    pass
+
+def main(subscribers=1000, events=10000):
+    evr = EventReactor(store=Store())
+    # a handful of services listen for heartbeats, everything else is a tab
+    for i in range(subscribers):
+        if i % 100 == 0:
+            evr.subscribe(handler, IHeartbeat)
+        else:
+            evr.subscribe(handler, interfaces[i % 3])
+    heartbeat, change = Heartbeat(), MetadataChange()
+    benchmark.start()
+    for i in xrange(events):
+        evr._fireEvent(change if i % 10 == 0 else heartbeat)
+    benchmark.stop()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,71 @@
+"""
+Benchmark a storm of thumbnail requests, as when a long playlist is first
+shown, and report how late a timer running alongside them fires. That is how
+long the reactor is held up, and so how long players and web clients are kept
+waiting. Pass "inline" to make the thumbnails in the reactor, as they were
+before the image pool.
+
+    python benchmark_images.py [thumbnails] [pool|inline]
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+from StringIO import StringIO
+
+import Image, ImageDraw
+
+from epsilon.scripts import benchmark
+
+from twisted.internet import reactor, defer, task
+from twisted.python.filepath import FilePath
+
+from squeal import imaging
+from squeal.library.artwork import ArtworkStore
+
+def picture(i):
+    image = Image.new("RGB", (600, 600), (i % 256, 64, 128))
+    ImageDraw.Draw(image).text((10, 10), "cover %d" % i)
+    s = StringIO()
+    image.save(s, "JPEG")
+    return s.getvalue()
+
+def main(thumbnails=200, mode="pool"):
+    thumbnails = int(thumbnails)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        store = ArtworkStore(FilePath(tmpdir).child("artwork"))
+        digests = [store.add(picture(i)) for i in xrange(thumbnails)]
+        if mode == "inline":
+            def _get(digest):
+                return defer.succeed(store.make(store.path(digest), store.path(digest, 128), 128))
+        else:
+            _get = lambda digest: store.get(digest, 100)
+        ticks = []
+        timer = task.LoopingCall(lambda: ticks.append(time.time()))
+        def _storm():
+            benchmark.start()
+            timer.start(0.01)
+            # as many at once as the pool will take, over and over
+            d = defer.succeed(None)
+            for i in xrange(0, thumbnails, imaging.pool.limit):
+                batch = digests[i:i + imaging.pool.limit]
+                d.addCallback(lambda ignored, batch=batch: defer.gatherResults(map(_get, batch)))
+            return d
+        def _done(result):
+            ticks.append(time.time())
+            timer.stop()
+            benchmark.stop()
+            print "worst delay %.1fms" % (max(b - a for a, b in zip(ticks, ticks[1:])) * 1000)
+            print imaging.pool.metrics()
+            reactor.stop()
+            return result
+        reactor.callWhenRunning(lambda: _storm().addBoth(_done))
+        reactor.run()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
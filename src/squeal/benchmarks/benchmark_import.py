@@ -0,0 +1,66 @@
+"""
+Benchmark putting a whole playlist in the queue at once and sending the queue
+to a client, for a source whose tracks have not loaded yet, as a spotify
+playlist's have not when it is played.
+
+    python benchmark_import.py [tracks]
+"""
+
+import sys
+import shutil
+import tempfile
+
+from zope.interface import implements
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import text
+
+from squeal import isqueal
+from squeal.event import EventReactor
+from squeal.playlist.service import Playlist
+
+class Track(object):
+
+    implements(isqueal.ITrack)
+
+    track_type = 3
+    is_loaded = False
+    title = artist = album = u"Loading..."
+    duration = 0
+    image_uri = u''
+
+    def __init__(self, provider, tid):
+        self.provider = provider
+        self.track_id = tid
+
+    def player_uri(self, player_id):
+        return u''
+
+class Source(Item):
+
+    namespace = text(default=u"benchmark")
+
+    def get_track(self, tid):
+        return Track(self, tid)
+
+def main(tracks=2000):
+    dbdir = tempfile.mkdtemp()
+    try:
+        s = Store(dbdir + "/import.axiom")
+        EventReactor(store=s)
+        source = Source(store=s)
+        playlist = Playlist(store=s)
+        playlist.activate()
+        benchmark.start()
+        playlist.enqueue(*[Track(source, u"track:%d" % i) for i in xrange(tracks)])
+        playlist.snapshot()
+        benchmark.stop()
+    finally:
+        shutil.rmtree(dbdir)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,51 @@
+
+"""
+Benchmark sending a long queue to a client, which reads the details of every
+track on it. Pass "cold" to empty the track cache before each pass, which is
+how every pass behaved before tracks were cached.
+
+    python benchmark_playlist.py [tracks] [warm|cold]
+"""
+
+import sys
+import shutil
+import tempfile
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+
+from squeal.event import EventReactor
+from squeal.library.service import Library
+from squeal.library.record import Collection, TrackImporter
+from squeal.playlist.service import Playlist
+
+from fixtures import examined
+
+def main(tracks=5000, mode="warm"):
+    tracks = int(tracks)
+    dbdir = tempfile.mkdtemp()
+    try:
+        s = Store(dbdir + "/playlist.axiom")
+        EventReactor(store=s)
+        library = Library(store=s)
+        for iface in library.powerupInterfaces:
+            s.powerUp(library, iface)
+        c = Collection(store=s, pathname=u"/music")
+        created = TrackImporter(c).create(examined(tracks))
+        playlist = Playlist(store=s)
+        playlist.enqueue(*created)
+        benchmark.start()
+        for i in range(5):
+            if mode == "cold":
+                playlist.tracks.clear()
+            playlist.snapshot()
+            for p in playlist:
+                (p.title, p.artist, p.album, p.duration, p.image_uri)
+        benchmark.stop()
+    finally:
+        shutil.rmtree(dbdir)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
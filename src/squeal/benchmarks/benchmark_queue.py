@@ -0,0 +1,51 @@
+"""
+Benchmark editing a long queue: filling it, playing tracks first, moving and
+removing tracks in the middle of it, and clearing it. None of the edits should
+cost more as the queue gets longer.
+
+    python benchmark_queue.py [tracks] [edits]
+"""
+
+import sys
+import shutil
+import tempfile
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+
+from squeal.event import EventReactor
+from squeal.library.service import Library
+from squeal.library.record import Collection, TrackImporter
+from squeal.playlist.service import Playlist
+
+from fixtures import examined
+
+def main(tracks=10000, edits=100):
+    dbdir = tempfile.mkdtemp()
+    try:
+        s = Store(dbdir + "/queue.axiom")
+        EventReactor(store=s)
+        library = Library(store=s)
+        for iface in library.powerupInterfaces:
+            s.powerUp(library, iface)
+        c = Collection(store=s, pathname=u"/music")
+        created = TrackImporter(c).create(examined(tracks))
+        playlist = Playlist(store=s)
+        playlist.activate()
+        benchmark.start()
+        playlist.enqueue(*created)
+        queued = list(playlist)
+        playlist.current = queued[tracks / 2].position
+        for i in xrange(edits):
+            playlist.playfirst(created[i])
+            playlist.move(queued[i], queued[-i - 1])
+            playlist.remove(queued[tracks / 4 + i])
+        playlist.clear()
+        benchmark.stop()
+    finally:
+        shutil.rmtree(dbdir)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,72 @@
+
+"""
+Benchmark rescanning a collection where only a few files have changed. The
+cost should grow with the number of changed files, not the size of the
+collection. The files are copies of the music files the tests use, so the
+changed ones have their tags read again.
+
+    python benchmark_rescan.py <files> <changed> [scan|watch]
+
+Pass "watch" to update just the changed files, as the collection watcher
+does, rather than rescanning the whole collection.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+from twisted.python.util import sibpath
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+
+from squeal.event import EventReactor
+from squeal.library.service import Library
+from squeal.library.record import Collection
+from squeal.library.policies import StandardNamingPolicy
+
+music = [sibpath(__file__, "../library/tests/files/la.%s" % t) for t in ("mp3", "flac", "ogg")]
+
+def main(files=10000, changed=10, mode="scan"):
+    files = int(files)
+    changed = int(changed)
+    root = tempfile.mkdtemp()
+    dbdir = tempfile.mkdtemp()
+    try:
+        pathnames = []
+        for i in xrange(files):
+            d = os.path.join(root, "dir%d" % (i / 100))
+            if not os.path.isdir(d):
+                os.mkdir(d)
+            source = music[i % len(music)]
+            pathname = os.path.join(d, "file%d%s" % (i, os.path.splitext(source)[1]))
+            shutil.copyfile(source, pathname)
+            pathnames.append(pathname.decode("utf-8"))
+        s = Store(dbdir + "/rescan.axiom")
+        EventReactor(store=s)
+        library = Library(store=s, naming_policy=StandardNamingPolicy(store=s))
+        for iface in library.powerupInterfaces:
+            s.powerUp(library, iface)
+        c = Collection(store=s, pathname=root.decode("utf-8"))
+        for x in c._scan():
+            pass
+        for pathname in pathnames[:changed]:
+            # a different mtime is enough for the file to be read again
+            os.utime(pathname, (0, 0))
+        benchmark.start()
+        if mode == "watch":
+            for x in c._update_changed(pathnames[:changed]):
+                pass
+        else:
+            for x in c._scan():
+                pass
+        benchmark.stop()
+    finally:
+        shutil.rmtree(root)
+        shutil.rmtree(dbdir)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,49 @@
+
+"""
+Benchmark library searches, both whole words and the short prefixes sent
+while the user is still typing. The time taken depends on how many tracks
+match, not on the size of the library.
+
+    python benchmark_search.py [tracks]
+"""
+
+import sys
+import random
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+
+from squeal.library.record import Collection, Track, TrackImporter
+from squeal.library.search import SearchIndex
+
+from fixtures import details
+
+words = [u"%s%s" % (a, b) for a in u"bcdfghjklmnprstvwz" for b in
+         (u"ale", u"ine", u"orn", u"usk", u"eep", u"ash", u"ight", u"ove",
+          u"ain", u"ool", u"irt", u"ank", u"oke", u"ume", u"ell", u"idge")]
+
+def title(r):
+    return u" ".join(r.choice(words) for i in range(r.randint(1, 4)))
+
+def random_details(r, i):
+    return details(i, title=title(r), genre=r.choice([u"rock", u"jazz", u"folk", u"electronic"]))
+
+def main(tracks=100000):
+    r = random.Random(0)
+    s = Store("TEMPORARY.axiom")
+    c = Collection(store=s, pathname=u"/music")
+    TrackImporter(c).create([(u"/music/%d.mp3" % i, 1, random_details(r, i)) for i in xrange(tracks)])
+    index = SearchIndex(s)
+    index.index(list(s.query(Track)))
+    benchmark.start()
+    for i in xrange(100):
+        list(index.search(u"b"))
+        list(index.search(u"blo"))
+        list(index.search(u"bale tight"))
+        list(index.search(u"jazz artist 12"))
+    benchmark.stop()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
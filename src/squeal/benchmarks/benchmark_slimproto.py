@@ -0,0 +1,47 @@
+
+"""
+Benchmark parsing the frames a player sends, replaying a stream of STMt
+heartbeats with the odd IR frame mixed in, cut into TCP sized segments so
+frames are split across reads and several arrive in one read.
+
+    python benchmark_slimproto.py [frames] [segment]
+"""
+
+import sys
+import struct
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+
+from squeal.event import EventReactor
+from squeal.net.slimproto import Factory
+
+def frame(operation, data):
+    return operation + struct.pack('!I', len(data)) + data
+
+# a heartbeat as sent by a playing squeezebox, and a volume up
+heartbeat = frame('STAT', 'STMt' + struct.pack('!BBBLLLLHLLLLHLLH', 0, 0, 0, 1 << 20,
+                  1 << 19, 123456, 1 << 16, 0, 1 << 20, 1 << 18, 40000, 40000, 0,
+                  0, 40000, 0))
+ir = frame('IR  ', struct.pack('!IxxI', 1000, 1988722815))
+
+class Service(object):
+
+    def __init__(self):
+        self.evreactor = EventReactor(store=Store())
+        self.players = []
+
+def main(frames=100000, segment=1460):
+    player = Factory(Service()).buildProtocol(None)
+    # log nothing for the heartbeat, as a real one does
+    stream = "".join(ir if i % 100 == 99 else heartbeat for i in xrange(frames))
+    segments = [stream[i:i+segment] for i in xrange(0, len(stream), segment)]
+    benchmark.start()
+    for s in segments:
+        player.dataReceived(s)
+    benchmark.stop()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,39 @@
+
+"""
+Benchmark the initial import of a large number of tracks, spread over a
+realistic number of artists and albums.
+
+    python benchmark_trackimport.py [tracks] [single]
+
+Pass "single" to create the tracks one at a time with Track.create, for
+comparison with the bulk TrackImporter.
+"""
+
+import sys
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+
+from squeal.library.record import Collection, Track, TrackImporter
+
+from fixtures import examined
+
+def main(tracks=10000, mode="bulk"):
+    s = Store("TEMPORARY.axiom")
+    c = Collection(store=s, pathname=u"/music")
+    rows = examined(tracks)
+    benchmark.start()
+    if mode == "single":
+        for pathname, ftype, d in rows:
+            Track.create(c, pathname, ftype, d)
+    else:
+        TrackImporter(c).create(rows)
+    benchmark.stop()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args:
+        args[0] = int(args[0])
+    main(*args)
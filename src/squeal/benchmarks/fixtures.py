@@ -0,0 +1,26 @@
+
+"""
+Made up library tracks shared by the benchmarks. There are ten tracks to an
+album and ten albums to an artist.
+"""
+
+def details(i, **tags):
+    """ The tags of the i'th track, as a naming policy gives them. Keyword
+    arguments replace tags. """
+    d = {
+        'artist': u"artist %d" % (i / 100),
+        'album': u"album %d" % (i / 10),
+        'track': i % 10,
+        'title': u"title %d" % i,
+        'year': u"2010",
+        'genre': u"genre",
+        'comment': None,
+        'duration': 180000,
+    }
+    d.update(tags)
+    return d
+
+def examined(tracks):
+    """ (pathname, ftype, details) for that many mp3s, as TrackImporter.create
+    takes them. """
+    return [(u"/music/%d.mp3" % i, 1, details(i)) for i in xrange(tracks)]
@@ -36,6 +36,18 @@ implemented by the events.
 
 Additional interfaces can be added to an event as needed at the time it is fired.
 
+Coalescing events
+=================
+
+A subscriber that does something expensive with each event, like reloading a
+page element, can ask for its handler to be called at most once a second:
+
+>         evr.subscribe(self.handleFooEvent, IFooEvent, interval=1)
+
+Events that arrive within the interval are held back and delivered together
+when it is up. If the held events have a merge method they are merged into
+one (see ChangeEvent), otherwise only the most recent is delivered.
+
 Sending events
 ==============
 
@@ -90,9 +102,94 @@ class EventSubscription(object):
                 return False
         return True
 
+    def matches(self, provided):
+        """ Whether events providing the set of interfaces provided are for
+        this subscription. """
+        for i in self.ifaces:
+            if i not in provided:
+                return False
+        return True
+
     def unsubscribe(self):
         self.evreactor.unsubscribe(self)
 
+    def stop(self):
+        """ Called when the subscription is removed. """
+
+def merge(held, event):
+    """ Combine an event that is being held back with one that has just
+    arrived. """
+    if held.__class__ is event.__class__ and hasattr(held, 'merge'):
+        return held.merge(event)
+    return event
+
+def union(first, second):
+    """ The items in first and then second, without duplicates. """
+    items = list(first)
+    seen = set(items)
+    for i in second:
+        if i not in seen:
+            seen.add(i)
+            items.append(i)
+    return items
+
+class ChangeEvent(object):
+
+    """ An event listing the items that have been added, removed or changed.
+    Coalesced change events are merged into one listing all of them. """
+
+    def __init__(self, added=(), removed=(), changed=(), playing=None):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.playing = playing
+
+    def merge(self, later):
+        merged = copy.copy(later)
+        merged.added = union(self.added, later.added)
+        merged.removed = union(self.removed, later.removed)
+        merged.changed = union(self.changed, later.changed)
+        return merged
+
+class CoalescedSubscription(EventSubscription):
+
+    """ A subscription whose handler is called at most once every interval
+    seconds. The first event is delivered straight away, and anything fired
+    in the interval after it is held back and delivered, merged into one
+    event, once the interval is up. """
+
+    clock = reactor
+
+    def __init__(self, evreactor, handler, interval, *ifaces):
+        EventSubscription.__init__(self, evreactor, self.deliver, *ifaces)
+        self.target = handler
+        self.interval = interval
+        self.held = None
+        self.timer = None
+
+    def deliver(self, event):
+        if self.timer is not None:
+            if self.held is None:
+                self.held = event
+            else:
+                self.held = merge(self.held, event)
+            return
+        self.timer = self.clock.callLater(self.interval, self.flush)
+        return self.target(event)
+
+    def flush(self):
+        self.timer = None
+        event, self.held = self.held, None
+        if event is not None:
+            d = defer.maybeDeferred(self.deliver, event)
+            d.addErrback(log.err, "Error handling %s" % event.__class__.__name__)
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.held = None
+
 class EventReactor(Item, service.Service):
     implements(IEventReactor)
     powerupInterfaces = (IEventReactor, service.IService)
@@ -102,32 +199,69 @@ class EventReactor(Item, service.Service):
     name = inmemory()
     parent = inmemory()
     subscribers = inmemory()
+    # the subscriptions for each kind of event, see _subscriptionsFor
+    dispatch = inmemory()
 
     def activate(self):
         self.subscribers = []
+        self.dispatch = {}
+
+    def _subscriptionsFor(self, event, interfaces):
+        """ Return the subscriptions for the event. Which subscriptions want
+        an event depends only on the interfaces it provides, which come from
+        its class and any interfaces added when it was fired, so the answer
+        is worked out once for each of those and kept until the subscribers
+        change. """
+        key = (event.__class__, interfaces)
+        subscriptions = self.dispatch.get(key)
+        if subscriptions is None:
+            provided = set(providedBy(event).flattened())
+            subscriptions = [s for s in self.subscribers if s.matches(provided)]
+            self.dispatch[key] = subscriptions
+        return subscriptions
 
-    @defer.inlineCallbacks
     def _fireEvent(self, event, *interfaces):
         """ Fire the specified event. You can optionally provide additional
-        interfaces that will be added to the event before firing. """
+        interfaces that will be added to the event before firing.
+
+        Handlers are called in the order they subscribed. A handler that
+        returns a Deferred does not hold up the others. Returns a Deferred
+        that fires once they have all finished, or None if no handler
+        returned a Deferred. """
         if 'SQUEAL_DEBUG' in os.environ:
             log.msg("Firing Event: %s [%s] [%s]" % (event.__class__.__name__, ",".join(x.__name__ for x in providedBy(event)), ",".join(x.__name__ for x in interfaces)), system="squeal.event.EventReactor")
         if interfaces:
             event = copy.copy(event)
             alsoProvides(event, *interfaces)
-        for s in self.subscribers:
-            call = yield defer.maybeDeferred(s.condition, event)
-            if call:
-                yield defer.maybeDeferred(s.handler, event)
+        pending = []
+        for s in self._subscriptionsFor(event, interfaces):
+            try:
+                result = s.handler(event)
+            except Exception:
+                log.err(None, "Error handling %s" % event.__class__.__name__)
+            else:
+                if isinstance(result, defer.Deferred):
+                    pending.append(result.addErrback(log.err, "Error handling %s" % event.__class__.__name__))
+        if pending:
+            return defer.DeferredList(pending)
 
     def fireEvent(self, event, *interfaces):
         reactor.callLater(0, self._fireEvent, event, *interfaces)
 
-    def subscribe(self, handler, *ifaces):
-        subscription = EventSubscription(self, handler, *ifaces)
+    def subscribe(self, handler, *ifaces, **kw):
+        """ Call handler with each event that provides all of ifaces. If an
+        interval is given, the handler is called at most once every interval
+        seconds, see CoalescedSubscription. """
+        interval = kw.pop('interval', None)
+        if interval is None:
+            subscription = EventSubscription(self, handler, *ifaces)
+        else:
+            subscription = CoalescedSubscription(self, handler, interval, *ifaces)
         self.subscribers.append(subscription)
+        self.dispatch = {}
         return subscription
 
     def unsubscribe(self, subscription):
         self.subscribers.remove(subscription)
-
+        self.dispatch = {}
+        subscription.stop()
@@ -0,0 +1,134 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Image processing away from the reactor. Scaling cover art and laying out
+text for the players' displays is slow enough that a burst of it would hold
+up everything else, so it is done in a few threads of its own. Only so much
+work is allowed to queue up. Beyond that it is refused straight away, so a
+page asking for hundreds of thumbnails gets some of them back as errors
+rather than all of them late. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+import time
+import multiprocessing
+
+from twisted.internet import reactor, defer, threads
+from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+class Busy(Exception):
+    """ There is already as much work queued as the pool will take """
+
+class ImagePool(object):
+
+    """ Runs functions in at most size threads, with no more than limit of
+    them waiting or running at once. Counts are kept of what it has done, for
+    metrics. """
+
+    def __init__(self, size=None, limit=64, reactor=reactor):
+        if size is None:
+            size = multiprocessing.cpu_count()
+        self.size = size
+        self.limit = limit
+        self.reactor = reactor
+        self.threadpool = None
+        # work by key, see once
+        self.pending = {}
+        self.queued = 0
+        self.peak = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        # seconds spent waiting for a thread, and running in one
+        self.waiting = 0.0
+        self.working = 0.0
+
+    def start(self):
+        if self.threadpool is None:
+            self.threadpool = ThreadPool(0, self.size, "squeal.imaging")
+            self.threadpool.start()
+            self.reactor.addSystemEventTrigger("during", "shutdown", self.stop)
+
+    def stop(self):
+        if self.threadpool is not None:
+            threadpool, self.threadpool = self.threadpool, None
+            threadpool.stop()
+
+    def run(self, f, *args, **kwargs):
+        """ Call f in a thread, returning a deferred that fires with what it
+        returns. The deferred fails with Busy if the pool is full. """
+        if self.queued >= self.limit:
+            self.rejected += 1
+            log.msg("%d images queued, refusing any more" % self.queued, system="squeal.imaging.ImagePool")
+            return defer.fail(Busy())
+        self.start()
+        self.queued += 1
+        self.peak = max(self.peak, self.queued)
+        self.submitted += 1
+        submitted = time.time()
+        times = []
+        def _work():
+            started = time.time()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                times.append((started - submitted, time.time() - started))
+        def _done(result):
+            self.queued -= 1
+            for waited, worked in times:
+                self.waiting += waited
+                self.working += worked
+            if isinstance(result, Failure):
+                self.failed += 1
+            else:
+                self.completed += 1
+            return result
+        d = threads.deferToThreadPool(self.reactor, self.threadpool, _work)
+        return d.addBoth(_done)
+
+    def once(self, key, f, *args, **kwargs):
+        """ As run, except that while work for key is running, more work for
+        the same key is not started. It gets the result of the first. """
+        d = defer.Deferred()
+        if key in self.pending:
+            self.pending[key].append(d)
+            return d
+        self.pending[key] = [d]
+        def _done(result):
+            for waiting in self.pending.pop(key):
+                waiting.callback(result)
+        self.run(f, *args, **kwargs).addBoth(_done)
+        return d
+
+    def metrics(self):
+        return {
+            'size': self.size,
+            'limit': self.limit,
+            'queued': self.queued,
+            'peak': self.peak,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'waiting': self.waiting,
+            'working': self.working,
+        }
+
+# shared by everything that processes images
+pool = ImagePool()
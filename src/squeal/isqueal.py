@@ -47,6 +47,17 @@ class IPlaylist(Interface):
         """ Add the specified track to the end of the playlist. The Track
         should provide the ISerializableTrack interface. """
 
+    def insert(tracks, after=None):
+        """ Put the tracks in the playlist after the PlayTrack after, or at
+        the start if after is None. """
+
+    def remove(*playtracks):
+        """ Take the PlayTracks out of the playlist. """
+
+    def move(playtrack, after=None):
+        """ Move the PlayTrack so it follows the PlayTrack after, or is at the
+        start of the playlist if after is None. """
+
 class IWebService(Interface):
     """ The web service, that manages the creation of the web site. """
 
@@ -75,7 +86,11 @@ class IPlayMusic(Interface):
     service which needs to go load a track. """
 
     def play(track):
-        """ Play the specified track """
+        """ Play the specified track. Returns the players it was sent to. """
+
+    def queue(track):
+        """ Play the specified track as soon as the one playing finishes.
+        Returns the players it was queued on. """
 
 
 # Player events
@@ -118,6 +133,8 @@ class ILibraryChangeEvent(Interface):
     added = Attribute(""" A list of tracks that have been added """)
     removed = Attribute(""" A list of tracks that have been removed """)
     changed = Attribute(""" A list of tracks that have changed """)
+    provider = Attribute(""" The track source the tracks come from. Removed
+    tracks are no longer in a store, so they cannot say themselves """)
 
 class IPlaylistEvent(Interface):
 
@@ -157,6 +174,14 @@ class ITrackSource(Interface):
         """ Return an object conforming to ITrack that corresponds to the
         referenced track identifier """
 
+class ITrackPrefetcher(Interface):
+
+    """ A source of tracks that can get a track ready to play before it is
+    needed, so that it starts straight away """
+
+    def prefetch(tid):
+        """ Get the referenced track ready to play """
+
 class ISquealPlugin(IPlugin):
     """ A plugin for squeal """
 
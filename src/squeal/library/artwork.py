@@ -0,0 +1,298 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Cover art for the local library. Pictures are found while the library is
+scanned, either embedded in the files themselves (an ID3 APIC frame or a FLAC
+PICTURE block) or as an image such as folder.jpg alongside them. Each picture
+is stored once, named by the hash of its contents, however many tracks and
+albums it turns up in. Thumbnails are made the first time each size is asked
+for, away from the reactor, and kept on disk as well. Sizes are rounded up to
+one of a few buckets, so there are only ever a handful of thumbnails of each
+picture. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+import os
+import struct
+import hashlib
+from StringIO import StringIO
+
+import Image
+
+from twisted.internet import defer
+
+from squeal import imaging
+
+# images in an album's directory that are taken to be its cover, best first
+folder_images = ('cover.jpg', 'folder.jpg', 'front.jpg', 'album.jpg',
+                 'cover.png', 'folder.png', 'front.png', 'album.png')
+
+# the ID3 picture type of the front cover
+FRONT_COVER = 3
+
+def syncsafe(data):
+    """ An ID3v2 syncsafe integer, which has seven bits in each byte. """
+    value = 0
+    for c in data:
+        value = (value << 7) | (ord(c) & 0x7f)
+    return value
+
+def skip_string(data, offset, encoding):
+    """ The offset just after the terminated string at offset, in the ID3
+    text encoding given. UTF-16 strings end with two nul bytes on an even
+    boundary. """
+    if encoding in (1, 2):
+        while offset + 1 < len(data) and data[offset:offset + 2] != "\0\0":
+            offset += 2
+        return offset + 2
+    end = data.find("\0", offset)
+    if end == -1:
+        return len(data)
+    return end + 1
+
+def id3_picture(f):
+    """ The cover picture from the ID3v2 tag at the start of f, or None. f is
+    left at the end of the tag. """
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != "ID3":
+        f.seek(0)
+        return None
+    version, flags = ord(header[3]), ord(header[5])
+    tag = f.read(syncsafe(header[6:10]))
+    if version < 4 and flags & 0x80:
+        # unsynchronisation applies to the whole tag before 2.4
+        tag = tag.replace("\xff\x00", "\xff")
+    offset = 0
+    if flags & 0x40 and version >= 3:
+        # an extended header, which is of no interest
+        if version == 3:
+            offset = 4 + struct.unpack(">I", tag[:4])[0]
+        else:
+            offset = syncsafe(tag[:4])
+    if version == 2:
+        id_size, header_size, wanted = 3, 6, "PIC"
+    else:
+        id_size, header_size, wanted = 4, 10, "APIC"
+    pictures = []
+    while offset + header_size <= len(tag):
+        frame_id = tag[offset:offset + id_size]
+        if not frame_id.strip("\0"):
+            # padding
+            break
+        if version == 2:
+            size = struct.unpack(">I", "\0" + tag[offset + 3:offset + 6])[0]
+        elif version == 3:
+            size = struct.unpack(">I", tag[offset + 4:offset + 8])[0]
+        else:
+            size = syncsafe(tag[offset + 4:offset + 8])
+        start = offset + header_size
+        offset = start + size
+        if frame_id != wanted:
+            continue
+        frame = tag[start:offset]
+        if version == 4:
+            frame_flags = ord(tag[start - 1])
+            if frame_flags & 0x01:
+                # a data length indicator
+                frame = frame[4:]
+            if frame_flags & 0x02:
+                frame = frame.replace("\xff\x00", "\xff")
+        if not frame:
+            continue
+        encoding = ord(frame[0])
+        if version == 2:
+            # a three letter image format rather than a mime type
+            i = 4
+        else:
+            i = skip_string(frame, 1, 0)
+        picture_type = ord(frame[i:i + 1] or "\0")
+        i = skip_string(frame, i + 1, encoding)
+        pictures.append((picture_type != FRONT_COVER, len(pictures), frame[i:]))
+    if pictures:
+        return min(pictures)[2]
+    return None
+
+def flac_picture(f):
+    """ The cover picture from the metadata blocks of the FLAC file f, or
+    None. """
+    if f.read(4) != "fLaC":
+        return None
+    pictures = []
+    last = False
+    while not last:
+        header = f.read(4)
+        if len(header) < 4:
+            break
+        last = ord(header[0]) & 0x80
+        block_type = ord(header[0]) & 0x7f
+        size = struct.unpack(">I", "\0" + header[1:])[0]
+        if block_type != 6:
+            f.seek(size, os.SEEK_CUR)
+            continue
+        block = f.read(size)
+        picture_type, length = struct.unpack(">II", block[:8])
+        i = 8 + length
+        length = struct.unpack(">I", block[i:i + 4])[0]
+        # the description, then width, height, depth and colours
+        i += 4 + length + 16
+        length = struct.unpack(">I", block[i:i + 4])[0]
+        pictures.append((picture_type != FRONT_COVER, len(pictures), block[i + 4:i + 4 + length]))
+    if pictures:
+        return min(pictures)[2]
+    return None
+
+def embedded_picture(pathname):
+    """ The picture embedded in the music file, or None. """
+    f = open(pathname, "rb")
+    try:
+        picture = id3_picture(f)
+        if picture is None:
+            # FLAC files sometimes have an ID3 tag in front of them as well
+            picture = flac_picture(f)
+        return picture
+    finally:
+        f.close()
+
+def folder_picture(dirpath):
+    """ The cover image in the directory, or None. """
+    try:
+        names = dict((n.lower(), n) for n in os.listdir(dirpath))
+    except OSError:
+        return None
+    for name in folder_images:
+        if name in names:
+            with open(os.path.join(dirpath, names[name]), "rb") as f:
+                return f.read()
+    return None
+
+# how each kind of picture starts
+signatures = [
+    ("\xff\xd8", "image/jpeg"),
+    ("\x89PNG", "image/png"),
+    ("GIF8", "image/gif"),
+]
+
+def content_type(data):
+    """ The content type of the picture, from the first few bytes of it. """
+    for signature, ctype in signatures:
+        if data.startswith(signature):
+            return ctype
+    return "application/octet-stream"
+
+class ArtworkStore(object):
+
+    """ Pictures, and thumbnails of them, kept in directory. Both are named
+    by the sha1 of the picture, which is what the library records as the
+    artwork of an album. """
+
+    # the sizes thumbnails are made in
+    sizes = (32, 64, 128, 256, 512)
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not directory.exists():
+            directory.makedirs()
+
+    def path(self, digest, size=None):
+        if size is None:
+            return self.directory.child(digest[:2]).child(digest)
+        return self.directory.child(str(size)).child(digest[:2]).child(digest)
+
+    def write(self, path, data):
+        """ Put data in path in one go, so that readers in other processes
+        never see part of it. """
+        parent = path.parent()
+        if not parent.exists():
+            try:
+                parent.makedirs()
+            except OSError:
+                # someone else got there first
+                pass
+        temp = path.temporarySibling()
+        temp.setContent(data)
+        temp.moveTo(path)
+
+    def add(self, data):
+        """ Keep the picture, if we do not already have it, and return its
+        digest. """
+        digest = hashlib.sha1(data).hexdigest()
+        path = self.path(digest)
+        if not path.exists():
+            self.write(path, data)
+        return digest
+
+    def extract(self, pathname, folders=None):
+        """ Find the picture for a music file, either in the file itself or
+        in its directory, and return its digest, or None if there is not one.
+        folders, if given, is a dictionary of the digest found for each
+        directory, so that a scan reads each directory's picture only once.
+        """
+        try:
+            picture = embedded_picture(pathname)
+        except (IOError, OSError, struct.error):
+            picture = None
+        if picture:
+            return self.add(picture)
+        dirpath = os.path.dirname(pathname)
+        if folders is not None and dirpath in folders:
+            return folders[dirpath]
+        picture = folder_picture(dirpath)
+        digest = None
+        if picture:
+            digest = self.add(picture)
+        if folders is not None:
+            folders[dirpath] = digest
+        return digest
+
+    def bucket(self, size):
+        """ The smallest thumbnail size at least as big as size. """
+        for s in self.sizes:
+            if s >= size:
+                return s
+        return self.sizes[-1]
+
+    def get(self, digest, size=None):
+        """ Returns a deferred that fires with the picture, or a thumbnail of
+        it no smaller than size, as a FilePath, or with None if we do not have
+        the picture. Thumbnails that are not there already are made in the
+        image pool. """
+        original = self.path(digest)
+        if not original.exists():
+            return defer.succeed(None)
+        if size is None:
+            return defer.succeed(original)
+        size = self.bucket(size)
+        path = self.path(digest, size)
+        if path.exists():
+            return defer.succeed(path)
+        return imaging.pool.once(path.path, self.make, original, path, size)
+
+    def make(self, original, path, size):
+        """ Write a thumbnail of the picture to path. This runs in a thread.
+        """
+        self.write(path, self.thumbnail(original.getContent(), size))
+        return path
+
+    def thumbnail(self, data, size):
+        """ The picture scaled down to fit in a square of size, as a PNG. """
+        image = Image.open(StringIO(data))
+        if image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+            # CMYK jpegs, for instance
+            image = image.convert("RGB")
+        image.thumbnail([size, size], Image.ANTIALIAS)
+        s = StringIO()
+        image.save(s, "PNG")
+        return s.getvalue()
@@ -22,6 +22,8 @@ __version__ = '$Revision$'[11:-2]
 from zope.interface import Interface, Attribute
 from twisted.plugin import IPlugin
 
+from squeal import isqueal
+
 
 class ILibrary(Interface):
     """ The music library management service. """
@@ -40,6 +42,10 @@ class ILibrary(Interface):
     def rescan():
         """ Rescan every track in the library """
 
+    def search(query, limit=50):
+        """ Return up to limit tracks with a word starting with each word in
+        query, sorted by title. """
+
 class INamingPolicy(Interface):
 
     """ Returns a set of details on a track. Different policies will make
@@ -48,11 +54,15 @@ class INamingPolicy(Interface):
     def details(collection, pathname):
         """ returns a dictionary of track details """
 
+    def merge(collection, pathname, tags):
+        """ returns a dictionary of track details, given the tags that have
+        already been read from the file (or None if it has no tags). """
+
 class ILibraryEvent(Interface):
 
     """ Any event that represents a change to the library """
 
-class ILibraryChangeEvent(Interface):
+class ILibraryChangeEvent(isqueal.ILibraryChangeEvent):
 
     """ The library has changed.  This provides a list of all the tracks that have changed or been removed """
 
@@ -33,23 +33,62 @@ Library.Widget.methods(
 );
 
 Library.Main = Library.Widget.subclass("Library.Main");
-Library.Artists = Library.Widget.subclass("Library.Artists");
-Library.Albums = Library.Widget.subclass("Library.Albums");
-Library.Tracks = Library.Widget.subclass("Library.Tracks");
+Library.Browser = Library.Widget.subclass("Library.Browser");
+Library.Artists = Library.Browser.subclass("Library.Artists");
+Library.Albums = Library.Browser.subclass("Library.Albums");
+Library.Tracks = Library.Browser.subclass("Library.Tracks");
 
 Library.Main.methods(
 
     function __init__(self, widgetNode) {
         Library.Main.upcall(self, "__init__", widgetNode);
-        $(widgetNode).find('li.playable').hover(
-            function(){
-                Squeal.W.playactions.proxy_to = self;
-                $(this).append($('#play-actions'));
-            },
-            function(){
-                $(this).find('div.actions:last').remove();
+        // live, because the browse lists grow as the user scrolls
+        $('li.playable', widgetNode).live('mouseenter', function(){
+            Squeal.W.playactions.proxy_to = self;
+            $(this).append($('#play-actions'));
+        }).live('mouseleave', function(){
+            $(this).find('div.actions:last').remove();
+        });
+        var form = $(widgetNode).find('form.search');
+        form.find('input.text').keyup(function() {
+            // wait for a pause in typing before searching
+            clearTimeout(self.searchTimer);
+            self.searchTimer = setTimeout(function() {
+                self.search();
+            }, 200);
+        });
+        form.find('input.button').click(function() {
+            self.search();
+        });
+        form.submit(function(ev) {
+            ev.preventDefault();
+            self.search();
+        });
+    },
+
+    function search(self) {
+        var query = $(self.node).find('form.search input.text').val();
+        var results = $(self.node).find('ul.search-results');
+        if(query == self.lastQuery) {
+            return;
+        }
+        self.lastQuery = query;
+        var d = self.callRemote("search", query);
+        d.addCallback(function(tracks) {
+            // a later search may have finished first
+            if(query != self.lastQuery) {
+                return;
             }
-        );
+            results.empty();
+            $.each(tracks, function(i, track) {
+                var a = $('<a href="#"></a>').attr('id', track.id).text(track.title);
+                var li = $('<li class="playable"></li>').append(a);
+                if(track.artist) {
+                    li.append($('<span class="artist"></span>').text(track.artist));
+                }
+                results.append(li);
+            });
+        });
     },
 
     function play(self, node, ev) {
@@ -71,6 +110,57 @@ Library.Main.methods(
     }
 );
 
+Library.Browser.methods(
+
+    function __init__(self, widgetNode) {
+        Library.Browser.upcall(self, "__init__", widgetNode);
+        self.loading = false;
+        $(window).scroll(function() {
+            self.checkMore();
+        });
+        $(widgetNode).find('ul').click(function(ev) {
+            if($(ev.target).parents('li.more').length) {
+                ev.preventDefault();
+                self.loadMore();
+            }
+        });
+    },
+
+    function checkMore(self) {
+        // fetch the next page when the end of the list scrolls into view
+        var more = $(self.node).find('li.more');
+        if(more.length && more.is(':visible') &&
+           more.offset().top < $(window).scrollTop() + $(window).height()) {
+            self.loadMore();
+        }
+    },
+
+    function loadMore(self) {
+        if(self.loading) {
+            return;
+        }
+        var more = $(self.node).find('li.more');
+        var after = more.prev().find('a').attr('id');
+        self.loading = true;
+        var d = self.callRemote("more", after);
+        d.addCallback(function(result) {
+            $.each(result.items, function(i, item) {
+                var a = $('<a href="#"></a>').attr('id', item.id).text(item.name);
+                $('<li class="playable"></li>').append(a).insertBefore(more);
+            });
+            if(!result.more) {
+                more.remove();
+            }
+            self.loading = false;
+        });
+        d.addErrback(function(err) {
+            // let the next scroll try again
+            self.loading = false;
+            return err;
+        });
+    }
+);
+
 Library.Albums.methods(
 
     function click(self, node, ev) {
@@ -97,11 +97,14 @@ class StandardNamingPolicy(Item, StandardPolicyMixin):
     wins = text(default=u'path') # who wins.  "path" or "tags"
 
     def details(self, collection, pathname):
-        pathd = self.detailsFromPath(os.path.join(collection.pathname, pathname))
         try:
             tagsd = self.detailsFromTags(pathname)
         except ValueError:
             tagsd = None
+        return self.merge(collection, pathname, tagsd)
+
+    def merge(self, collection, pathname, tagsd):
+        pathd = self.detailsFromPath(os.path.join(collection.pathname, pathname))
         details = {}
         for t in self.tags:
             if tagsd is None:
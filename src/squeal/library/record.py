@@ -25,17 +25,19 @@ import stat
 
 from zope.interface import Interface, implements
 
-from twisted.internet import reactor
 from twisted.internet import defer
+from twisted.internet import task
 from twisted.python.components import Adapter, registerAdapter
 from twisted.python import log
 
-from axiom.item import Item
-from axiom.attributes import text, timestamp, path, reference, integer, AND, inmemory
+from axiom.item import Item, declareLegacyItem
+from axiom.attributes import text, timestamp, path, reference, integer, boolean, AND, OR, inmemory, compoundIndex
+from axiom.upgrade import registerAttributeCopyingUpgrader
 from epsilon.extime import Time
 
 from squeal.isqueal import *
 from squeal.adaptivejson import IJsonAdapter
+from squeal.event import ChangeEvent
 
 from ilibrary import *
 
@@ -43,15 +45,40 @@ from ilibrary import *
 magicdb = magic.open(magic.MAGIC_NONE)
 magicdb.load()
 
-class LibraryChangeEvent(object):
+filetypes = {
+    'ogg': 0,
+    'mp3': 1,
+    'flac': 2,
+    'wav': 3
+}
+
+def file_type(pathname):
+    """ Return our internal representation of the music file type for the
+    file at pathname, or None if it is not a music file we know about. """
+    mtype = magicdb.file(pathname.encode('utf-8')).lower()
+    if 'ogg' in mtype:
+        mtype = 'ogg'
+    elif 'flac' in mtype:
+        mtype = 'flac'
+    elif 'mp3' in mtype:
+        mtype = 'mp3'
+    elif 'mpeg' in mtype:
+        mtype = 'mp3'
+    elif 'audio file with id3' in mtype:
+        mtype = 'mp3'
+    elif 'wave' in mtype:
+        mtype = 'wav'
+    else:
+        mtype = None
+    return filetypes.get(mtype, None)
+
+class LibraryChangeEvent(ChangeEvent):
 
     implements(ILibraryChangeEvent)
 
-    def __init__(self, added=(), removed=(), changed=(), playing=None):
-        self.added = added
-        self.removed = removed
-        self.changed = changed
-        self.playing = playing
+    def __init__(self, provider=None, **kw):
+        ChangeEvent.__init__(self, **kw)
+        self.provider = provider
 
 class Collection(Item):
 
@@ -59,94 +86,342 @@ class Collection(Item):
 
     implements(ICollection)
 
+    schemaVersion = 2
+
     # the pathname to the root of the collection
     pathname = text()
     # the date of the last update run
     last = timestamp()
+    # whether a scan has recorded every file in the FileRecord index
+    indexed = boolean(default=False)
     # number of files to process before yielding to the reactor loop
     files_per_loop = 20
 
-    filetypes = {
-        'ogg': 0,
-        'mp3': 1,
-        'flac': 2,
-        'wav': 3
-    }
+    filetypes = filetypes
 
     def update(self, pathname, ftype, details):
         """ Update a track in the database, based on it's filetype and the
-        details we can extract from it's path or tags. """
-        for track in self.store.query(Track, Track.pathname == pathname):
-            # we should make updating an option
-            #track.update(details)
-            break
-        else:
-            Track.create(self, pathname, ftype, details)
+        details we can extract from it's path or tags. Returns the track. """
+        return self.update_details([(pathname, ftype, details)]).get(pathname)
 
     @property
     def library(self):
         for l in self.store.powerupsFor(ILibrary):
             return l
 
-    def _generate_changed_paths(self):
-        """ Generator of all pathnames within this collection that have been
-        created or updated since the collection was last updated. """
-        for (dirpath, dirnames, filenames) in os.walk(self.pathname):
-            for filename in filenames:
-                pathname = os.path.join(dirpath, filename)
-                if self.is_new_file(pathname):
-                    yield pathname
+    @property
+    def scanner(self):
+        """ The library's pool of scanner processes, if it is running. """
+        library = self.library
+        if library is not None:
+            return library.scanner
+
+    def _load_index(self):
+        """ Return a dictionary of pathname to FileRecord, for every file we
+        have seen in this collection. """
+        return dict((r.pathname, r) for r in
+                    self.store.query(FileRecord, FileRecord.collection == self))
+
+    def _changed_files(self, dirpath, filenames, index, upgrading=False):
+        """ Return the pathnames in a single directory that are new or have
+        changed since we last recorded them.  Every file that is found is
+        removed from the index, so once the whole tree has been examined the
+        index holds only those files that have been deleted from disk.
+
+        If upgrading is true then the collection was scanned before we kept
+        an index, and files older than that scan are recorded as they are
+        rather than being examined again. """
+        changed = []
+        for filename in filenames:
+            pathname = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(pathname)
+            except OSError:
+                # probably a dangling symlink
+                continue
+            record = index.pop(pathname, None)
+            if record is None:
+                if upgrading and not self.is_new_file(pathname, st):
+                    track = self.store.findFirst(Track, Track.pathname == pathname)
+                    self.record_file(pathname, track, st)
+                else:
+                    changed.append(pathname)
+            elif record.is_stale(st):
+                changed.append(pathname)
+        return changed
 
     def file_type(self, pathname):
         """ Return our internal representation of the music file type for the
         file at pathname. """
-        mtype = magicdb.file(pathname.encode('utf-8')).lower()
-        if 'ogg' in mtype:
-            mtype = 'ogg'
-        elif 'flac' in mtype:
-            mtype = 'flac'
-        elif 'mp3' in mtype:
-            mtype = 'mp3'
-        elif 'mpeg' in mtype:
-            mtype = 'mp3'
-        elif 'audio file with id3' in mtype:
-            mtype = 'mp3'
-        elif 'wave' in mtype:
-            mtype = 'wav'
-        else:
-            mtype = None
-        log.msg("Found file %s of type %s" % (pathname, mtype), system="squeal.library.record.Collection")
-        return self.filetypes.get(mtype, None)
+        ftype = file_type(pathname)
+        log.msg("Found file %s of type %s" % (pathname, ftype), system="squeal.library.record.Collection")
+        return ftype
 
-    def is_new_file(self, pathname):
+    def is_new_file(self, pathname, st=None):
         """ Is this file newer than the last time the collection was scanned? """
         if self.last is not None:
+            if st is None:
+                st = os.stat(pathname)
             timestamp = self.last.asPOSIXTimestamp()
-            if os.stat(pathname)[stat.ST_MTIME] < timestamp:
+            if st[stat.ST_MTIME] < timestamp:
                 return False
         return True
 
-    def update_path(self, pathname):
-        """ Update a database entry for a specified pathname. """
-        ftype = self.file_type(pathname)
-        if ftype is not None:
-            details = self.library.naming_policy.details(self, pathname)
-            self.update(pathname, ftype, details)
+    def record_file(self, pathname, track=None, st=None, record=None):
+        """ Record the current state of the file on disk, so that we can tell
+        if it has changed on the next scan. record is the file's FileRecord,
+        if the caller has already looked it up. """
+        if st is None:
+            st = os.stat(pathname)
+        if record is None:
+            record = self.store.findFirst(FileRecord, AND(FileRecord.collection == self,
+                                                          FileRecord.pathname == pathname))
+        if record is None:
+            record = FileRecord(store=self.store, collection=self, pathname=pathname)
+        if track is not None:
+            record.track = track
+        record.record(st)
+        return record
+
+    def find(self, itemType, pathnames):
+        """ The items of itemType in this collection that have one of the
+        pathnames, by pathname. They are looked up a chunk at a time. """
+        found = {}
+        chunk_size = TrackImporter.chunk_size
+        for i in range(0, len(pathnames), chunk_size):
+            for item in self.store.query(itemType, AND(itemType.collection == self,
+                                                       itemType.pathname.oneOf(pathnames[i:i+chunk_size]))):
+                found[item.pathname] = item
+        return found
+
+    def update_paths(self, pathnames, importer=None):
+        """ Examine each file and update the database, creating any new
+        tracks in bulk. """
+        examined = []
+        folders = {}
+        for pathname in pathnames:
+            details = None
+            ftype = self.file_type(pathname)
+            if ftype is not None:
+                details = self.library.naming_policy.details(self, pathname)
+                details['artwork'] = self.library.artwork.extract(pathname, folders)
+            examined.append((pathname, ftype, details))
+        self.update_details(examined, importer)
+
+    def update_examined(self, results, importer=None):
+        """ Update database entries from the results of examining files in
+        a scanner process. results is a list of (pathname, ftype, tags,
+        artwork), where artwork is the digest of the file's cover art. """
+        examined = []
+        for pathname, ftype, tags, artwork in results:
+            details = None
+            if ftype is not None:
+                details = self.library.naming_policy.merge(self, pathname, tags)
+                details['artwork'] = artwork
+            examined.append((pathname, ftype, details))
+        self.update_details(examined, importer)
+
+    def update_details(self, examined, importer=None):
+        """ Update the database from a list of (pathname, ftype, details).
+        Existing tracks are updated in place, and new tracks are handed to
+        the importer to be created in one go. A single LibraryChangeEvent is
+        fired for all of them. Returns the tracks by pathname. """
+        if importer is None:
+            importer = TrackImporter(self)
+        pathnames = [pathname for pathname, ftype, details in examined]
+        tracks = self.find(Track, pathnames)
+        records = self.find(FileRecord, pathnames)
+        new = []
+        changed = []
+        for pathname, ftype, details in examined:
+            if ftype is None or details is None:
+                continue
+            track = tracks.get(pathname)
+            if track is None:
+                new.append((pathname, ftype, details))
+            else:
+                track.update(details)
+                importer.artwork(track.album, details.get('artwork'))
+                changed.append(track)
+        for track in importer.create(new, changed):
+            tracks[track.pathname] = track
+        for pathname, ftype, details in new:
+            if pathname in tracks:
+                importer.artwork(tracks[pathname].album, details.get('artwork'))
+        for pathname, ftype, details in examined:
+            # non-music files are recorded too, so we don't examine them again
+            record = records.get(pathname)
+            if record is None:
+                record = FileRecord(store=self.store, collection=self, pathname=pathname)
+            self.record_file(pathname, tracks.get(pathname), record=record)
+        return tracks
+
+    def remove_files(self, records):
+        """ Forget about files that are no longer on disk, along with any
+        tracks that were created from them. """
+        removed = [r.track for r in records if r.track is not None]
+        if removed:
+            for r in self.store.powerupsFor(IEventReactor):
+                r.fireEvent(LibraryChangeEvent(self.library, removed=removed))
+        for record in records:
+            record.deleteFromStore()
+        for track in removed:
+            track.deleteFromStore()
+
+    def _process(self, pathnames, scanner=None, importer=None):
+        """ Examine and store a batch of changed files. If we have a scanner
+        the files are examined in another process, and a deferred is returned
+        that fires once the results have been stored. """
+        if scanner is None:
+            self.store.transact(self.update_paths, pathnames, importer)
+            return None
+        def _store(results):
+            self.store.transact(self.update_examined, results, importer)
+        def _local(failure):
+            log.err(failure, "Scanner failed, examining files locally", system="squeal.library.record.Collection")
+            self.store.transact(self.update_paths, pathnames, importer)
+        d = scanner.examine(pathnames).addCallbacks(_store, _local)
+        return d.addErrback(log.err, "Unable to store examined files", system="squeal.library.record.Collection")
+
+    def _scan(self, scanner=None):
+        """ Examine the collection a directory at a time, yielding between
+        each one. Only files that have been added, changed or removed since
+        the last scan are processed. """
+        if not os.path.isdir(self.pathname):
+            # an unmounted disk is not the same as an empty collection
+            log.msg("Collection %s is missing, not scanning" % self.pathname, system="squeal.library.record.Collection")
+            return
+        index = self._load_index()
+        upgrading = not self.indexed
+        importer = TrackImporter(self)
+        changed = []
+        pending = []
+        found = 0
+        for (dirpath, dirnames, filenames) in os.walk(self.pathname):
+            found += len(filenames)
+            changed.extend(self._changed_files(dirpath, filenames, index, upgrading))
+            while len(changed) >= self.files_per_loop:
+                batch, changed = changed[:self.files_per_loop], changed[self.files_per_loop:]
+                d = self._process(batch, scanner, importer)
+                if d is not None:
+                    pending.append(d)
+                    # keep every scanner busy, but don't run too far ahead
+                    if len(pending) >= scanner.size * 2:
+                        yield pending.pop(0)
+                else:
+                    yield None
+            yield None
+        if changed:
+            d = self._process(changed, scanner, importer)
+            if d is not None:
+                pending.append(d)
+        if pending:
+            yield defer.DeferredList(pending, consumeErrors=True)
+        if index and not found:
+            # most likely a mountpoint with nothing mounted on it
+            log.msg("Collection %s is empty, not removing its %d files" % (self.pathname, len(index)), system="squeal.library.record.Collection")
+            return
+        if index:
+            log.msg("%d files removed from %s" % (len(index), self.pathname), system="squeal.library.record.Collection")
+            self.store.transact(self.remove_files, index.values())
+        self.indexed = True
+        self.last = Time()
 
     def scan(self):
         """ Loop through every file in the collection and update the metadata
-        stored against the track from it's tags and/or name """
+        stored against the track from it's tags and/or name. Returns a
+        deferred that fires when the scan is complete. """
         log.msg("Scanning collection %s" % self.pathname, system="squeal.library.record.Collection")
-        for i, pathname in enumerate(self._generate_changed_paths()):
-            self.update_path(pathname)
-            if i % self.files_per_loop == 0:
-                # allow other things to happen
-                reactor.iterate()
-        self.last = Time()
+        return task.coiterate(self._scan(self.scanner))
+
+    def _is_changed(self, pathname):
+        try:
+            st = os.stat(pathname)
+        except OSError:
+            return False
+        record = self.store.findFirst(FileRecord, AND(FileRecord.collection == self,
+                                                      FileRecord.pathname == pathname))
+        return record is None or record.is_stale(st)
+
+    def _update_changed(self, pathnames, scanner=None):
+        files = []
+        gone = []
+        for pathname in pathnames:
+            if os.path.isdir(pathname):
+                # probably moved in from somewhere else, so look at everything
+                for (dirpath, dirnames, filenames) in os.walk(pathname):
+                    files.extend(os.path.join(dirpath, f) for f in filenames)
+            elif os.path.exists(pathname):
+                files.append(pathname)
+            else:
+                gone.append(pathname)
+        changed = [p for p in files if self._is_changed(p)]
+        importer = TrackImporter(self)
+        for i in range(0, len(changed), self.files_per_loop):
+            yield self._process(changed[i:i+self.files_per_loop], scanner, importer)
+        records = []
+        for pathname in gone:
+            # this may have been a directory. LIKE treats _ as a wildcard, so
+            # check the prefix properly as well
+            prefix = pathname + u"/"
+            for r in self.store.query(FileRecord,
+                                      AND(FileRecord.collection == self,
+                                          OR(FileRecord.pathname == pathname,
+                                             FileRecord.pathname.startswith(prefix)))):
+                if r.pathname == pathname or r.pathname.startswith(prefix):
+                    records.append(r)
+        if records:
+            self.store.transact(self.remove_files, records)
+
+    def update_changed(self, pathnames):
+        """ Bring the database up to date for pathnames that are known to
+        have been created, modified or deleted, without scanning the rest of
+        the collection. Returns a deferred that fires when this is done. """
+        return task.coiterate(self._update_changed(pathnames, self.scanner))
+
+
+declareLegacyItem(Collection.typeName, 1, dict(
+    pathname=text(),
+    last=timestamp(),
+))
+
+def _indexed(collection):
+    # collections scanned since the index was added have FileRecords, those
+    # from before it have only their tracks
+    collection.indexed = collection.store.findFirst(FileRecord, FileRecord.collection == collection) is not None
+
+registerAttributeCopyingUpgrader(Collection, 1, 2, _indexed)
+
+class FileRecord(Item):
+
+    """ What we knew about a file the last time we looked at it. If none of
+    these have changed then there is no need to examine the file again. """
+
+    collection = reference()
+    pathname = text()
+    size = integer()
+    mtime = integer()
+    inode = integer()
+    track = reference()
+    compoundIndex(collection, pathname)
+
+    def record(self, st):
+        self.size = st[stat.ST_SIZE]
+        self.mtime = st[stat.ST_MTIME]
+        self.inode = st[stat.ST_INO]
+
+    def is_stale(self, st):
+        """ Has the file changed since it was recorded? """
+        return (self.size != st[stat.ST_SIZE] or
+                self.mtime != st[stat.ST_MTIME] or
+                self.inode != st[stat.ST_INO])
+
 
+# Axiom creates any indexes that are missing when a store is opened, so
+# existing libraries pick these up without needing an upgrade.
 
 class Artist(Item):
-    name = text()
+    name = text(indexed=True)
 
     def tracks(self):
         """ This is how the web part knows which tracks to play when this item
@@ -156,14 +431,23 @@ class Artist(Item):
                                 sort=(Album.name.ascending, Track.track.ascending))
 
 class Album(Item):
-    name = text()
+    name = text(indexed=True)
     artist = reference()
+    compoundIndex(artist, name)
 
     def tracks(self):
         """ This is how the web part knows which tracks to play when this item
         is selected """
         return self.store.query(Track, Track.album==self, sort=Track.track.ascending)
 
+class AlbumArt(Item):
+
+    """ The cover art of an album, as the digest of the picture in the
+    library's ArtworkStore. """
+
+    album = reference(indexed=True)
+    digest = text()
+
 class Track(Item):
 
     collection = reference()
@@ -171,17 +455,26 @@ class Track(Item):
     album = reference()
     track = integer()
     type = integer()
-    pathname = text()
-    title = text()
+    pathname = text(indexed=True)
+    title = text(indexed=True)
     year = text()
     genre = text()
     duration = integer() # milliseconds
+    compoundIndex(album, track)
+    compoundIndex(artist, album)
 
     def tracks(self):
         """ This is how the web part knows which tracks to play when this item
         is selected """
         return [self]
 
+    def artwork(self):
+        """ The digest of the cover art of the track's album, or None. """
+        if self.album is not None:
+            art = self.store.findFirst(AlbumArt, AlbumArt.album == self.album)
+            if art is not None:
+                return art.digest
+
     @classmethod
     def create(self, collection, pathname, ftype, details):
         if details is None:
@@ -201,7 +494,7 @@ class Track(Item):
                      duration=details['duration'],
                      )
         for r in track.store.powerupsFor(IEventReactor):
-            r.fireEvent(LibraryChangeEvent(added=[track]))
+            r.fireEvent(LibraryChangeEvent(collection.library, added=[track]))
         return track
 
     @classmethod
@@ -222,6 +515,7 @@ class Track(Item):
                 album = None
         else:
             artist = None
+            album = None
         return artist, album
 
     def update(self, details):
@@ -232,6 +526,83 @@ class Track(Item):
         self.title = details['title']
         self.year = details['year']
         self.genre = details['genre']
+        self.duration = details['duration']
+
+class TrackImporter(object):
+
+    """ Creates tracks in bulk. Artists and albums are remembered for the
+    life of the importer, so each one is only looked up or created once
+    however many tracks refer to it. """
+
+    # sqlite will only take so many parameters in a query
+    chunk_size = 500
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.store = collection.store
+        self.artists = {}
+        self.albums = {}
+        # albums whose artwork has been seen to already
+        self.covered = set()
+
+    def artist(self, name):
+        if name is None:
+            return None
+        artist = self.artists.get(name)
+        if artist is None:
+            artist = self.artists[name] = self.store.findOrCreate(Artist, name=name)
+        return artist
+
+    def album(self, artist, name):
+        if artist is None or name is None:
+            return None
+        key = (artist.storeID, name)
+        album = self.albums.get(key)
+        if album is None:
+            album = self.albums[key] = self.store.findOrCreate(Album, artist=artist, name=name)
+        return album
+
+    def artwork(self, album, digest):
+        """ Record the picture as the album's artwork. Only the first picture
+        found for each album is used. """
+        if album is None or digest is None or album.storeID in self.covered:
+            return
+        self.covered.add(album.storeID)
+        art = self.store.findOrCreate(AlbumArt, album=album)
+        art.digest = digest
+
+    def create(self, tracks, changed=()):
+        """ Create a track for each (pathname, ftype, details) provided, a
+        chunk at a time, and fire a single LibraryChangeEvent for all of
+        them, along with the existing tracks in changed. Returns the new
+        tracks. """
+        created = []
+        for i in range(0, len(tracks), self.chunk_size):
+            created.extend(self.store.transact(self._create, tracks[i:i+self.chunk_size]))
+        if created or changed:
+            for r in self.store.powerupsFor(IEventReactor):
+                r.fireEvent(LibraryChangeEvent(self.collection.library, added=created, changed=list(changed)))
+        return created
+
+    def _create(self, tracks):
+        rows = []
+        for pathname, ftype, details in tracks:
+            artist = self.artist(details['artist'])
+            album = self.album(artist, details['album'])
+            rows.append((self.collection, artist, album, details['track'],
+                         ftype, pathname, details['title'], details['year'],
+                         details['genre'], details['duration']))
+        if not rows:
+            return []
+        self.store.batchInsert(Track,
+                               (Track.collection, Track.artist, Track.album,
+                                Track.track, Track.type, Track.pathname,
+                                Track.title, Track.year, Track.genre,
+                                Track.duration),
+                               rows)
+        return list(self.store.query(Track,
+                                     AND(Track.collection == self.collection,
+                                         Track.pathname.oneOf([r[5] for r in rows]))))
 
 class TrackJSON(Adapter):
 
@@ -241,8 +612,8 @@ class TrackJSON(Adapter):
         t = self.original
         return {
             u'id': t.storeID,
-            u'artist': t.artist.name,
-            u'album': t.album.name,
+            u'artist': t.artist and t.artist.name,
+            u'album': t.album and t.album.name,
             u'track': t.track,
             u'title': t.title
         }
@@ -275,11 +646,11 @@ class TrackITrackAdapter(Adapter):
 
     @property
     def artist(self):
-        return self.original.artist.name
+        return self.original.artist and self.original.artist.name
 
     @property
     def album(self):
-        return self.original.album.name
+        return self.original.album and self.original.album.name
 
     @property
     def image_uri(self):
@@ -0,0 +1,133 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" A pool of child processes that examine music files on behalf of the
+library. Working out the file type and reading the tags is the expensive part
+of a scan, so it is done here, off the reactor, on as many cores as we have.
+The results are sent back in batches and written to the store by the main
+process. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+import multiprocessing
+
+from twisted.python.filepath import FilePath
+
+from twisted.internet import defer, error
+from twisted.python.util import sibpath
+from twisted.python import log
+
+from epsilon import juice
+from axiom.batch import ProcessController, JuiceChild
+
+from squeal import adaptivejson
+from squeal.library.record import file_type
+from squeal.library.policies import StandardPolicyMixin
+from squeal.library.artwork import ArtworkStore
+
+class ExamineFiles(juice.Command):
+    """
+    Work out the type of each file, and read the tags and cover art from those
+    that are music. Arguments and results are JSON encoded lists. Cover art is
+    put in the artwork directory.
+    """
+    commandName = 'Examine-Files'
+    arguments = [('pathnames', juice.String()), ('artwork', juice.String())]
+    response = [('results', juice.String())]
+
+class ScannerChild(JuiceChild):
+
+    """ Protocol that runs in each of the scanner processes. """
+
+    def __init__(self, issueGreeting=False):
+        JuiceChild.__init__(self, issueGreeting)
+
+    def examine(self, pathname, artwork, folders=None):
+        ftype = file_type(pathname)
+        tags = None
+        digest = None
+        if ftype is not None:
+            try:
+                tags = StandardPolicyMixin().detailsFromTags(pathname)
+            except ValueError:
+                pass
+            digest = artwork.extract(pathname, folders)
+        return (pathname, ftype, tags, digest)
+
+    def command_EXAMINE_FILES(self, pathnames, artwork):
+        results = []
+        artwork = ArtworkStore(FilePath(artwork))
+        folders = {}
+        for pathname in adaptivejson.loads(pathnames):
+            try:
+                results.append(self.examine(pathname, artwork, folders))
+            except Exception:
+                log.err(None, "Unable to examine %r" % pathname)
+                results.append((pathname, None, None, None))
+        return {'results': adaptivejson.dumps(results)}
+    command_EXAMINE_FILES.command = ExamineFiles
+
+class ScannerPool(object):
+
+    """ A bounded pool of scanner processes. Processes are started when they
+    are first needed, and each handles one batch of files at a time. Cover
+    art is put in the ArtworkStore artwork. """
+
+    tacPath = sibpath(__file__, "scanner.tac")
+
+    def __init__(self, store, artwork, size=None):
+        if size is None:
+            size = multiprocessing.cpu_count()
+        self.size = size
+        self.artwork = artwork
+        rundir = store.dbdir.child("run")
+        logdir = rundir.child("logs")
+        for d in rundir, logdir:
+            try:
+                d.createDirectory()
+            except OSError:
+                pass
+        self.controllers = []
+        self.idle = defer.DeferredQueue()
+        for i in range(size):
+            name = "scanner-%d" % i
+            controller = ProcessController(
+                name, ScannerChild(), self.tacPath,
+                logPath=logdir.child(name + ".log").path,
+                pidPath=rundir.child(name + ".pid").path)
+            self.controllers.append(controller)
+            self.idle.put(controller)
+
+    def examine(self, pathnames):
+        """ Returns a deferred that fires with a list of (pathname, ftype,
+        tags, artwork) tuples, once a scanner process has examined the files.
+        """
+        command = ExamineFiles(pathnames=adaptivejson.dumps(pathnames),
+                               artwork=self.artwork.directory.path)
+        def _examine(controller):
+            d = controller.getProcess()
+            d.addCallback(command.do)
+            d.addCallback(lambda response: adaptivejson.loads(response['results']))
+            def _release(result):
+                self.idle.put(controller)
+                return result
+            return d.addBoth(_release)
+        return self.idle.get().addCallback(_examine)
+
+    def stop(self):
+        d = defer.DeferredList([c.stopProcess() for c in self.controllers])
+        d.addErrback(lambda err: err.trap(error.ProcessDone))
+        return d
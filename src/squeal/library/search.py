@@ -0,0 +1,138 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Searching the library. Each track's title, artist, album and genre are
+split into words, and every word is stored as a SearchTerm pointing back at
+the track. A query is answered by a join on the SearchTerm table, one per word
+searched for, so it uses the token index however big the library is. Every
+word is treated as a prefix, which is what type-ahead needs. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+import re
+
+from twisted.internet import task
+from twisted.python import log
+from axiom.attributes import text, reference, AND, compoundIndex
+from axiom.item import Item, Placeholder
+
+from record import Track
+
+# sorts after any character that can reasonably appear in a token
+HIGHEST = u"\uffff"
+
+word_re = re.compile(r"\w+", re.UNICODE)
+
+def tokens(value):
+    """ The distinct lower case words in value. """
+    if not value:
+        return set()
+    return set(word_re.findall(value.lower()))
+
+class SearchTerm(Item):
+
+    """ A word found in one of the fields of a track. These go when the track
+    does. """
+
+    token = text(allowNone=False)
+    track = reference(reftype=Track, whenDeleted=reference.CASCADE)
+    compoundIndex(token, track)
+
+class SearchIndex(object):
+
+    """ Maintains the search terms for the tracks in a store, and answers
+    queries against them. """
+
+    # sqlite will only take so many parameters in a query
+    chunk_size = 500
+
+    def __init__(self, store):
+        self.store = store
+
+    def terms(self, track):
+        words = tokens(track.title) | tokens(track.genre)
+        if track.artist is not None:
+            words |= tokens(track.artist.name)
+        if track.album is not None:
+            words |= tokens(track.album.name)
+        return words
+
+    def index(self, tracks):
+        """ (Re)index the tracks provided, replacing any terms they already
+        have. Tracks that have been deleted since are skipped. """
+        ids = [t.storeID for t in tracks]
+        for i in range(0, len(ids), self.chunk_size):
+            self.store.transact(self._index, ids[i:i+self.chunk_size])
+
+    def _index(self, ids):
+        tracks = list(self.store.query(Track, Track.storeID.oneOf(ids)))
+        if not tracks:
+            return
+        self.store.query(SearchTerm, SearchTerm.track.oneOf(tracks)).deleteFromStore()
+        rows = []
+        for track in tracks:
+            rows.extend((word, track) for word in self.terms(track))
+        if rows:
+            self.store.batchInsert(SearchTerm, (SearchTerm.token, SearchTerm.track), rows)
+
+    def changed(self, ev):
+        """ Handler for library change events. Removed tracks need nothing
+        doing, because their terms are deleted along with them. """
+        tracks = list(ev.added) + list(ev.changed)
+        if tracks:
+            self.index(tracks)
+
+    def _build(self):
+        count = 0
+        last = 0
+        while True:
+            chunk = list(self.store.query(Track, Track.storeID > last,
+                                          sort=Track.storeID.ascending,
+                                          limit=self.chunk_size))
+            if not chunk:
+                break
+            self.index(chunk)
+            count += len(chunk)
+            last = chunk[-1].storeID
+            yield None
+        log.msg("Indexed %d tracks for searching" % count, system="squeal.library.search.SearchIndex")
+
+    def build(self):
+        """ Index every track in the store, if it has not been done already.
+        This is only needed the first time a library is searched, or after
+        the index has been lost; otherwise it is kept up to date by
+        LibraryChangeEvents. """
+        if self.store.query(SearchTerm, limit=1).count() or not self.store.query(Track, limit=1).count():
+            return
+        return task.coiterate(self._build())
+
+    def search(self, query, limit=50):
+        """ Return up to limit tracks that have a word starting with each of
+        the words in query, sorted by title. Only the tracks returned are
+        sorted: sorting everything that matches a short prefix would take as
+        long as there are matches. """
+        words = sorted(tokens(query))
+        if not words:
+            return []
+        conditions = []
+        for word in words:
+            term = Placeholder(SearchTerm)
+            conditions.append(AND(term.track == Track.storeID,
+                                  term.token >= word,
+                                  term.token < word + HIGHEST))
+        tracks = list(self.store.query(Track, AND(*conditions), limit=limit).distinct())
+        tracks.sort(key=lambda t: t.title)
+        return tracks
@@ -21,13 +21,20 @@ __version__ = "$Revision$"[11:-2]
 
 from zope.interface import Interface, implements
 from twisted.python import log
+from twisted.python.util import sibpath
 from twisted.application import service
-from twisted.internet import reactor
+from twisted.internet import reactor, threads, defer
 from axiom.item import Item
-from axiom.attributes import reference, inmemory
+from axiom.attributes import reference, inmemory, AND, OR
 
 import web
 from record import *
+from scanner import ScannerPool
+from search import SearchIndex
+from transcode import TranscodePool
+from stream import OpenTracks
+from artwork import ArtworkStore
+import watcher
 from ilibrary import *
 from squeal import isqueal
 
@@ -38,8 +45,21 @@ setup_form = form.Form("library-setup", action="install")
 field.StringField(form=setup_form, name="pathname", label="Directory containing music files")
 field.SubmitButton(form=setup_form, name="submit", label="Configure library")
 
+def readahead(pathname, size, blocksize=1 << 16):
+    """ Read up to size bytes of the file, so that they are in the page cache
+    when the file is streamed. """
+    try:
+        f = open(pathname, "rb")
+    except IOError:
+        return
+    try:
+        while size > 0 and f.read(min(blocksize, size)):
+            size -= blocksize
+    finally:
+        f.close()
+
 class Library(Item, service.Service):
-    implements(ILibrary, IMusicSource)
+    implements(ILibrary, IMusicSource, isqueal.ITrackPrefetcher)
     powerupInterfaces = (ILibrary, IMusicSource, isqueal.IRootResourceExtension)
 
     collections = reference()
@@ -48,12 +68,90 @@ class Library(Item, service.Service):
     label = 'Local music'
     parent = inmemory()
     naming_policy = reference()
+    scanner = inmemory()
+    watchers = inmemory()
+    search_index = inmemory()
+    transcoder = inmemory()
+    open_tracks = inmemory()
+    _artwork = inmemory()
+    _default_artwork = inmemory()
 
     setup_form = setup_form
 
+    # how much of a track to read before it is played
+    readahead_size = 32 << 20
+
     def activate(self):
+        self.running = False
+        self.scanner = None
+        self.transcoder = None
+        self.watchers = []
+        self.search_index = SearchIndex(self.store)
+        self.open_tracks = OpenTracks(self.store)
+        self._artwork = None
+        self._default_artwork = None
+        for r in self.store.powerupsFor(isqueal.IEventReactor):
+            r.subscribe(self.search_index.changed, ILibraryChangeEvent)
+            r.subscribe(self.open_tracks.changed, ILibraryChangeEvent)
         self.rescan()
 
+    def startService(self):
+        # an in-memory store has nowhere for scanner processes to keep their
+        # logs, so it is scanned in this process instead
+        if self.store.dbdir is not None:
+            self.scanner = ScannerPool(self.store, self.artwork)
+        if self.store.filesdir is not None:
+            self.transcoder = TranscodePool(self.store.newFilePath("transcode"))
+        reactor.callLater(0, self.search_index.build)
+        for collection in self.store.query(Collection):
+            self.watch(collection)
+        return service.Service.startService(self)
+
+    def stopService(self):
+        service.Service.stopService(self)
+        for w in self.watchers:
+            w.stop()
+        self.watchers = []
+        stopping = []
+        scanner, self.scanner = self.scanner, None
+        if scanner is not None:
+            stopping.append(scanner.stop())
+        transcoder, self.transcoder = self.transcoder, None
+        if transcoder is not None:
+            stopping.append(transcoder.stop())
+        return defer.DeferredList(stopping)
+
+    @property
+    def artwork(self):
+        """ The ArtworkStore in the store's files directory. It is not made
+        until it is needed, so that an in-memory store without one works
+        until there is cover art to keep. """
+        if self._artwork is None:
+            self._artwork = ArtworkStore(self.store.newFilePath("artwork"))
+        return self._artwork
+
+    @property
+    def default_artwork(self):
+        """ The digest of the picture shown for tracks that have no cover
+        art of their own. """
+        if self._default_artwork is None:
+            with open(sibpath(__file__, "music.png"), "rb") as f:
+                self._default_artwork = self.artwork.add(f.read())
+        return self._default_artwork
+
+    def watch(self, collection):
+        """ Keep the library up to date with changes to the collection as
+        they happen, where the platform supports it. """
+        if not watcher.supported():
+            return
+        w = watcher.CollectionWatcher(collection)
+        try:
+            w.start()
+        except Exception:
+            log.err(None, "Unable to watch %s" % collection.pathname)
+            return
+        self.watchers.append(w)
+
     def rescan(self):
         log.msg("Rescanning music collections", system="squeal.library.service.Library")
         for collection in self.store.query(Collection):
@@ -68,11 +166,53 @@ class Library(Item, service.Service):
             log.msg("Found duplicate collection %s" % pathname, system="squeal.library.service.Library")
             return c
         log.msg("Adding a collection at %s" % pathname, system="squeal.library.service.Library")
-        return Collection(store=self.store, pathname=pathname)
+        collection = Collection(store=self.store, pathname=pathname)
+        if self.running:
+            self.watch(collection)
+        return collection
+
+    # what each browse list contains, and what it is sorted on
+    browse_columns = {
+        'artists': (Artist, Artist.name),
+        'albums': (Album, Album.name),
+        'tracks': (Track, Track.title),
+    }
+
+    def browse(self, kind, after=None, count=50):
+        """ Return up to count artists, albums or tracks in order, starting
+        after the item with storeID after. This pages on the sort column
+        rather than using an offset, so every page costs the same however far
+        into the library it is. If that item has been removed since, the
+        page starts at the next item with a greater storeID. """
+        itemType, column = self.browse_columns[kind]
+        comparison = None
+        if after is not None:
+            after = int(after)
+            last = self.store.getItemByID(after, None)
+            if not isinstance(last, itemType):
+                last = self.store.findFirst(itemType, itemType.storeID > after,
+                                            sort=itemType.storeID.ascending)
+                if last is None:
+                    return []
+                after = last.storeID - 1
+            value = getattr(last, column.attrname)
+            if value is None:
+                # nulls sort first
+                comparison = OR(column != None,
+                                AND(column == None, itemType.storeID > after))
+            else:
+                comparison = OR(column > value,
+                                AND(column == value, itemType.storeID > after))
+        return self.store.query(itemType, comparison,
+                                sort=(column.ascending, itemType.storeID.ascending),
+                                limit=count)
 
     def tracks(self):
         return self.store.query(Track, sort=Track.title.asc)
 
+    def search(self, query, limit=50):
+        return self.search_index.search(query, limit)
+
     def artists(self):
         return self.store.query(Artist, sort=Artist.name.asc)
 
@@ -83,7 +223,30 @@ class Library(Item, service.Service):
         return web.Main()
 
     def get_track(self, tid):
-        return self.store.getItemByID(int(tid))
+        """ The track, or None if it is no longer in the library. """
+        track = self.store.getItemByID(int(tid), None)
+        if isinstance(track, Track):
+            return track
+        return None
+
+    def cover(self, tid):
+        """ The digest of the track's cover art, or of the default artwork if
+        it has none. """
+        track = self.store.getItemByID(int(tid), None)
+        if isinstance(track, Track):
+            digest = track.artwork()
+            if digest is not None:
+                return digest
+        return self.default_artwork
+
+    def prefetch(self, tid):
+        """ Read the track's file in a thread, so the disk is not what holds
+        up the start of the track. """
+        track = self.store.getItemByID(int(tid), None)
+        if isinstance(track, Track):
+            d = threads.deferToThread(readahead, track.pathname, self.readahead_size)
+            d.addErrback(log.err, "Unable to read %s" % track.pathname)
+            return d
 
     #isqueal.IRootResourceExtension
 
@@ -0,0 +1,247 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Streaming library tracks to the players. The files of recently played
+tracks are kept open, along with what is needed to serve them, so a request
+does not have to look the track up or open it again. Where the platform has
+sendfile the kernel copies the file straight to the socket, otherwise it is
+read and written a block at a time. Either way a block is only sent once the
+last has gone, so a slow player holds nothing up. A single byte range can be
+asked for, so that a player can start part way through a track. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+import os
+import errno
+import mimetypes
+
+try:
+    # os.sendfile is new in Python 3.3
+    from os import sendfile
+except ImportError:
+    try:
+        from sendfile import sendfile
+    except ImportError:
+        sendfile = None
+
+from zope.interface import implements
+from twisted.internet.interfaces import IPullProducer, ISSLTransport
+from twisted.python import log
+
+from nevow import inevow
+from nevow import rend
+
+from squeal.util import LRUCache
+from record import Track
+
+class Unsatisfiable(ValueError):
+    """ The range asked for is not in the file """
+
+def parse_range(header, size):
+    """ Return the start and end of the byte range in a Range header, with
+    the end exclusive, or None if the whole file should be sent. Only the
+    first range is honoured. Raises Unsatisfiable if it starts beyond the end
+    of the file. """
+    if not header:
+        return None
+    unit, _, ranges = header.partition("=")
+    if unit.strip() != "bytes":
+        return None
+    first, _, last = ranges.split(",")[0].strip().partition("-")
+    try:
+        if not first:
+            # the last so many bytes
+            start, end = size - int(last), size
+        else:
+            start = int(first)
+            end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start >= size:
+        raise Unsatisfiable(header)
+    if end <= start:
+        return None
+    return max(0, start), min(end, size)
+
+class OpenTrack(object):
+
+    """ A track's file, held open, and what is needed to serve it. The file
+    is closed once it has dropped out of the cache and the last stream using
+    it has finished. """
+
+    def __init__(self, pathname):
+        self.pathname = pathname
+        self.file = open(pathname, "rb")
+        st = os.fstat(self.file.fileno())
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.content_type = mimetypes.guess_type(pathname)[0] or "application/octet-stream"
+        self.streams = 0
+        self.cached = True
+
+    def stream_started(self):
+        self.streams += 1
+
+    def stream_finished(self, ignored=None):
+        self.streams -= 1
+        self._close()
+
+    def evicted(self):
+        self.cached = False
+        self._close()
+
+    def _close(self):
+        if not self.cached and not self.streams:
+            self.file.close()
+
+class OpenTracks(object):
+
+    """ The most recently streamed tracks, by storeID. Tracks that change or
+    are removed from the library are forgotten. """
+
+    def __init__(self, store, size=64):
+        self.store = store
+        self.tracks = LRUCache(size, lambda entry: entry.evicted())
+
+    def get(self, tid):
+        """ The OpenTrack for the track, raising KeyError if there is no such
+        track. """
+        entry = self.tracks.get(tid)
+        if entry is None:
+            track = self.store.getItemByID(tid, None)
+            if not isinstance(track, Track):
+                raise KeyError("Not a track")
+            entry = OpenTrack(track.pathname)
+            self.tracks.put(tid, entry)
+        return entry
+
+    def changed(self, ev):
+        """ Handler for library change events. """
+        for t in list(ev.changed) + list(ev.removed):
+            self.tracks.remove(t.storeID)
+
+class FileProducer(object):
+
+    """ Sends part of an open file to a request, a block each time the
+    transport asks for more. """
+
+    implements(IPullProducer)
+
+    block_size = 1 << 16
+
+    def __init__(self, request, f, start, end):
+        self.request = request
+        self.file = f
+        self.offset = start
+        self.end = end
+
+    def start(self):
+        self.request.registerProducer(self, False)
+
+    def resumeProducing(self):
+        if self.request is None:
+            return
+        self.file.seek(self.offset)
+        data = self.file.read(min(self.block_size, self.end - self.offset))
+        self.offset += len(data)
+        if data:
+            self.request.write(data)
+        if not data or self.offset >= self.end:
+            self.finish()
+
+    def finish(self):
+        request, self.request = self.request, None
+        request.unregisterProducer()
+        request.finish()
+
+    def stopProducing(self):
+        # the player has gone away
+        self.request = None
+
+class SendfileProducer(FileProducer):
+
+    """ Has the kernel send the file to the socket itself. The transport only
+    asks for more once its own buffer is empty, and the first block goes
+    through it along with the headers, so after that the socket is ours to
+    write to. """
+
+    def __init__(self, request, f, start, end):
+        FileProducer.__init__(self, request, f, start, end)
+        self.transport = request.transport
+        self.started = False
+
+    def resumeProducing(self):
+        if self.request is None:
+            return
+        if not self.started:
+            self.started = True
+            return FileProducer.resumeProducing(self)
+        try:
+            sent = sendfile(self.transport.fileno(), self.file.fileno(), self.offset, self.end - self.offset)
+        except (OSError, IOError), e:
+            if e.errno != errno.EAGAIN:
+                log.msg("Unable to send %s: %s" % (self.file.name, e), system="squeal.library.stream.SendfileProducer")
+                self.request = None
+                self.transport.unregisterProducer()
+                self.transport.loseConnection()
+                return
+        else:
+            self.offset += sent
+            if sent == 0 or self.offset >= self.end:
+                # nothing sent means the file is shorter than it was
+                self.finish()
+                return
+        # so that the transport calls back once the socket is writable
+        self.transport.startWriting()
+
+def can_sendfile(transport):
+    return sendfile is not None and hasattr(transport, "fileno") and not ISSLTransport.providedBy(transport)
+
+class TrackStream(rend.Page):
+
+    """ A library track, or the part of it asked for. """
+
+    def __init__(self, track):
+        self.track = track
+
+    def renderHTTP(self, ctx):
+        request = inevow.IRequest(ctx)
+        track = self.track
+        request.setHeader("accept-ranges", "bytes")
+        request.setHeader("content-type", track.content_type)
+        try:
+            r = parse_range(request.getHeader("range"), track.size)
+        except Unsatisfiable:
+            request.setResponseCode(416)
+            request.setHeader("content-range", "bytes */%d" % track.size)
+            return ""
+        if r is None:
+            start, end = 0, track.size
+        else:
+            start, end = r
+            request.setResponseCode(206)
+            request.setHeader("content-range", "bytes %d-%d/%d" % (start, end - 1, track.size))
+        request.setHeader("content-length", str(end - start))
+        if request.method == "HEAD" or start == end:
+            return ""
+        if can_sendfile(request.transport):
+            producer = SendfileProducer(request, track.file, start, end)
+        else:
+            producer = FileProducer(request, track.file, start, end)
+        track.stream_started()
+        request.notifyFinish().addBoth(track.stream_finished)
+        producer.start()
+        return request.deferred
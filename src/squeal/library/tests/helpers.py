@@ -0,0 +1,59 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Fakes shared by the squeal.library tests. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+from twisted.internet import defer, error
+
+class FakeRequest(object):
+
+    """ Enough of a web request to have a producer write to it. """
+
+    def __init__(self, transport=None):
+        self.transport = transport
+        self.data = []
+        self.producer = None
+        self.finished = False
+        self.notifications = []
+
+    def notifyFinish(self):
+        d = defer.Deferred()
+        self.notifications.append(d)
+        return d
+
+    def connectionLost(self):
+        for d in self.notifications:
+            d.errback(error.ConnectionLost())
+        self.notifications = []
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+        if not streaming:
+            producer.resumeProducing()
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def write(self, data):
+        self.data.append(data)
+
+    def finish(self):
+        self.finished = True
+        for d in self.notifications:
+            d.callback(None)
+        self.notifications = []
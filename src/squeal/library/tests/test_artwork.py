@@ -0,0 +1,168 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Automated unit tests for squeal.library.artwork. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+import os
+import struct
+from StringIO import StringIO
+
+import Image
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.python.filepath import FilePath
+from axiom.store import Store
+
+from squeal import imaging
+from squeal.library import artwork
+from squeal.library import record
+
+def picture(colour="red", size=300):
+    s = StringIO()
+    Image.new("RGB", (size, size), colour).save(s, "PNG")
+    return s.getvalue()
+
+def syncsafe(n):
+    return "".join(chr((n >> shift) & 0x7f) for shift in (21, 14, 7, 0))
+
+def id3(version, frames):
+    body = ""
+    for frame_id, data in frames:
+        if version == 3:
+            size = struct.pack(">I", len(data))
+        else:
+            size = syncsafe(len(data))
+        body += frame_id + size + "\0\0" + data
+    body += "\0" * 100
+    return "ID3" + chr(version) + "\0\0" + syncsafe(len(body)) + body
+
+def apic(data, picture_type=3, description="cover"):
+    return "\0image/png\0" + chr(picture_type) + description + "\0" + data
+
+def flac(pictures):
+    blocks = [(0, "\0" * 34)]
+    for picture_type, data in pictures:
+        blocks.append((6, struct.pack(">II", picture_type, 9) + "image/png" +
+                          struct.pack(">I", 5) + "cover" + "\0" * 16 +
+                          struct.pack(">I", len(data)) + data))
+    out = "fLaC"
+    for i, (block_type, block) in enumerate(blocks):
+        if i == len(blocks) - 1:
+            block_type |= 0x80
+        out += chr(block_type) + struct.pack(">I", len(block))[1:] + block
+    return out + "audio"
+
+class TestExtract(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = FilePath(self.mktemp())
+        self.dir.makedirs()
+        self.store = artwork.ArtworkStore(self.dir.child("artwork"))
+        self.cover = picture("red")
+        self.back = picture("blue")
+
+    def write(self, name, data):
+        f = self.dir.child(name)
+        f.setContent(data)
+        return f.path
+
+    def test_id3(self):
+        for version in 3, 4:
+            pathname = self.write("track.mp3", id3(version, [
+                ("TIT2", "\0title"),
+                ("APIC", apic(self.back, picture_type=4)),
+                ("APIC", apic(self.cover)),
+            ]) + "audio")
+            self.assertEqual(artwork.embedded_picture(pathname), self.cover)
+
+    def test_flac(self):
+        pathname = self.write("track.flac", flac([(4, self.back), (3, self.cover)]))
+        self.assertEqual(artwork.embedded_picture(pathname), self.cover)
+        pathname = self.write("tagged.flac", id3(3, [("TIT2", "\0title")]) + flac([(4, self.back)]))
+        self.assertEqual(artwork.embedded_picture(pathname), self.back)
+
+    def test_folder(self):
+        pathname = self.write("track.mp3", id3(3, [("TIT2", "\0title")]))
+        self.assertEqual(self.store.extract(pathname), None)
+        self.write("Folder.JPG", self.cover)
+        digest = self.store.extract(pathname)
+        self.assertEqual(self.store.path(digest).getContent(), self.cover)
+
+    def test_folder_once(self):
+        one = self.write("one.mp3", id3(3, [("TIT2", "\0title")]))
+        two = self.write("two.mp3", id3(3, [("TIT2", "\0title")]))
+        self.write("folder.jpg", self.cover)
+        read = []
+        def folder_picture(dirpath):
+            read.append(dirpath)
+            return self.cover
+        self.patch(artwork, "folder_picture", folder_picture)
+        folders = {}
+        digest = self.store.extract(one, folders)
+        self.assertEqual(self.store.extract(two, folders), digest)
+        self.assertEqual(read, [os.path.dirname(one)])
+        self.assertEqual(folders, {os.path.dirname(one): digest})
+
+    def test_dedupe(self):
+        first = self.store.extract(self.write("one.flac", flac([(3, self.cover)])))
+        second = self.store.extract(self.write("two.flac", flac([(3, self.cover)])))
+        self.assertEqual(first, second)
+        self.assertEqual(len(list(self.store.directory.walk())), 3)
+
+    def test_thumbnail(self):
+        pool = imaging.ImagePool(size=1)
+        self.patch(imaging, "pool", pool)
+        self.addCleanup(pool.stop)
+        digest = self.store.add(self.cover)
+        made = []
+        thumbnail = self.store.thumbnail
+        def _thumbnail(data, size):
+            made.append(size)
+            return thumbnail(data, size)
+        self.patch(self.store, "thumbnail", _thumbnail)
+        first = self.store.get(digest, 100)
+        # asked for again while it is being made
+        second = self.store.get(digest, 120)
+        def _made((path, again)):
+            self.assertEqual(again, path)
+            self.assertEqual(Image.open(path.path).size, (128, 128))
+            self.assertEqual(self.store.get(digest, 128).result, path)
+            self.assertEqual(made, [128])
+            self.assertEqual(self.store.get(digest).result.getContent(), self.cover)
+            self.assertEqual(self.store.get("0" * 40, 100).result, None)
+            return self.store.get(digest, 1000)
+        def _largest(path):
+            self.assertEqual(Image.open(path.path).size, (300, 300))
+        d = defer.gatherResults([first, second])
+        return d.addCallback(_made).addCallback(_largest)
+
+class TestAlbumArt(unittest.TestCase):
+
+    def test_first_found(self):
+        store = Store()
+        importer = record.TrackImporter(record.Collection(store=store, pathname=u"/music"))
+        artist = importer.artist(u"Ministry")
+        album = importer.album(artist, u"Psalm 69")
+        track = record.Track(store=store, artist=artist, album=album, title=u"Hero")
+        self.assertEqual(track.artwork(), None)
+        importer.artwork(album, None)
+        importer.artwork(album, u"a" * 40)
+        importer.artwork(album, u"b" * 40)
+        self.assertEqual(track.artwork(), u"a" * 40)
+        self.assertEqual(store.query(record.AlbumArt).count(), 1)
@@ -85,3 +85,31 @@ class TestStandardNamingPolicy(unittest.TestCase):
         self.details["album"] = albumName
         self.details["title"] = trackName
         self.assertEqual(self._p("foo/bar/baz/%s/%s/04-%s" % (artistPart, albumPart, trackPart)), self.details)
+
+class FakeCollection(object):
+    pathname = u"/music"
+
+class TestMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = policies.StandardNamingPolicy()
+        self.collection = FakeCollection()
+        self.pathname = u"/music/%s/%s/04-%s.mp3" % (artistName, albumName, trackName)
+        self.tags = dict(zip(self.policy.tags, cycle([None])))
+        self.tags.update({'artist': u"50 cent", 'album': albumName, 'year': u"2010", 'duration': 1000})
+
+    def test_no_tags(self):
+        details = self.policy.merge(self.collection, self.pathname, None)
+        self.assertEqual(details, self.policy.detailsFromPath(self.pathname))
+
+    def test_path_wins(self):
+        details = self.policy.merge(self.collection, self.pathname, self.tags)
+        self.assertEqual((details['artist'], details['album'], details['title'], details['track']),
+                         (artistName, albumName, trackName, 4))
+        # only the tags know these
+        self.assertEqual((details['year'], details['duration']), (u"2010", 1000))
+
+    def test_tags_win(self):
+        self.policy.wins = u'tags'
+        details = self.policy.merge(self.collection, self.pathname, self.tags)
+        self.assertEqual((details['artist'], details['title']), (u"50 cent", trackName))
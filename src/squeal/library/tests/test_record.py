@@ -22,9 +22,44 @@ import os
 
 from twisted.python.util import sibpath
 from twisted.trial import unittest
+from twisted.internet import defer
+from zope.interface import implements
+from squeal.isqueal import IEventReactor
 from squeal.library import record
 from epsilon.extime import Time
 from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import text
+
+class FakeScanner(object):
+
+    size = 1
+
+    def examine(self, pathnames):
+        return defer.succeed([(p, None, None, None) for p in pathnames])
+
+class FakeEventReactor(Item):
+
+    implements(IEventReactor)
+    powerupInterfaces = (IEventReactor,)
+
+    name = text()
+    events = []
+
+    def fireEvent(self, event, *interfaces):
+        self.events.append(event)
+
+def details(i, albums=2):
+    return {
+        'artist': u"artist",
+        'album': u"album %d" % (i % albums),
+        'track': i,
+        'title': u"title %d" % i,
+        'year': u"2010",
+        'genre': u"genre",
+        'comment': None,
+        'duration': 180000,
+    }
 
 class TestCollection(unittest.TestCase):
 
@@ -38,7 +73,17 @@ class TestCollection(unittest.TestCase):
             pathname = os.path.join(files, "la.%s" % t)
             self.assertEqual(self.c.file_type(pathname), i)
 
-    def test_generate_changed_paths(self):
+    def scan(self):
+        """ Scan the collection, returning the pathnames it examined. """
+        examined = []
+        def _process(self, pathnames, scanner=None, importer=None):
+            examined.extend(pathnames)
+            self.store.transact(self.update_details, [(p, None, None) for p in pathnames], importer)
+        self.patch(record.Collection, "_process", _process)
+        list(self.c._scan())
+        return examined
+
+    def test_scan_upgrading(self):
         self.c.last = Time().fromPOSIXTimestamp(1000)
         os.mkdir("colltest")
         correct = []
@@ -51,6 +96,158 @@ class TestCollection(unittest.TestCase):
                 os.utime(filepath, (0, f))
                 if f > 1000:
                     correct.append(filepath)
-        changed = list(self.c._generate_changed_paths())
-        self.assertEqual(sorted(changed), sorted(correct))
+        # files from before the index are recorded without being examined
+        self.assertEqual(sorted(self.scan()), sorted(correct))
+        self.assertEqual(len(self.c._load_index()), 12)
+        self.assertTrue(self.c.indexed)
+
+    def _make_files(self):
+        self.c.pathname = unicode(self.mktemp())
+        os.mkdir(self.c.pathname)
+        paths = []
+        for f in 1, 2, 3:
+            filepath = os.path.join(self.c.pathname, u"file%d" % f)
+            open(filepath, "w").write("x" * f)
+            paths.append(filepath)
+        return paths
+
+    def test_scan_indexed(self):
+        paths = self._make_files()
+        self.assertEqual(sorted(self.scan()), paths)
+        self.assertEqual(self.scan(), [])
+        open(paths[1], "w").write("changed")
+        self.assertEqual(self.scan(), [paths[1]])
+
+    def test_scan_removed(self):
+        paths = self._make_files()
+        self.scan()
+        os.unlink(paths[0])
+        self.scan()
+        self.assertEqual(sorted(self.c._load_index().keys()), paths[1:])
+
+    def test_scan_emptied(self):
+        paths = self._make_files()
+        self.scan()
+        away = self.mktemp()
+        os.mkdir(away)
+        for p in paths:
+            os.utime(p, (0, 0))
+            os.rename(p, os.path.join(away, os.path.basename(p)))
+        # as if the disk had been unmounted
+        self.scan()
+        self.assertEqual(sorted(self.c._load_index().keys()), paths)
+        for p in paths:
+            os.rename(os.path.join(away, os.path.basename(p)), p)
+        # old files are not taken as they are once the collection is indexed
+        self.c.store.query(record.FileRecord).deleteFromStore()
+        self.assertEqual(sorted(self.scan()), paths)
+
+    def test_store_failure(self):
+        def _update_examined(self, results, importer=None):
+            raise ValueError("broken")
+        self.patch(record.Collection, "update_examined", _update_examined)
+        d = self.c._process([u"colltest/file1"], FakeScanner())
+        def _check(result):
+            self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        return d.addCallback(_check)
+
+class TestTrackImporter(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        self.events = FakeEventReactor(store=self.store)
+        self.store.powerUp(self.events, IEventReactor)
+        self.patch(FakeEventReactor, "events", [])
+        self.c = record.Collection(store=self.store, pathname=unicode(self.mktemp()))
+        os.mkdir(self.c.pathname)
+
+    def examined(self, count):
+        examined = []
+        for i in range(count):
+            pathname = os.path.join(self.c.pathname, u"%d.mp3" % i)
+            open(pathname, "w").write("x")
+            examined.append((pathname, 1, details(i)))
+        return examined
+
+    def test_create(self):
+        examined = self.examined(3)
+        created = record.TrackImporter(self.c).create(examined)
+        self.assertEqual(sorted((t.pathname, t.title, t.track) for t in created),
+                         sorted((p, d['title'], d['track']) for p, f, d in examined))
+        self.assertEqual(self.store.query(record.Track).count(), 3)
+
+    def test_chunks(self):
+        self.patch(record.TrackImporter, "chunk_size", 2)
+        created = record.TrackImporter(self.c).create(self.examined(5))
+        self.assertEqual(len(created), 5)
+        self.assertEqual(self.store.query(record.Artist).count(), 1)
+        self.assertEqual(self.store.query(record.Album).count(), 2)
+        for t in created:
+            self.assertEqual(t.album.name, u"album %d" % (t.track % 2))
+        # one event for every chunk
+        self.assertEqual(len(self.events.events), 1)
+        self.assertEqual(len(self.events.events[0].added), 5)
+
+    def test_update_existing(self):
+        examined = self.examined(3)
+        first = self.c.update_details(examined[:2])
+        self.patch(FakeEventReactor, "events", [])
+        pathname, ftype, changed = examined[0]
+        changed = dict(changed, title=u"changed")
+        tracks = self.c.update_details([(pathname, ftype, changed), examined[2]])
+        self.assertIdentical(tracks[pathname], first[pathname])
+        self.assertEqual(tracks[pathname].title, u"changed")
+        self.assertEqual(self.store.query(record.Track).count(), 3)
+        self.assertEqual(self.store.query(record.FileRecord).count(), 3)
+        [event] = self.events.events
+        self.assertEqual(event.changed, [tracks[pathname]])
+        self.assertEqual(event.added, [tracks[examined[2][0]]])
+
+class TestUpdateChanged(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        self.c = record.Collection(store=self.store, pathname=unicode(self.mktemp()))
+        os.mkdir(self.c.pathname)
+        self.processed = []
+        def _process(collection, pathnames, scanner=None, importer=None):
+            self.processed.extend(pathnames)
+        self.patch(record.Collection, "_process", _process)
+
+    def write(self, *parts):
+        pathname = os.path.join(self.c.pathname, *parts)
+        if not os.path.isdir(os.path.dirname(pathname)):
+            os.makedirs(os.path.dirname(pathname))
+        open(pathname, "w").write(pathname)
+        return pathname
+
+    def test_unchanged(self):
+        same = self.write(u"same.mp3")
+        self.c.record_file(same)
+        changed = self.write(u"changed.mp3")
+        self.c.record_file(changed)
+        open(changed, "a").write("more")
+        new = self.write(u"new.mp3")
+        d = self.c.update_changed([same, changed, new])
+        def _check(ignored):
+            self.assertEqual(self.processed, [changed, new])
+        return d.addCallback(_check)
 
+    def test_directory_removed(self):
+        importer = record.TrackImporter(self.c)
+        gone = [self.write(u"album", u"%d.mp3" % i) for i in range(2)]
+        # _ is a wildcard to LIKE
+        kept = self.write(u"albumX", u"1.mp3")
+        created = importer.create([(p, 1, details(i)) for i, p in enumerate(gone + [kept])])
+        for track in created:
+            self.c.record_file(track.pathname, track)
+        for pathname in gone:
+            os.unlink(pathname)
+        os.rmdir(os.path.dirname(gone[0]))
+        d = self.c.update_changed([os.path.join(self.c.pathname, u"album_")])
+        d.addCallback(lambda ignored: self.c.update_changed([os.path.join(self.c.pathname, u"album")]))
+        def _check(ignored):
+            self.assertEqual([r.pathname for r in self.store.query(record.FileRecord)], [kept])
+            self.assertEqual([t.pathname for t in self.store.query(record.Track)], [kept])
+            self.assertEqual(self.processed, [])
+        return d.addCallback(_check)
@@ -0,0 +1,68 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Automated unit tests for squeal.library.scanner. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+import os
+
+from twisted.python.util import sibpath
+from twisted.python.filepath import FilePath
+from twisted.trial import unittest
+
+from squeal import adaptivejson
+from squeal.library import scanner
+from squeal.library.policies import StandardPolicyMixin
+from squeal.library.artwork import ArtworkStore
+
+class TestScannerChild(unittest.TestCase):
+
+    def setUp(self):
+        self.artwork = FilePath(self.mktemp())
+        self.child = scanner.ScannerChild()
+        self.music = os.path.join(sibpath(__file__, "files"), "la.mp3")
+
+    def test_not_music(self):
+        pathname = self.mktemp()
+        open(pathname, "w").write("not music")
+        self.assertEqual(self.child.examine(pathname, ArtworkStore(self.artwork)),
+                         (pathname, None, None, None))
+
+    def test_music(self):
+        tags = {'title': u"la"}
+        self.patch(StandardPolicyMixin, "detailsFromTags", lambda self, pathname: tags)
+        self.assertEqual(self.child.examine(self.music, ArtworkStore(self.artwork)),
+                         (self.music, 1, tags, None))
+
+    def test_unreadable_tags(self):
+        def _detailsFromTags(self, pathname):
+            raise ValueError("bad tags")
+        self.patch(StandardPolicyMixin, "detailsFromTags", _detailsFromTags)
+        self.assertEqual(self.child.examine(self.music, ArtworkStore(self.artwork)),
+                         (self.music, 1, None, None))
+
+    def test_command(self):
+        def _examine(pathname, artwork, folders):
+            if pathname == u"broken":
+                raise IOError("unreadable")
+            return (pathname, None, None, None)
+        self.patch(self.child, "examine", _examine)
+        response = self.child.command_EXAMINE_FILES(adaptivejson.dumps([u"broken", u"fine"]),
+                                                    self.artwork.path)
+        self.assertEqual(adaptivejson.loads(response['results']),
+                         [[u"broken", None, None, None], [u"fine", None, None, None]])
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
@@ -0,0 +1,77 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Automated unit tests for squeal.library.search. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+from twisted.trial import unittest
+from axiom.store import Store
+
+from squeal.library import record
+from squeal.library import search
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        self.index = search.SearchIndex(self.store)
+        self.ministry = record.Artist(store=self.store, name=u"Ministry")
+        self.album = record.Album(store=self.store, artist=self.ministry, name=u"Psalm 69")
+        self.jesus = self.track(u"Jesus Built My Hotrod", u"Industrial")
+        self.hero = self.track(u"Hero", u"Industrial")
+        self.other = record.Track(store=self.store, title=u"Heroes", genre=u"Rock")
+
+    def track(self, title, genre):
+        return record.Track(store=self.store, artist=self.ministry,
+                            album=self.album, title=title, genre=genre)
+
+    def titles(self, query):
+        return [t.title for t in self.index.search(query)]
+
+    def test_tokens(self):
+        self.assertEqual(search.tokens(u"Jesus Built, my HOTROD!"),
+                         set([u"jesus", u"built", u"my", u"hotrod"]))
+        self.assertEqual(search.tokens(None), set())
+
+    def test_search(self):
+        self.index.index(list(self.store.query(record.Track)))
+        self.assertEqual(self.titles(u"her"), [u"Hero", u"Heroes"])
+        self.assertEqual(self.titles(u"min her"), [u"Hero"])
+        self.assertEqual(self.titles(u"psalm indus"), [u"Hero", u"Jesus Built My Hotrod"])
+        self.assertEqual(self.titles(u"nothing"), [])
+        self.assertEqual(self.titles(u""), [])
+
+    def test_build(self):
+        def _built(ignored):
+            self.assertEqual(self.titles(u"hot"), [u"Jesus Built My Hotrod"])
+            # a built index is left alone
+            self.assertEqual(self.index.build(), None)
+        return self.index.build().addCallback(_built)
+
+    def test_changed(self):
+        self.index.index(list(self.store.query(record.Track)))
+        self.hero.title = u"Stigmata"
+        self.index.changed(record.LibraryChangeEvent(changed=[self.hero]))
+        self.assertEqual(self.titles(u"her"), [u"Heroes"])
+        self.assertEqual(self.titles(u"stig"), [u"Stigmata"])
+
+    def test_removed(self):
+        self.index.index(list(self.store.query(record.Track)))
+        self.other.deleteFromStore()
+        self.index.changed(record.LibraryChangeEvent(removed=[self.other]))
+        self.assertEqual(self.titles(u"her"), [u"Hero"])
+        self.assertEqual(self.store.query(search.SearchTerm, search.SearchTerm.track == None).count(), 0)
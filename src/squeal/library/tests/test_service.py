@@ -0,0 +1,130 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Automated unit tests for squeal.library.service. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+from twisted.trial import unittest
+from axiom.store import Store
+
+from squeal import isqueal
+from squeal.event import EventReactor
+from squeal.library import record
+from squeal.library import web
+from squeal.library.ilibrary import ILibrary
+from squeal.library.service import Library
+from squeal.playlist.service import Playlist, track_cache
+
+class TestBrowse(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        self.library = Library(store=self.store)
+        titles = [u"b", None, u"a", u"b", None, u"c", u"b", u"a", None, u"b"]
+        self.tracks = [record.Track(store=self.store, title=t) for t in titles]
+        # nulls first, then ties in the order they were created
+        self.expected = [t.storeID for t in sorted(self.tracks,
+                         key=lambda t: (t.title is not None, t.title, t.storeID))]
+
+    def pages(self, count):
+        seen = []
+        after = None
+        while True:
+            page = [t.storeID for t in self.library.browse('tracks', after, count)]
+            if not page:
+                return seen
+            seen.extend(page)
+            after = page[-1]
+
+    def test_pages(self):
+        for count in 1, 2, 3, 4, 20:
+            self.assertEqual(self.pages(count), self.expected)
+
+    def test_removed_cursor(self):
+        gone = self.expected[3]
+        self.store.getItemByID(gone).deleteFromStore()
+        following = min(t.storeID for t in self.tracks if t.storeID > gone)
+        expected = [i for i in self.expected if i != gone]
+        page = [t.storeID for t in self.library.browse('tracks', gone, 20)]
+        self.assertEqual(page, expected[expected.index(following):])
+        last = self.tracks[-1].storeID
+        self.tracks[-1].deleteFromStore()
+        self.assertEqual(list(self.library.browse('tracks', last, 20)), [])
+
+    def test_more(self):
+        self.patch(web.LibraryElement, "library", self.library)
+        browser = web.Tracks()
+        self.patch(browser, "page_size", 4)
+        first = browser.more(None)
+        self.assertEqual([i[u'id'] for i in first[u'items']], self.expected[:4])
+        self.assertTrue(first[u'more'])
+        second = browser.more(first[u'items'][-1][u'id'])
+        self.assertEqual([i[u'id'] for i in second[u'items']], self.expected[4:8])
+        last = browser.more(second[u'items'][-1][u'id'])
+        self.assertEqual([i[u'id'] for i in last[u'items']], self.expected[8:])
+        self.assertFalse(last[u'more'])
+
+class TestArtwork(unittest.TestCase):
+
+    def test_default_artwork(self):
+        store = Store(filesdir=self.mktemp())
+        library = Library(store=store)
+        # not written until it is asked for
+        self.assertFalse(store.newFilePath("artwork").exists())
+        digest = library.cover(u"1")
+        self.assertEqual(digest, library.default_artwork)
+        self.assertTrue(library.artwork.path(digest).exists())
+
+class TestRemovedTracks(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store(self.mktemp())
+        EventReactor(store=self.store)
+        self.library = Library(store=self.store)
+        self.store.powerUp(self.library, ILibrary)
+        self.track = record.Track(store=self.store, title=u"Gone")
+        self.playlist = Playlist(store=self.store)
+        self.playlist.activate()
+        self.playlist.enqueue(self.track)
+
+    def test_get_track(self):
+        tid = unicode(self.track.storeID)
+        self.assertIdentical(self.library.get_track(tid), self.track)
+        self.assertEqual(self.library.get_track(unicode(self.library.storeID)), None)
+        self.track.deleteFromStore()
+        self.assertEqual(self.library.get_track(tid), None)
+
+    def test_no_artist(self):
+        t = isqueal.ITrack(self.track)
+        self.assertEqual((t.artist, t.album), (None, None))
+
+    def test_removed(self):
+        self.playlist.snapshot()
+        self.track.deleteFromStore()
+        ev = record.LibraryChangeEvent(self.library, removed=[self.track])
+        self.playlist.tracks.libraryChanged(ev)
+        self.playlist.libraryChanged(ev)
+        self.assertEqual(list(self.playlist), [])
+        self.assertEqual(self.playlist.snapshot()[u'items'], [])
+
+    def test_missing(self):
+        # removed while the server was not running, so nothing is cached
+        self.track.deleteFromStore()
+        track_cache(self.store).clear()
+        self.assertEqual(self.playlist.snapshot()[u'items'][0][u'tid'], unicode(self.track.storeID))
+        self.playlist.play()
+        self.assertEqual(list(self.playlist), [])
@@ -0,0 +1,131 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Automated unit tests for squeal.library.stream. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+import socket
+
+from twisted.trial import unittest
+from twisted.python.filepath import FilePath
+from axiom.store import Store
+
+from squeal.library import record
+from squeal.library import stream
+from squeal.library.tests.helpers import FakeRequest
+
+class FakeTransport(object):
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.writing = False
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def startWriting(self):
+        self.writing = True
+
+class TestParseRange(unittest.TestCase):
+
+    def test_whole(self):
+        self.assertEqual(stream.parse_range(None, 100), None)
+        self.assertEqual(stream.parse_range("", 100), None)
+        self.assertEqual(stream.parse_range("lines=1-2", 100), None)
+        self.assertEqual(stream.parse_range("bytes=x-y", 100), None)
+
+    def test_range(self):
+        self.assertEqual(stream.parse_range("bytes=0-9", 100), (0, 10))
+        self.assertEqual(stream.parse_range("bytes=10-", 100), (10, 100))
+        self.assertEqual(stream.parse_range("bytes=90-200", 100), (90, 100))
+        self.assertEqual(stream.parse_range("bytes=-10", 100), (90, 100))
+        self.assertEqual(stream.parse_range("bytes=-200", 100), (0, 100))
+        self.assertEqual(stream.parse_range("bytes=0-9,20-29", 100), (0, 10))
+
+    def test_unsatisfiable(self):
+        self.assertRaises(stream.Unsatisfiable, stream.parse_range, "bytes=100-", 100)
+        self.assertRaises(stream.Unsatisfiable, stream.parse_range, "bytes=-0", 100)
+
+class TestOpenTracks(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        self.file = FilePath(self.mktemp())
+        self.file.setContent("not really mp3" * 1000)
+        self.track = record.Track(store=self.store, title=u"Track",
+                                  pathname=self.file.path.decode("utf-8"))
+        self.tracks = stream.OpenTracks(self.store)
+
+    def test_get(self):
+        t = self.tracks.get(self.track.storeID)
+        self.assertEqual(t.size, len(self.file.getContent()))
+        self.assertEqual(t.content_type, "application/octet-stream")
+        self.assertIdentical(self.tracks.get(self.track.storeID), t)
+        self.assertRaises(KeyError, self.tracks.get, self.store.storeID)
+        self.assertRaises(KeyError, self.tracks.get, 1000)
+
+    def test_changed(self):
+        t = self.tracks.get(self.track.storeID)
+        self.tracks.changed(record.LibraryChangeEvent(changed=[self.track]))
+        self.assertNotIdentical(self.tracks.get(self.track.storeID), t)
+        self.assertTrue(t.file.closed)
+
+    def test_close_after_stream(self):
+        self.tracks.tracks.size = 1
+        t = self.tracks.get(self.track.storeID)
+        request = FakeRequest()
+        t.stream_started()
+        request.notifyFinish().addBoth(t.stream_finished)
+        other = record.Track(store=self.store, title=u"Other",
+                             pathname=self.file.path.decode("utf-8"))
+        self.tracks.get(other.storeID)
+        # still being streamed
+        self.assertFalse(t.file.closed)
+        request.connectionLost()
+        self.assertTrue(t.file.closed)
+
+    def test_produce(self):
+        t = self.tracks.get(self.track.storeID)
+        self.patch(stream.FileProducer, "block_size", 100)
+        request = FakeRequest()
+        producer = stream.FileProducer(request, t.file, 50, 1050)
+        producer.start()
+        while request.producer is not None:
+            producer.resumeProducing()
+        self.assertTrue(request.finished)
+        self.assertEqual(len(request.data), 10)
+        self.assertEqual("".join(request.data), self.file.getContent()[50:1050])
+
+    def test_sendfile(self):
+        if stream.sendfile is None:
+            raise unittest.SkipTest("sendfile is not available")
+        t = self.tracks.get(self.track.storeID)
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        transport = FakeTransport(a)
+        request = FakeRequest(transport)
+        producer = stream.SendfileProducer(request, t.file, 10, 14000)
+        producer.start()
+        # the first block goes out with the headers
+        self.assertEqual("".join(request.data), self.file.getContent()[10:10 + producer.block_size])
+        received = []
+        while request.producer is not None:
+            producer.resumeProducing()
+            received.append(b.recv(1 << 16))
+        self.assertTrue(request.finished)
+        self.assertEqual("".join(request.data + received), self.file.getContent()[10:14000])
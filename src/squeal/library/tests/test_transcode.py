@@ -0,0 +1,124 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Automated unit tests for squeal.library.transcode. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+import os
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.python.filepath import FilePath
+
+from squeal.library import transcode
+from squeal.library.tests.helpers import FakeRequest
+
+class TestTranscodePool(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(transcode, "profiles", {
+            'copy': ['cat', '%(pathname)s'],
+            'again': ['cat', '%(pathname)s'],
+            'slow': ['sleep', '10'],
+        })
+        base = FilePath(self.mktemp())
+        base.createDirectory()
+        self.track = base.child("track.flac")
+        self.track.setContent("not really flac" * 1000)
+        self.pathname = self.track.path.decode("utf-8")
+        self.pool = transcode.TranscodePool(base.child("cache"), size=1)
+
+    def test_transcode(self):
+        request = FakeRequest()
+        self.assertEqual(self.pool.get(self.pathname, 'copy'), None)
+        def _done(ignored):
+            self.assertTrue(request.finished)
+            self.assertEqual("".join(request.data), self.track.getContent())
+            self.assertEqual(self.pool.get(self.pathname, 'copy').getContent(), self.track.getContent())
+        return self.pool.transcode(request, self.pathname, 'copy').addCallback(_done)
+
+    def test_abandoned(self):
+        request = FakeRequest()
+        def _stop():
+            request.producer.stopProducing()
+        d = self.pool.transcode(request, self.pathname, 'slow')
+        # waits for the first to finish
+        later = FakeRequest()
+        d2 = self.pool.transcode(later, self.pathname, 'copy')
+        self.assertEqual(later.producer, None)
+        _stop()
+        def _done(ignored):
+            self.assertFalse(request.finished)
+            self.assertEqual(self.pool.get(self.pathname, 'slow'), None)
+            self.assertEqual(self.pool.cachedir.globChildren("*.slow*"), [])
+            return d2
+        return d.addCallback(_done)
+
+    def test_dropped(self):
+        request = FakeRequest()
+        d = self.pool.transcode(request, self.pathname, 'slow')
+        later = FakeRequest()
+        d2 = self.pool.transcode(later, self.pathname, 'copy')
+        # goes away before its turn
+        later.connectionLost()
+        self.assertEqual(self.pool.semaphore.waiting, [])
+        request.producer.stopProducing()
+        def _done(ignored):
+            self.assertEqual(later.producer, None)
+            self.assertEqual(later.data, [])
+            self.assertEqual(self.pool.get(self.pathname, 'copy'), None)
+            return d
+        return d2.addCallback(_done)
+
+    def test_gone_while_running(self):
+        request = FakeRequest()
+        d = self.pool.transcode(request, self.pathname, 'slow')
+        p, = self.pool.processes
+        request.connectionLost()
+        # the process is killed, but its turn is kept until it has exited
+        self.assertTrue(p.stopped)
+        self.assertEqual(self.pool.semaphore.tokens, 0)
+        self.assertEqual(self.pool.processes, set([p]))
+        def _ended(ignored):
+            self.assertEqual(self.pool.semaphore.tokens, 1)
+            self.assertEqual(self.pool.processes, set())
+            self.assertEqual(self.pool.cachedir.globChildren("*.slow*"), [])
+            return d
+        return p.done.addCallback(_ended)
+
+    def test_stop(self):
+        request = FakeRequest()
+        d = self.pool.transcode(request, self.pathname, 'slow')
+        later = FakeRequest()
+        d2 = self.pool.transcode(later, self.pathname, 'copy')
+        def _stopped(ignored):
+            self.assertEqual(self.pool.processes, set())
+            self.assertEqual(self.pool.semaphore.waiting, [])
+            self.assertEqual(later.producer, None)
+            return defer.DeferredList([d, d2])
+        return self.pool.stop().addCallback(_stopped)
+
+    def test_prune(self):
+        self.patch(transcode.TranscodePool, "cache_size", 20000)
+        d = self.pool.transcode(FakeRequest(), self.pathname, 'copy')
+        def _again(ignored):
+            os.utime(self.pool.cached(self.pathname, 'copy').path, (0, 0))
+            return self.pool.transcode(FakeRequest(), self.pathname, 'again')
+        def _done(ignored):
+            self.assertEqual(self.pool.get(self.pathname, 'copy'), None)
+            self.assertNotEqual(self.pool.get(self.pathname, 'again'), None)
+        return d.addCallback(_again).addCallback(_done)
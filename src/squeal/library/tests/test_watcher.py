@@ -0,0 +1,68 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Automated unit tests for squeal.library.watcher. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.python.filepath import FilePath
+
+from squeal.library.watcher import CollectionWatcher
+
+class FakeCollection(object):
+
+    pathname = u"/music"
+
+    def __init__(self):
+        self.updated = []
+
+    def update_changed(self, pathnames):
+        self.updated.append(pathnames)
+        return defer.succeed(None)
+
+class TestCollectionWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(CollectionWatcher, "clock", self.clock)
+        self.collection = FakeCollection()
+        self.watcher = CollectionWatcher(self.collection)
+
+    def notify(self, pathname):
+        self.watcher.notify(None, FilePath(pathname), 0)
+
+    def test_debounce(self):
+        self.notify("/music/a/1.mp3")
+        self.clock.advance(1)
+        self.notify("/music/a/2.mp3")
+        self.notify("/music/a/1.mp3")
+        self.clock.advance(CollectionWatcher.delay - 0.5)
+        self.assertEqual(self.collection.updated, [])
+        self.clock.advance(0.5)
+        self.assertEqual(self.collection.updated, [[u"/music/a/1.mp3", u"/music/a/2.mp3"]])
+        self.assertFalse(self.clock.getDelayedCalls())
+
+    def test_maxdelay(self):
+        # events that keep coming are dealt with every maxdelay seconds
+        for i in range(CollectionWatcher.maxdelay + 2):
+            self.notify("/music/%d.mp3" % i)
+            self.clock.advance(1)
+        self.assertEqual(len(self.collection.updated), 1)
+        self.assertEqual(len(self.collection.updated[0]), CollectionWatcher.maxdelay)
+        self.clock.advance(CollectionWatcher.delay)
+        self.assertEqual(len(self.collection.updated), 2)
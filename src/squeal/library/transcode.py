@@ -0,0 +1,198 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Transcoding library tracks for players that cannot decode them as they
+are. Each transcode runs ffmpeg in a child process, and only so many run at
+once. The output is sent to the player as it arrives, and the child is paused
+whenever the player falls behind. A copy is kept on disk, so a track that is
+played again is served from there instead. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+import os
+import hashlib
+import multiprocessing
+
+from zope.interface import implements
+from twisted.internet import reactor, defer, protocol, error
+from twisted.internet.interfaces import IPushProducer
+from twisted.python import log, procutils
+
+# the command for each format tracks can be transcoded to. Raw PCM is 16
+# bit little endian stereo at 44.1kHz, which is what squeezeboxes are told to
+# expect.
+profiles = {
+    'mp3': ['ffmpeg', '-v', 'quiet', '-i', '%(pathname)s', '-f', 'mp3', '-ab', '320k', '-'],
+    'pcm': ['ffmpeg', '-v', 'quiet', '-i', '%(pathname)s', '-f', 's16le', '-ar', '44100', '-ac', '2', '-'],
+}
+
+content_types = {
+    'mp3': 'audio/mpeg',
+    'pcm': 'audio/L16',
+}
+
+class TranscodeProcess(protocol.ProcessProtocol):
+
+    """ Sends the output of a transcode to the request, and writes it to the
+    cache as well. The copy in the cache is only kept if the transcode runs
+    to the end. """
+
+    implements(IPushProducer)
+
+    def __init__(self, request, partial, cached):
+        self.request = request
+        self.partial = partial
+        self.cached = cached
+        self.cache = partial.open("w")
+        self.stopped = False
+        self.done = defer.Deferred()
+
+    def connectionMade(self):
+        self.transport.closeStdin()
+        self.request.registerProducer(self, True)
+
+    def outReceived(self, data):
+        self.cache.write(data)
+        self.request.write(data)
+
+    def processEnded(self, reason):
+        self.cache.close()
+        if not self.stopped:
+            self.request.unregisterProducer()
+            self.request.finish()
+        if reason.check(error.ProcessDone) and not self.stopped:
+            self.partial.moveTo(self.cached)
+        else:
+            log.msg("Transcode of %s abandoned" % self.cached.basename(), system="squeal.library.transcode.TranscodeProcess")
+            self.partial.remove()
+        self.done.callback(None)
+
+    def pauseProducing(self):
+        self.transport.pauseProducing()
+
+    def resumeProducing(self):
+        self.transport.resumeProducing()
+
+    def stopProducing(self):
+        # the player has gone away
+        self.stopped = True
+        try:
+            # TERM is lost if it arrives before the child has exec'd, as the
+            # child still has the reactor's handler for it
+            self.transport.signalProcess('KILL')
+        except error.ProcessExitedAlready:
+            pass
+
+class TranscodePool(object):
+
+    """ Runs at most size transcodes at once, and keeps their results in
+    cachedir. Once the cache is bigger than cache_size the least recently
+    used results are removed. """
+
+    cache_size = 2 << 30
+
+    def __init__(self, cachedir, size=None):
+        if size is None:
+            size = multiprocessing.cpu_count()
+        self.cachedir = cachedir
+        if not cachedir.exists():
+            cachedir.createDirectory()
+        self.semaphore = defer.DeferredSemaphore(size)
+        self.processes = set()
+
+    def available(self, format):
+        return format in profiles and bool(procutils.which(profiles[format][0]))
+
+    def cached(self, pathname, format):
+        """ Where the transcode of the file to format is kept. The name
+        changes if the file does. """
+        st = os.stat(pathname)
+        key = hashlib.sha1("%s\0%d\0%d" % (pathname.encode("utf-8"), st.st_mtime, st.st_size)).hexdigest()
+        return self.cachedir.child("%s.%s" % (key, format))
+
+    def get(self, pathname, format):
+        """ The cached transcode of the file, or None if there is not one. """
+        cached = self.cached(pathname, format)
+        if not cached.exists():
+            return None
+        # so that prune knows it has been used
+        cached.touch()
+        return cached
+
+    def transcode(self, request, pathname, format):
+        """ Transcode the file to format, writing it to the request as it
+        arrives. Returns a deferred that fires when it has finished. A
+        request that goes away while it waits for its turn is dropped, and
+        one that goes away while it is running is stopped. Its turn is not
+        given up until the process has exited. """
+        cached = self.cached(pathname, format)
+        started = []
+        d = self.semaphore.acquire()
+        request.notifyFinish().addErrback(lambda ignored: d.cancel())
+        def _start(ignored):
+            partial = cached.temporarySibling(".partial")
+            p = TranscodeProcess(request, partial, cached)
+            args = [a % {'pathname': pathname.encode("utf-8")} for a in profiles[format]]
+            try:
+                reactor.spawnProcess(p, procutils.which(args[0])[0], args, env=os.environ)
+            except:
+                self.semaphore.release()
+                raise
+            started.append(p)
+            self.processes.add(p)
+            p.done.addBoth(_finished, p)
+            # cancelling kills the process, which releases the semaphore
+            # when it has exited
+            finished = defer.Deferred(lambda ignored: p.stopProducing())
+            def _ended(result):
+                if not finished.called:
+                    finished.callback(result)
+            p.done.addCallback(_ended)
+            return finished
+        def _finished(result, p):
+            self.processes.discard(p)
+            self.semaphore.release()
+            self.prune()
+            return result
+        def _cancelled(failure):
+            failure.trap(defer.CancelledError)
+            if started:
+                log.msg("Transcode of %s stopped" % cached.basename(), system="squeal.library.transcode.TranscodePool")
+            else:
+                log.msg("Transcode of %s dropped before it started" % cached.basename(), system="squeal.library.transcode.TranscodePool")
+        return d.addCallback(_start).addErrback(_cancelled)
+
+    def stop(self):
+        """ Drop the transcodes waiting for their turn and stop the ones
+        running. Returns a deferred that fires once they have ended. """
+        for d in list(self.semaphore.waiting):
+            d.cancel()
+        running = [p.done for p in self.processes]
+        for p in list(self.processes):
+            p.stopProducing()
+        return defer.DeferredList(running)
+
+    def prune(self):
+        """ Remove the least recently used transcodes until the cache fits in
+        cache_size. """
+        files = [(f.getModificationTime(), f.getsize(), f) for f in self.cachedir.children()
+                 if f.splitext()[1] != ".partial"]
+        total = sum(size for mtime, size, f in files)
+        for mtime, size, f in sorted(files):
+            if total <= self.cache_size:
+                break
+            f.remove()
+            total -= size
@@ -0,0 +1,88 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Watches collections for changes on disk, so the library is kept up to
+date without needing a rescan. Linux only, since it uses inotify. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+from twisted.internet import reactor
+from twisted.python import filepath
+from twisted.python import log
+from twisted.python.runtime import platform
+
+if platform.supportsINotify():
+    from twisted.internet import inotify
+else:
+    inotify = None
+
+def supported():
+    return inotify is not None
+
+class CollectionWatcher(object):
+
+    """ Watches a single collection. Events are gathered up by pathname, and
+    nothing is done until things have been quiet for delay seconds (or
+    maxdelay seconds have passed since the first event), so copying in a whole
+    album is dealt with in one go. """
+
+    delay = 2
+    maxdelay = 10
+    clock = reactor
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.notifier = None
+        self.pending = set()
+        self.call = None
+        self.first = None
+
+    def start(self):
+        log.msg("Watching %s" % self.collection.pathname, system="squeal.library.watcher.CollectionWatcher")
+        mask = (inotify.IN_CLOSE_WRITE | inotify.IN_CREATE | inotify.IN_DELETE |
+                inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO)
+        self.notifier = inotify.INotify()
+        self.notifier.startReading()
+        self.notifier.watch(filepath.FilePath(self.collection.pathname.encode("utf-8")),
+                            mask=mask, autoAdd=True, recursive=True,
+                            callbacks=[self.notify])
+
+    def stop(self):
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+        if self.notifier is not None:
+            self.notifier.loseConnection()
+            self.notifier = None
+
+    def notify(self, ignored, path, mask):
+        self.pending.add(path.path.decode("utf-8"))
+        now = self.clock.seconds()
+        if self.first is None:
+            self.first = now
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        delay = min(self.delay, self.first + self.maxdelay - now)
+        self.call = self.clock.callLater(max(delay, 0), self.flush)
+
+    def flush(self):
+        pathnames, self.pending = self.pending, set()
+        self.first = None
+        self.call = None
+        log.msg("%d paths changed in %s" % (len(pathnames), self.collection.pathname), system="squeal.library.watcher.CollectionWatcher")
+        d = self.collection.update_changed(sorted(pathnames))
+        d.addErrback(log.err, "Unable to update %s" % self.collection.pathname)
+        return d
@@ -19,6 +19,7 @@ __docformat__ = "restructuredtext en"
 
 from twisted.python.util import sibpath
 from twisted.python import log
+from twisted.web import http
 
 from nevow import page
 from nevow import loaders
@@ -31,11 +32,14 @@ from nevow import static
 
 from squeal.web import base
 from squeal import isqueal
+from squeal import adaptivejson
+from squeal import imaging
 
 import record
 import ilibrary
-import Image
-from StringIO import StringIO
+import transcode
+import stream
+import artwork
 
 template_dir = sibpath(__file__, 'templates')
 
@@ -88,38 +92,61 @@ class Track(page.Element):
             T.a(href="#", id=self.original.storeID)[self.original.title],
         ]
 
-class Artists(LibraryElement):
-    jsClass = u"Library.Artists"
-    docFactory = xmltemplate("artists.html")
+class Browser(LibraryElement):
+
+    """ A list of artists, albums or tracks. Only the first page is rendered
+    with the element, and the client asks for the rest as the user scrolls
+    down. """
+
+    kind = None
+    element = None
+    page_size = 50
+
+    def label(self, item):
+        return item.name
+
+    def window(self, after=None):
+        """ Return the next page of items, and whether there are more after
+        it. """
+        items = list(self.library.browse(self.kind, after, self.page_size + 1))
+        return items[:self.page_size], len(items) > self.page_size
 
     @page.renderer
-    def artists(self, request, tag):
-        def _(request, tag):
-            for a in self.library.artists():
-                yield Artist(a)
-        return tag[_]
+    def items(self, request, tag):
+        items, more = self.window()
+        tag[(self.element(i) for i in items)]
+        if more:
+            tag[T.li(class_="more")[T.a(href="#")["more..."]]]
+        return tag
+
+    @athena.expose
+    def more(self, after):
+        items, more = self.window(after)
+        return {
+            u'items': [{u'id': i.storeID, u'name': self.label(i)} for i in items],
+            u'more': more,
+        }
+
+class Artists(Browser):
+    jsClass = u"Library.Artists"
+    docFactory = xmltemplate("artists.html")
+    kind = 'artists'
+    element = Artist
 
-class Albums(LibraryElement):
+class Albums(Browser):
     jsClass = u"Library.Albums"
     docFactory = xmltemplate("albums.html")
+    kind = 'albums'
+    element = Album
 
-    @page.renderer
-    def albums(self, request, tag):
-        def _(request, tag):
-            for a in self.library.albums():
-                yield Album(a)
-        return tag[_]
-
-class Tracks(LibraryElement):
+class Tracks(Browser):
     jsClass = u"Library.Tracks"
     docFactory = xmltemplate("tracks.html")
+    kind = 'tracks'
+    element = Track
 
-    @page.renderer
-    def tracks(self, request, tag):
-        def _(request, tag):
-            for t in self.library.tracks():
-                yield Track(t)
-        return tag[_]
+    def label(self, item):
+        return item.title
 
 class Main(base.BaseElementContainer):
     jsClass = u"Library.Main"
@@ -162,6 +189,10 @@ class Main(base.BaseElementContainer):
     def track_count(self, request, tag):
         return "[%d]" % self.library.tracks().count()
 
+    @athena.expose
+    def search(self, query):
+        return map(adaptivejson.simplify, self.library.search(query))
+
     @athena.expose
     def play(self, itemID):
         log.msg("Playing %s" % itemID, system="squeal.library.web.Main")
@@ -176,6 +207,13 @@ class Main(base.BaseElementContainer):
 
 class Artwork(rend.Page):
 
+    """ The cover art for a track, or a thumbnail of it at least size pixels
+    square. The digest of the picture is its ETag, so browsers that already
+    have it are told so without it being read again. """
+
+    # how long browsers can use their copy before asking again
+    max_age = 24 * 60 * 60
+
     def __init__(self, original, trackID, size):
         self.original = original
         self.trackID = trackID
@@ -183,22 +221,72 @@ class Artwork(rend.Page):
 
     def renderHTTP(self, ctx):
         request = inevow.IRequest(ctx)
-        request.setHeader("content-type", "image/png")
-        data = open(sibpath(__file__, 'music.png')).read()
+        pictures = self.original.artwork
+        digest = self.original.cover(self.trackID)
+        size = None
         if self.size is not None:
-            s = StringIO(data)
-            image = Image.open(s)
-            image.thumbnail([int(self.size), int(self.size)], Image.ANTIALIAS)
-            s2 = StringIO()
-            image.save(s2, "PNG")
-            return s2.getvalue()
-        return data
+            size = pictures.bucket(int(self.size))
+        request.setHeader("cache-control", "public, max-age=%d" % self.max_age)
+        if request.setETag('"%s-%s"' % (digest, size or "full")) is http.CACHED:
+            return ""
+        def _missing(path):
+            if path is None:
+                # it has gone from the disk since it was found
+                return pictures.get(self.original.default_artwork, size)
+            return path
+        def _send(path):
+            data = path.getContent()
+            request.setHeader("content-type", artwork.content_type(data))
+            return data
+        def _busy(failure):
+            failure.trap(imaging.Busy)
+            request.setResponseCode(http.SERVICE_UNAVAILABLE)
+            request.setHeader("cache-control", "no-cache")
+            request.setHeader("retry-after", "1")
+            return ""
+        d = pictures.get(digest, size)
+        d.addCallback(_missing)
+        d.addCallback(_send)
+        return d.addErrback(_busy)
+
+class Transcode(rend.Page):
+
+    """ A track transcoded to another format as it is sent. """
+
+    def __init__(self, transcoder, pathname, format):
+        self.transcoder = transcoder
+        self.pathname = pathname
+        self.format = format
+
+    def renderHTTP(self, ctx):
+        request = inevow.IRequest(ctx)
+        request.setHeader("content-type", transcode.content_types[self.format])
+        self.transcoder.transcode(request, self.pathname, self.format)
+        return request.deferred
+
+class Search(rend.Page):
+
+    """ The search results for ?q=..., as JSON. """
+
+    def __init__(self, original, query, limit):
+        self.original = original
+        self.query = query
+        self.limit = limit
+
+    def renderHTTP(self, ctx):
+        request = inevow.IRequest(ctx)
+        request.setHeader("content-type", "application/json")
+        tracks = self.original.search(self.query.decode("utf-8"), self.limit)
+        return adaptivejson.dumps(list(tracks))
 
 class Root(rend.Page):
 
     """ This hangs from /library at the root of the server. See
     IRootResourceExtension """
 
+    # the most search results a client can ask for
+    search_limit = 200
+
     def renderHTTP(self, ctx):
         request = inevow.IRequest(ctx)
         request.redirect(request.URLPath().child('jukebox'))
@@ -206,11 +294,22 @@ class Root(rend.Page):
 
     def child_stream(self, ctx):
         log.msg("Request for library track %s received" % ctx.arg('tid'), system="squeal.web.service.Root")
-        tid = ctx.arg('tid')
-        track = self.original.store.getItemByID(int(tid))
-        if not isinstance(track, record.Track):
-            raise KeyError("Not a track")
-        return static.File(track.pathname)
+        track = self.original.open_tracks.get(int(ctx.arg('tid')))
+        format = ctx.arg('format')
+        if format is not None:
+            transcoder = self.original.transcoder
+            if transcoder is not None and transcoder.available(format):
+                cached = transcoder.get(track.pathname, format)
+                if cached is not None:
+                    return static.File(cached.path, defaultType=transcode.content_types[format])
+                return Transcode(transcoder, track.pathname, format)
+            log.msg("Unable to transcode to %s" % format, system="squeal.web.service.Root")
+        return stream.TrackStream(track)
+
+    def child_search(self, ctx):
+        query = ctx.arg("q") or ""
+        limit = min(int(ctx.arg("limit") or 50), self.search_limit)
+        return Search(self.original, query, limit)
 
     def child_image(self, ctx):
         image_id = ctx.arg("image")
@@ -41,6 +41,7 @@ from netaddr import EUI
 
 from squeal.event import EventReactor
 from squeal.player.display import Display
+from squeal.player.animation import Animator
 from squeal.player.volume import Volume
 from squeal.player.remote import Remote
 from squeal.player.visualisation import NoVisualisation, SpectrumAnalyser
@@ -90,6 +91,7 @@ class StateChanged(object):
         PLAYING = 4
         UNDERRUN = 5 # end of playback, not an error
         READY = 6
+        STARTED = 7 # a new track, rather than a resume
 
     def __init__(self, player, state):
         self.player = player
@@ -109,10 +111,12 @@ class SlimService(Item, service.Service):
     players = inmemory()
     factory = inmemory()
     running = inmemory()
+    animator = inmemory()
 
     def activate(self):
         self.players = []
         self.factory = Factory(self)
+        self.animator = Animator()
         self.evreactor.subscribe(self.button_pressed, IRemoteButtonPressedEvent)
 
     def button_pressed(self, ev):
@@ -128,13 +132,25 @@ class SlimService(Item, service.Service):
         strports.service(self.listen, self.factory).setServiceParent(self.parent)
         return service.Service.startService(self)
 
+    def stopService(self):
+        self.animator.stopAll()
+        return service.Service.stopService(self)
+
     def play(self, track):
         """ Play the track. """
         assert ITrack.providedBy(track)
         log.msg("Playing %r" % track, system="squeal.net.slimproto.SlimService")
         for p in self.players:
             p.play(track)
-        return len(self.players)
+        return list(self.players)
+
+    def queue(self, track):
+        """ Play the track once the one playing has finished. """
+        assert ITrack.providedBy(track)
+        log.msg("Queueing %r" % track, system="squeal.net.slimproto.SlimService")
+        for p in self.players:
+            p.queue(track)
+        return list(self.players)
 
     def pause(self):
         for p in self.players:
@@ -158,12 +174,40 @@ class Player(protocol.Protocol):
         3: 'p', # pcm (wav etc.)
     }
 
+    # the formats devices can decode, where it is not all of the above
+    deviceFormats = {
+        'squeezebox': 'mp',
+    }
+
+    # the format byte for tracks this player cannot decode, and the format
+    # they are transcoded to on the server
+    transcodeFormat = ('m', 'mp3')
+
     def __init__(self):
-        self.buffer = ''
+        self.buffer = bytearray()
         self.display = Display()
         self.volume = Volume()
         self.device_type = None
         self.mac_address = None
+        # the track that will start when the one playing ends
+        self.queued = None
+        # the track most recently streamed
+        self.streaming = None
+        # the text most recently asked to be shown on the display
+        self.showing = None
+        self.formats = set(self.typeMap.values())
+        self.operations = self.handlers("process_", exclude="process_remote_")
+        self.stat_handlers = self.handlers("stat_")
+
+    def handlers(self, prefix, exclude=None):
+        """ Map each name following prefix to the method that handles it, so
+        incoming messages can be dispatched without looking the handler up
+        each time. """
+        table = {}
+        for name in dir(self):
+            if name.startswith(prefix) and not (exclude and name.startswith(exclude)):
+                table[name[len(prefix):]] = getattr(self, name)
+        return table
 
     @property
     def service(self):
@@ -177,22 +221,36 @@ class Player(protocol.Protocol):
         log.msg("Connected to squeezebox", system="squeal.net.slimproto.Player")
 
     def connectionLost(self, reason=protocol.connectionDone):
+        self.showing = None
+        self.service.animator.stop(self)
         self.service.evreactor.fireEvent(StateChanged(self, StateChanged.State.DISCONNECTED))
         self.service.players.remove(self)
 
     def dataReceived(self, data):
-        self.buffer = self.buffer + data
-        if len(self.buffer) > 8:
-            operation, length = self.buffer[:4], self.buffer[4:8]
-            length = struct.unpack('!I', length)[0]
-            plen = length + 8
-            if len(self.buffer) >= plen:
-                packet, self.buffer = self.buffer[8:plen], self.buffer[plen:]
-                operation = operation.strip("!").strip(" ")
-                handler = getattr(self, "process_%s" % operation, None)
-                if handler is None:
-                    raise NotImplementedError
-                handler(packet)
+        """ Process every complete frame that has arrived. Each frame is an
+        operation code, a length and then the packet itself. Whatever is left
+        over is kept until the rest of it turns up. """
+        self.buffer.extend(data)
+        offset = 0
+        available = len(self.buffer)
+        try:
+            while available - offset >= 8:
+                (length,) = struct.unpack_from('!I', self.buffer, offset + 4)
+                end = offset + 8 + length
+                if end > available:
+                    break
+                operation = str(self.buffer[offset:offset + 4])
+                packet = str(self.buffer[offset + 8:end])
+                offset = end
+                self.dispatch(operation, packet)
+        finally:
+            del self.buffer[:offset]
+
+    def dispatch(self, operation, packet):
+        handler = self.operations.get(operation.strip("!").strip(" "))
+        if handler is None:
+            raise NotImplementedError("Operation %r not known" % operation)
+        handler(packet)
 
     def send_frame(self, command, data):
         packet = struct.pack('!H', len(data) + 4) + command + data
@@ -228,15 +286,34 @@ class Player(protocol.Protocol):
         self.stop_streaming()
 
     def play(self, track):
+        self.queued = None
+        self.stream(track)
+        log.msg("Requesting play from squeezebox %s" % (id(self),), system="squeal.net.slimproto.Player")
+        self.displayTrack(track)
+
+    def queue(self, track):
+        """ Start streaming the track while the one before it is still
+        playing. This should only be done once the decoder is ready (STMd).
+        The player starts the track the moment the one before it runs out,
+        with no gap between them, and says so with STMs. """
+        self.queued = track
+        self.stream(track)
+        log.msg("Queueing track on squeezebox %s" % (id(self),), system="squeal.net.slimproto.Player")
+
+    def stream(self, track):
         command = 's'
         autostart = '1'
-        formatbyte = self.typeMap[track.type]
+        self.streaming = track
+        formatbyte = self.typeMap[track.track_type]
+        uri = track.player_uri(id(self))
+        if formatbyte not in self.formats:
+            formatbyte, format = self.transcodeFormat
+            uri += "&format=" + format
+            log.msg("Asking for the track as %s" % format, system="squeal.net.slimproto.Player")
         data = self.pack_stream(command, autostart=autostart, flags=0x00, formatbyte=formatbyte)
-        request = "GET %s HTTP/1.0\r\n\r\n" % (track.player_uri(id(self)),)
+        request = "GET %s HTTP/1.0\r\n\r\n" % (uri,)
         data = data + request.encode("utf-8")
         self.send_frame('strm', data)
-        log.msg("Requesting play from squeezebox %s" % (id(self),), system="squeal.net.slimproto.Player")
-        self.displayTrack(track)
 
     def displayTrack(self, track):
         self.render("%s by %s" % (track.title, track.artist))
@@ -248,6 +325,7 @@ class Player(protocol.Protocol):
         mac = EUI(mac)
         self.device_type = devices.get(devId, 'unknown device')
         self.mac_address = str(mac)
+        self.formats = set(self.deviceFormats.get(self.device_type, self.typeMap.values()))
         log.msg("HELO received from %s %s" % (self.mac_address, self.device_type), system="squeal.net.slimproto.Player")
         self.init_client()
 
@@ -281,10 +359,23 @@ class Player(protocol.Protocol):
     def set_visualisation(self, visualisation):
         self.send_frame("visu", visualisation.pack())
 
-    def render(self, text):
-        self.display.clear()
-        self.display.renderText(text, "DejaVu-Sans", 16, (0,0))
-        self.updateDisplay(self.display.frame())
+    def render(self, text, fontName="DejaVu-Sans", size=16):
+        """ Show the text on the display, scrolling it if it is too wide to
+        fit. The text is laid out away from the reactor, and is not shown if
+        something else has been shown since. """
+        self.showing = showing = object()
+        def _show((kind, data)):
+            if self.showing is not showing:
+                return
+            if kind == 'strip':
+                self.service.animator.scroll(self, data)
+            else:
+                self.service.animator.stop(self)
+                self.updateDisplay(data)
+        d = self.display.render(text, fontName, size)
+        d.addCallback(_show)
+        d.addErrback(log.err, "Unable to show %r" % text, system="squeal.net.slimproto.Player")
+        return d
 
     def updateDisplay(self, bitmap, transition = 'c', offset=0, param=0):
         frame = struct.pack("!Hcb", offset, transition, param) + bitmap
@@ -296,7 +387,7 @@ class Player(protocol.Protocol):
         if ev == '\x00\x00\x00\x00':
             log.msg("Presumed informational stat message", system="squeal.net.slimproto.Player")
         else:
-            handler = getattr(self, 'stat_%s' % ev, None)
+            handler = self.stat_handlers.get(ev)
             if handler is None:
                 raise NotImplementedError("Stat message %r not known" % ev)
             handler(data[4:])
@@ -328,6 +419,14 @@ class Player(protocol.Protocol):
 
     def stat_STMn(self, data):
         log.msg("Decoder does not support file format", system="squeal.net.slimproto.Player")
+        track = self.streaming
+        if track is None:
+            return
+        formatbyte = self.typeMap[track.track_type]
+        if formatbyte in self.formats and formatbyte != self.transcodeFormat[0]:
+            # try again, transcoded to something it can play
+            self.formats.discard(formatbyte)
+            self.stream(track)
 
     def stat_STMo(self, data):
         log.msg("Output Underrun", system="squeal.net.slimproto.Player")
@@ -342,7 +441,10 @@ class Player(protocol.Protocol):
 
     def stat_STMs(self, data):
         log.msg("Player status message: playback of new track has started", system="squeal.net.slimproto.Player")
-        self.service.evreactor.fireEvent(StateChanged(self, StateChanged.State.PLAYING))
+        if self.queued is not None:
+            self.displayTrack(self.queued)
+            self.queued = None
+        self.service.evreactor.fireEvent(StateChanged(self, StateChanged.State.STARTED))
 
     def stat_STMt(self, data):
         """ Timer heartbeat """
@@ -0,0 +1,95 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Scrolling text on player displays. Text too wide for the display is
+rendered once onto a strip (see Display.render), and the animator sends
+each player successive windows of it. A single timer drives every player that
+is scrolling, and it only runs while there is something to scroll. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+from twisted.internet import task
+
+from squeal.player.display import window
+
+class Scroll(object):
+
+    """ The progress of a strip scrolling across one player's display. The
+    text is held still for a moment each time it comes round to the start. """
+
+    def __init__(self, player, strip, step, hold):
+        self.player = player
+        self.strip = strip
+        self.columns = len(strip) / 4
+        self.step = step
+        self.hold = hold
+        self.offset = 0
+        self.wait = hold
+
+    def frame(self):
+        return window(self.strip, self.offset)
+
+    def advance(self):
+        """ Move on to the next frame, returning False if the display is being
+        held still and there is nothing new to send. """
+        if self.wait:
+            self.wait -= 1
+            return False
+        self.offset += self.step
+        if self.offset >= self.columns:
+            self.offset = 0
+            self.wait = self.hold
+        return True
+
+class Animator(object):
+
+    """ Scrolls text on any number of players from one timer. """
+
+    # frames per second
+    rate = 15
+    # columns moved each frame
+    step = 2
+    # seconds the start of the text is held on the display
+    hold = 2
+
+    def __init__(self):
+        self.scrolls = {}
+        self.loop = task.LoopingCall(self.tick)
+
+    def scroll(self, player, strip):
+        """ Start scrolling the packed strip across the player's display,
+        replacing anything already scrolling there. """
+        s = Scroll(player, strip, self.step, int(self.hold * self.rate))
+        self.scrolls[player] = s
+        player.updateDisplay(s.frame())
+        if not self.loop.running:
+            self.loop.start(1.0 / self.rate, now=False)
+
+    def stop(self, player):
+        """ Stop any scrolling on the player's display. """
+        self.scrolls.pop(player, None)
+        if not self.scrolls and self.loop.running:
+            self.loop.stop()
+
+    def stopAll(self):
+        self.scrolls.clear()
+        if self.loop.running:
+            self.loop.stop()
+
+    def tick(self):
+        for s in self.scrolls.values():
+            if s.advance():
+                s.player.updateDisplay(s.frame())
@@ -20,23 +20,64 @@ __docformat__ = "restructuredtext en"
 __version__ = "$Revision$"[11:-2]
 
 import os
-import struct
+import threading
 import Image, ImageDraw, ImageFont
 
 from twisted.python.util import sibpath
 
+from twisted.internet import defer
+
+from squeal.util import LRUCache
+from squeal import imaging
+
 fontdir = sibpath(__file__, 'font')
 
+def tobytes(image):
+    """ The raw image data. Pillow renamed tostring to tobytes. """
+    try:
+        return image.tobytes()
+    except AttributeError:
+        return image.tostring()
+
+def pack(image):
+    """ Pack a one bit image 32 pixels high as the player wants it: each
+    column as a big endian 32 bit word, with the top pixel in the most
+    significant bit. Transposing the image makes each column a row, and a
+    one bit image packs its rows in exactly that form. """
+    columns = image.transpose(Image.ROTATE_90).transpose(Image.FLIP_TOP_BOTTOM)
+    return tobytes(columns)
+
+def window(strip, offset, width=320):
+    """ The frame showing width columns of a packed strip, starting at
+    column offset and wrapping around to the start of the strip. """
+    start = offset * 4
+    end = start + width * 4
+    if end <= len(strip):
+        return strip[start:end]
+    return strip[start:] + strip[:end - len(strip)]
+
 class Font(object):
 
     def __init__(self, name):
         self.filename = os.path.join(fontdir, name + ".ttf")
-        self.cache = {}
-
-    def render(self, s, size=15):
-        """ Returns a PIL image with this string rendered into it """
-        self.cache.setdefault(size, ImageFont.truetype(self.filename, size))
-        font = self.cache[size]
+        # the fonts loaded by each thread, by size
+        self.loaded = threading.local()
+
+    def truetype(self, size):
+        """ The font at size. Each thread loads fonts of its own, because a
+        FreeType face must not be used by two threads at once. """
+        cache = getattr(self.loaded, 'cache', None)
+        if cache is None:
+            cache = self.loaded.cache = {}
+        font = cache.get(size)
+        if font is None:
+            font = cache[size] = ImageFont.truetype(self.filename, size)
+        return font
+
+    def draw(self, s, size=15):
+        """ Returns a new PIL image with this string rendered into it. This
+        is safe to call from the image pool. """
+        font = self.truetype(size)
         siz = font.getsize(s)
         im = Image.new("RGB", siz)
         draw = ImageDraw.Draw(im)
@@ -71,11 +112,24 @@ class Display(object):
         server_normal = 1
         server_ticker = 2
 
+    # fonts are shared by every display
+    fonts = None
+
+    width = 320
+
+    # frames of text rendered on an otherwise clear display, shared by every
+    # display, as (image, frame)
+    text_frames = LRUCache(256)
+
+    # packed strips of text too wide for the display, shared by every display
+    text_strips = LRUCache(64)
+
     def __init__(self):
         self.image = Image.new("1", (320, 32))
-        self.fonts = {}
-        for f in self.availableFonts():
-            self.fonts[f] = Font(f)
+        if Display.fonts is None:
+            Display.fonts = {}
+            for f in self.availableFonts():
+                Display.fonts[f] = Font(f)
 
     def clear(self):
         self.image.paste(0, (0,0,320,32))
@@ -85,19 +139,48 @@ class Display(object):
             if f.endswith(".ttf"):
                 yield f[:-len(".ttf")]
 
-    def renderText(self, text, fontName, size, position):
-        font = self.fonts[fontName]
-        im = font.render(text, size)
-        self.image.paste(im, position)
-
     def frame(self):
         """ Return the frame ready for transmission """
-        pixmap = self.image.load()
-        words = []
-        for col in range(0,320):
-            word = 0
-            for bit in range(0, 32):
-                set = 1 if pixmap[col, 31-bit] else 0
-                word += set << bit
-            words.append(word)
-        return struct.pack("!320I", *words)
+        return pack(self.image)
+
+    def render(self, text, fontName, size, gap=40):
+        """ Lay the text out for the display, in the image pool unless it has
+        been laid out already. Returns a deferred that fires with ('frame',
+        frame) for text that fits on the display, or with ('strip', strip)
+        for text that has to be scrolled. If the pool is full of other work
+        the text is laid out here instead, rather than leaving the display
+        showing something stale. """
+        cached = self.text_frames.get((text, fontName, size))
+        if cached is not None:
+            self.image.paste(cached[0], (0,0))
+            return defer.succeed(('frame', cached[1]))
+        strip = self.text_strips.get((text, fontName, size, gap))
+        if strip is not None:
+            return defer.succeed(('strip', strip))
+        def _store((image, frame)):
+            if frame is None:
+                self.text_strips.put((text, fontName, size, gap), image)
+                return ('strip', image)
+            self.text_frames.put((text, fontName, size), (image, frame))
+            self.image.paste(image, (0,0))
+            return ('frame', frame)
+        def _busy(failure):
+            failure.trap(imaging.Busy)
+            return self.layout(self.fonts[fontName], text, size, gap)
+        d = imaging.pool.run(self.layout, self.fonts[fontName], text, size, gap)
+        return d.addErrback(_busy).addCallback(_store)
+
+    def layout(self, font, text, size, gap):
+        """ The text on a clear display and the frame of it, or a packed
+        strip of it and None if it is too wide. This normally runs in the
+        image pool.
+        The font is only used through Font.draw, which loads its fonts for
+        each thread, and nothing else it touches is shared. """
+        im = font.draw(text, size)
+        if im.size[0] > self.width:
+            image = Image.new("1", (im.size[0] + gap, 32))
+            image.paste(im, (0,0))
+            return pack(image), None
+        image = Image.new("1", (self.width, 32))
+        image.paste(im, (0,0))
+        return image, pack(image)
@@ -13,7 +13,30 @@
 # limitations under the License.
 
 """ Playlist management for squeal. Manages a persistent queue of tracks, and
-schedules the for playing as appropriate. """
+schedules the for playing as appropriate.
+
+Ordering the queue
+==================
+
+A PlayTrack's position is a key that sorts it into the queue, not its index
+in it. Keys are handed out with gaps between them, so a track can be put
+anywhere in the queue by picking a key in the gap where it is to go, without
+touching any other track. Only when a gap runs out is the whole queue
+renumbered, and that gets rarer the more room renumbering leaves. The
+current position is a key too, and the next track to play is the first one
+after it, so removing tracks, the current one included, needs no
+renumbering either.
+
+Moving on to the next track
+===========================
+
+Once a player's decoder has all of the track it is playing, it says it is
+ready (STMd). When every player that was sent the track is ready, the next
+track is queued on them, and each starts it as soon as the track playing ends,
+without a gap. It only becomes the current track when the players say it has
+started. Some time before the end of a track, the source of the next track is
+asked to get it ready too, if it can, which for the library means reading the
+file into memory. """
 
 __author__ = "Doug Winter <doug.winter@isotoma.com>"
 __docformat__ = "restructuredtext en"
@@ -23,14 +46,78 @@ from zope.interface import Interface, implements
 from twisted.python.components import registerAdapter, Adapter
 from twisted.application import service
 from twisted.python import log
+from twisted.internet import reactor
 from axiom.item import Item
-from axiom.attributes import reference, inmemory, text, integer, timestamp
+from axiom.attributes import reference, inmemory, text, integer, timestamp, AND
 
-from squeal.event import EventReactor
+from squeal.event import EventReactor, ChangeEvent
 from squeal.adaptivejson import IJsonAdapter
 from squeal import adapters, isqueal
+from squeal.util import LRUCache
 
 import time
+import weakref
+
+class TrackCache(object):
+
+    """ The tracks that PlayTracks refer to, as resolved by their providers,
+    along with their JSON encoders. Adapting is not free either: adapting
+    anything backed by an Item looks for powerups in the store. Entries are
+    dropped when the library changes. Tracks that had not loaded when they
+    were cached are dropped when new metadata arrives. Tracks their provider
+    no longer has are None, and are not cached. """
+
+    def __init__(self, size=10000):
+        self.tracks = LRUCache(size)
+        self.unloaded = set()
+
+    def entry(self, provider, tid):
+        key = (provider.storeID, tid)
+        entry = self.tracks.get(key)
+        if entry is None:
+            track = provider.get_track(tid)
+            if track is None:
+                return (None, None)
+            track = isqueal.ITrack(track)
+            entry = (track, IJsonAdapter(track))
+            self.tracks.put(key, entry)
+            if not track.is_loaded:
+                self.unloaded.add(key)
+        return entry
+
+    def get(self, provider, tid):
+        return self.entry(provider, tid)[0]
+
+    def encoder(self, provider, tid):
+        return self.entry(provider, tid)[1]
+
+    def remove(self, provider, tid):
+        key = (provider.storeID, tid)
+        self.tracks.remove(key)
+        self.unloaded.discard(key)
+
+    def clear(self):
+        self.tracks.clear()
+        self.unloaded = set()
+
+    def metadataChanged(self, ev):
+        for key in self.unloaded:
+            self.tracks.remove(key)
+        self.unloaded = set()
+
+    def libraryChanged(self, ev):
+        for t in list(ev.changed) + list(ev.removed):
+            self.remove(ev.provider, isqueal.ITrack(t).track_id)
+
+# the TrackCache for each store
+caches = weakref.WeakKeyDictionary()
+
+def track_cache(store):
+    """ The TrackCache shared by the PlayTracks in store. """
+    cache = caches.get(store)
+    if cache is None:
+        cache = caches[store] = TrackCache()
+    return cache
 
 class PlayTrack(Item):
 
@@ -39,15 +126,14 @@ class PlayTrack(Item):
 
     implements(isqueal.ITrack)
 
-    position = integer(default=0)
+    position = integer(default=0, indexed=True)
     added = timestamp()
     tid = text()
     provider = reference()
 
     @property
     def track(self):
-        # caching this locally in memory may or may not be a good idea
-        return isqueal.ITrack(self.provider.get_track(self.tid))
+        return track_cache(self.store).get(self.provider, self.tid)
 
     # these are the ITrack interface. __getattr__ does weird shit with Axiom,
     # so I opted for simple-but-lots-of-typing
@@ -90,26 +176,31 @@ class PlayTrack(Item):
 
 class PlayTrackJSON(Adapter):
     def encode(self):
-        encoded = IJsonAdapter(isqueal.ITrack(self.original.track)).encode()
-        encoded.update({
+        playtrack = self.original
+        encoder = track_cache(playtrack.store).encoder(playtrack.provider, playtrack.tid)
+        if encoder is None:
+            # gone from its source, and about to be removed from the queue
+            return self.stub()
+        encoded = encoder.encode()
+        encoded.update(self.stub())
+        return encoded
+
+    def stub(self):
+        """ Just enough to put the PlayTrack in its place in the queue,
+        without resolving its track. """
+        return {
+            u'pid': self.original.storeID,
             u'position': self.original.position,
             u'added': self.original.added,
             u'tid': unicode(self.original.tid),
-        })
-        return encoded
+        }
 
 registerAdapter(PlayTrackJSON, PlayTrack, IJsonAdapter)
 
-class PlaylistChangeEvent(object):
+class PlaylistChangeEvent(ChangeEvent):
 
     implements(isqueal.IPlaylistChangeEvent)
 
-    def __init__(self, added=(), removed=(), changed=(), playing=None):
-        self.added = added
-        self.removed = removed
-        self.changed = changed
-        self.playing = playing
-
 class Playlist(Item, service.Service):
 
     """ The service that hosts the list of tracks queued up to play on the
@@ -121,12 +212,45 @@ class Playlist(Item, service.Service):
 
     playing = inmemory()
     current = integer(default=-1) # currently playing
-    maxposition = integer(default=0) # the highest track number
+    maxposition = integer(default=0) # beyond the last track
     running = inmemory()
     name = inmemory()
     parent = inmemory()
     previous_playtime = inmemory()
     last_started = inmemory()
+    # the number of the latest change to the playlist
+    version = inmemory()
+    # the most recent changes, as (version, change)
+    changelog = inmemory()
+    # PlayTracks sent to clients before their metadata was loaded
+    unloaded = inmemory()
+    # the players the current track was sent to
+    listening = inmemory()
+    # the players sent the current track part way through it, whose
+    # playback starting says nothing about the others
+    joining = inmemory()
+    # the players the pending track was queued on
+    queued = inmemory()
+    # the players whose decoders are ready for the next track
+    ready = inmemory()
+    # the PlayTrack queued on the players to follow the current one
+    pending = inmemory()
+    # the storeID of the PlayTrack whose source was asked to get it ready
+    prefetched = inmemory()
+    prefetch_timer = inmemory()
+    # the tracks the queue's PlayTracks resolve to
+    tracks = inmemory()
+
+    changelog_size = 1000
+    # clients are sent the details of this many tracks at the start of the
+    # queue, and ask for the rest as they come into view. Inserting more
+    # than this at once makes them reload instead of being sent each one.
+    window = 50
+    # the gap left between the positions of adjacent tracks
+    spacing = 1 << 16
+    # seconds before the end of a track that the next one is got ready
+    prefetch_lead = 15
+    clock = reactor
 
     def time_played(self):
         if self.playing:
@@ -142,16 +266,238 @@ class Playlist(Item, service.Service):
         self.playing = False
         self.previous_playtime = 0
         self.last_started = 0
+        self.version = 0
+        self.changelog = []
+        self.unloaded = set()
+        self.listening = set()
+        self.joining = set()
+        self.queued = set()
+        self.ready = set()
+        self.pending = None
+        self.prefetched = None
+        self.prefetch_timer = None
+        # the track cache must be up to date before anything else hears
+        self.tracks = track_cache(self.store)
+        self.evreactor.subscribe(self.tracks.metadataChanged, isqueal.IMetadataChangeEvent)
+        self.evreactor.subscribe(self.tracks.libraryChanged, isqueal.ILibraryChangeEvent)
         self.evreactor.subscribe(self.playerState, isqueal.IPlayerStateChange)
         self.evreactor.subscribe(self.buttonPressed, isqueal.IRemoteButtonPressedEvent)
+        self.evreactor.subscribe(self.metadataChanged, isqueal.IMetadataChangeEvent, interval=0.5)
+        self.evreactor.subscribe(self.libraryChanged, isqueal.ILibraryChangeEvent)
+
+    def record(self, op, **kw):
+        """ Add a change to the change log. Clients that are up to date are
+        sent just the changes, rather than the whole playlist. """
+        change = {u'op': op}
+        for k, v in kw.items():
+            change[unicode(k)] = v
+        self.version += 1
+        self.changelog.append((self.version, change))
+        del self.changelog[:-self.changelog_size]
+
+    def recordInsert(self, playtrack):
+        self.record(u'insert', item=self.encode(playtrack))
+
+    def encode(self, playtrack):
+        """ The details of the PlayTrack for a client, which is sent an
+        update if they are not loaded yet. """
+        item = PlayTrackJSON(playtrack).encode()
+        if not item.get(u'isLoaded', True):
+            self.unloaded.add(playtrack.storeID)
+        return item
+
+    def changes_since(self, version):
+        """ Return the changes made after version, or None if they are no
+        longer in the log and the client needs a snapshot instead. """
+        if version == self.version:
+            return []
+        if not self.changelog or version < self.changelog[0][0] - 1 or version > self.version:
+            return None
+        start = version + 1 - self.changelog[0][0]
+        return [change for v, change in self.changelog[start:]]
+
+    def snapshot(self):
+        """ The whole playlist, for clients that are not up to date. Only
+        the first window of tracks have their details, so that a long queue
+        does not need every track resolved. """
+        items = []
+        for i, p in enumerate(self):
+            # not simplify, which would look for powerups for every PlayTrack
+            if i < self.window:
+                items.append(self.encode(p))
+            else:
+                items.append(PlayTrackJSON(p).stub())
+        return {
+            u'version': self.version,
+            u'items': items,
+            u'current': self.current,
+        }
+
+    def details(self, pids):
+        """ The details of the PlayTracks with the storeIDs pids, for
+        clients that were sent them without. Any that have been removed are
+        left out. """
+        items = []
+        for pid in pids:
+            playtrack = self.store.getItemByID(pid, None)
+            if isinstance(playtrack, PlayTrack):
+                items.append(self.encode(playtrack))
+        return items
+
+    def metadataChanged(self, ev):
+        """ Send updates for tracks that were waiting for their metadata. """
+        changed = []
+        for pid in list(self.unloaded):
+            playtrack = self.store.getItemByID(pid, None)
+            if playtrack is None:
+                self.unloaded.discard(pid)
+            elif playtrack.is_loaded:
+                self.unloaded.discard(pid)
+                self.record(u'update', item=PlayTrackJSON(playtrack).encode())
+                changed.append(playtrack)
+        if changed:
+            for r in self.store.powerupsFor(isqueal.IEventReactor):
+                r.fireEvent(PlaylistChangeEvent(changed=changed))
+
+    def libraryChanged(self, ev):
+        """ Send updates for queued tracks whose details have changed in the
+        library, and take tracks that have been removed from it out of the
+        queue. Spotify tracks do not change once they have loaded, so only
+        the library needs this. """
+        changed = self.queued_tracks(ev.provider, ev.changed)
+        for p in changed:
+            self.record(u'update', item=self.encode(p))
+        if changed:
+            for r in self.store.powerupsFor(isqueal.IEventReactor):
+                r.fireEvent(PlaylistChangeEvent(changed=changed))
+        removed = self.queued_tracks(ev.provider, ev.removed)
+        if removed:
+            self.remove(*removed)
+
+    def queued_tracks(self, provider, tracks):
+        """ The PlayTracks in the queue for any of the provider's tracks. """
+        tids = set(isqueal.ITrack(t).track_id for t in tracks)
+        if not tids:
+            return []
+        return [p for p in self.store.query(PlayTrack, PlayTrack.provider == provider)
+                if p.tid in tids]
 
     def playerState(self, ev):
         """ Called by the event system in response to player state change events. """
         # TODO: this should wait till we've heard from all players that we believe are still connected
         if ev.state == ev.State.PAUSED:
             self.players_paused()
+        elif ev.state == ev.State.STARTED:
+            if ev.player in self.joining:
+                # the rest are still part way through the track
+                self.joining.discard(ev.player)
+                return
+            if self.pending is not None:
+                self.started(self.pending)
+            self.previous_playtime = 0
+            self.players_playing()
         elif ev.state == ev.State.PLAYING:
             self.players_playing()
+        elif ev.state == ev.State.READY:
+            self.ready.add(ev.player)
+            self.queue_next()
+        elif ev.state == ev.State.UNDERRUN:
+            self.players_finished()
+        elif ev.state == ev.State.ESTABLISHED:
+            self.player_joined(ev.player)
+        elif ev.state == ev.State.DISCONNECTED:
+            self.player_left(ev.player)
+
+    def player_joined(self, player):
+        """ A player that connects part way through a track is sent it too,
+        so that it can join in. """
+        current = self.get_current_track()
+        if not self.playing or current is None:
+            return
+        log.msg("Sending %r to a new player" % current.track, system="squeal.playlist.service.Playlist")
+        player.play(current.track)
+        self.listening.add(player)
+        self.joining.add(player)
+
+    def player_left(self, player):
+        self.listening.discard(player)
+        self.joining.discard(player)
+        self.queued.discard(player)
+        self.ready.discard(player)
+        self.queue_next()
+
+    def queue_next(self):
+        """ Queue the next track on the players once all of them have the
+        whole of the current one. """
+        if self.pending is not None or not self.ready or not self.ready.issuperset(self.listening):
+            return
+        p = self.get_next_track()
+        if p is None:
+            return
+        if p.track is None:
+            self.unavailable(p)
+            return self.queue_next()
+        log.msg("Queueing %r" % p.track, system="squeal.playlist.service.Playlist")
+        self.prefetch(p)
+        self.pending = p
+        self.queued = set()
+        for m in self.store.powerupsFor(isqueal.IPlayMusic):
+            self.queued.update(m.queue(p.track))
+
+    def started(self, playtrack):
+        """ The players have moved on to the queued track. """
+        self.pending = None
+        self.listening = self.queued
+        self.queued = set()
+        self.ready = set()
+        self.current = playtrack.position
+        self.record(u'current', position=self.current)
+        for r in self.store.powerupsFor(isqueal.IEventReactor):
+            r.fireEvent(PlaylistChangeEvent(playing=[playtrack]))
+
+    def players_finished(self):
+        """ Playback has run out. If the next track did not get queued in
+        time, or has been added since, it is played now. """
+        if not self.playing:
+            # another player got here first
+            return
+        log.msg("Playback finished", system="squeal.playlist.service.Playlist")
+        self.cancel_prefetch()
+        self.playing = False
+        self.previous_playtime = 0
+        self.last_started = 0
+        p = self.pending
+        if p is None:
+            p = self.get_next_track()
+        if p is not None:
+            self.load(p)
+
+    def prefetch(self, playtrack=None):
+        """ Ask the source of the track, by default the next one, to get it
+        ready to play. """
+        self.prefetch_timer = None
+        if playtrack is None:
+            playtrack = self.get_next_track()
+        if playtrack is None or playtrack.storeID == self.prefetched:
+            return
+        self.prefetched = playtrack.storeID
+        provider = playtrack.provider
+        if isqueal.ITrackPrefetcher.providedBy(provider):
+            provider.prefetch(playtrack.tid)
+
+    def schedule_prefetch(self):
+        self.cancel_prefetch()
+        current = self.get_current_track()
+        if current is None or not current.duration:
+            return
+        remaining = (current.duration - self.time_played()) / 1000.0
+        delay = max(0, remaining - self.prefetch_lead)
+        self.prefetch_timer = self.clock.callLater(delay, self.prefetch)
+
+    def cancel_prefetch(self):
+        if self.prefetch_timer is not None:
+            self.prefetch_timer.cancel()
+            self.prefetch_timer = None
 
     def buttonPressed(self, ev):
         if ev.button == 'play' and not self.playing:
@@ -161,10 +507,14 @@ class Playlist(Item, service.Service):
 
     def clear(self):
         log.msg("Clear", system="squeal.playlist.service.Playlist")
-        for p in self.store.query(PlayTrack):
-            p.deleteFromStore()
+        self.store.transact(self._clear)
+
+    def _clear(self):
+        self.store.query(PlayTrack).deleteFromStore()
         self.maxposition = 0
         self.current = -1
+        self.unloaded = set()
+        self.record(u'clear')
 
     def play(self):
         log.msg("Playing", system="squeal.playlist.service.Playlist")
@@ -174,17 +524,17 @@ class Playlist(Item, service.Service):
                 p.unpause()
             self.last_started = time.time()
         else:
-            for p in self.store.query(PlayTrack, PlayTrack.position == self.current + 1):
+            p = self.get_next_track()
+            if p is not None:
                 self.load(p)
-                break
             else:
                 log.msg("No PlayTracks found",  system="squeal.playlist.service.Playlist")
 
     def players_playing(self):
         log.msg("All players playing", system="squeal.playlist.service.Playlist")
         self.playing = True
-        self.previous_playtime = 0
         self.last_started = time.time()
+        self.schedule_prefetch()
 
     def pause(self):
         log.msg("Pausing", system="squeal.playlist.service.Playlist")
@@ -197,10 +547,13 @@ class Playlist(Item, service.Service):
         self.playing = False
         self.previous_playtime += time.time() - self.last_started
         self.last_started = 0
+        self.cancel_prefetch()
 
     def stop(self):
         for p in self.store.powerupsFor(isqueal.ISlimPlayerService):
             p.stop()
+        self.cancel_prefetch()
+        self.pending = None
         self.playing = False
         self.previous_playtime = 0
         self.last_started = 0
@@ -209,49 +562,176 @@ class Playlist(Item, service.Service):
         return iter(self.store.query(PlayTrack, sort=PlayTrack.position.ascending))
 
     def get_current_track(self):
-        for p in self.store.query(PlayTrack, PlayTrack.position == self.current):
-            return p
+        return self.store.findFirst(PlayTrack, PlayTrack.position == self.current)
+
+    def get_next_track(self):
+        return self.store.findFirst(PlayTrack, PlayTrack.position > self.current,
+                                    sort=PlayTrack.position.ascending)
+
+    def get_previous_track(self, playtrack):
+        """ The track before playtrack in the queue, or None if it is first. """
+        return self.store.findFirst(PlayTrack, PlayTrack.position < playtrack.position,
+                                    sort=PlayTrack.position.descending)
 
     def load(self, playtrack):
         """ Load the specified track on the player. """
-        connected = 0
+        if playtrack.track is None:
+            self.unavailable(playtrack)
+            p = self.get_next_track()
+            if p is not None:
+                self.load(p)
+            return
         log.msg("Loading %r" % playtrack.track, system="squeal.playlist.service.Playlist")
+        self.listening = set()
         for p in self.store.powerupsFor(isqueal.IPlayMusic):
-            connected += p.play(playtrack.track)
-        if connected != 0:
+            self.listening.update(p.play(playtrack.track))
+        self.joining = set()
+        self.queued = set()
+        self.ready = set()
+        self.pending = None
+        if self.listening:
             self.current = playtrack.position
+            self.record(u'current', position=self.current)
         else:
             log.msg("Not playing - no players connected", system="squeal.playlist.service.Playlist")
         for r in self.store.powerupsFor(isqueal.IEventReactor):
             r.fireEvent(PlaylistChangeEvent(playing=[playtrack]))
 
+    def positions(self, after, count):
+        """ Positions for count tracks going after the PlayTrack after, or at
+        the start if after is None. Returns None if there is not room for them
+        without renumbering. """
+        lower = -1 if after is None else after.position
+        upper = self.store.findFirst(PlayTrack, PlayTrack.position > lower,
+                                     sort=PlayTrack.position.ascending)
+        if upper is None:
+            start = max(self.maxposition, lower + self.spacing)
+            self.maxposition = start + count * self.spacing
+            return [start + i * self.spacing for i in range(count)]
+        gap = upper.position - lower
+        if gap <= count:
+            return None
+        return [lower + gap * (i + 1) / (count + 1) for i in range(count)]
+
+    def rebalance(self, after=None, room=0):
+        """ Renumber the whole queue with the standard spacing, leaving space
+        for room more tracks after the PlayTrack after, or at the start if
+        after is None. Every position changes, so clients are made to reload
+        the playlist rather than being sent the changes. """
+        log.msg("Renumbering the queue", system="squeal.playlist.service.Playlist")
+        extra = (room + 1) * self.spacing
+        position = extra if after is None else self.spacing
+        # keeps the current position between the same two tracks
+        current = -1
+        for p in list(self):
+            if p.position == self.current:
+                current = position
+            elif p.position < self.current:
+                current = position + self.spacing / 2
+            p.position = position
+            position += extra if p is after else self.spacing
+        self.current = current
+        self.maxposition = position
+        self.version += 1
+        self.changelog = []
+
+    def insert(self, tracks, after=None):
+        """ Put the tracks in the queue after the PlayTrack after, or at the
+        start if after is None. Tracks must be conformable to ITrack. Returns
+        the new PlayTracks. They are written in one go, and none of them are
+        resolved, so a whole playlist can be put in the queue at once. """
+        tracks = [isqueal.ITrack(t) for t in tracks]
+        if not tracks:
+            return []
+        positions = self.positions(after, len(tracks))
+        if positions is None:
+            self.rebalance(after, len(tracks))
+            positions = self.positions(after, len(tracks))
+        log.msg("enqueing %d tracks at %d" % (len(tracks), positions[0]), system="squeal.playlist.service.Playlist")
+        self.store.batchInsert(PlayTrack,
+                               (PlayTrack.position, PlayTrack.tid, PlayTrack.provider),
+                               [(position, track.track_id, track.provider)
+                                for position, track in zip(positions, tracks)])
+        # nothing else is between the first and last position
+        pt = list(self.store.query(PlayTrack,
+                                   AND(PlayTrack.position >= positions[0],
+                                       PlayTrack.position <= positions[-1]),
+                                   sort=PlayTrack.position.ascending))
+        if len(pt) > self.window:
+            self.version += 1
+            self.changelog = []
+        else:
+            for p in pt:
+                self.recordInsert(p)
+        return pt
+
     def enqueue(self, *tracks):
         """ Add a track to the end of the queue. Track must be conformable to
         ITrack. """
-        pt = []
-        for track in tracks:
-            track = isqueal.ITrack(track)
-            log.msg("enqueing %r at %d" % (track.track_id, self.maxposition), system="squeal.playlist.service.Playlist")
-            pt.append(PlayTrack(store=self.store, position=self.maxposition, tid=track.track_id, provider=track.provider))
-            self.maxposition += 1
+        pt = self.store.transact(self._enqueue, tracks)
         for r in self.store.powerupsFor(isqueal.IEventReactor):
             r.fireEvent(PlaylistChangeEvent(added=pt))
 
+    def _enqueue(self, tracks):
+        last = self.store.findFirst(PlayTrack, sort=PlayTrack.position.descending)
+        return self.insert(tracks, last)
+
+    def remove(self, *playtracks):
+        """ Take the PlayTracks out of the queue. """
+        self.store.transact(self._remove, playtracks)
+        for r in self.store.powerupsFor(isqueal.IEventReactor):
+            r.fireEvent(PlaylistChangeEvent(removed=playtracks))
+
+    def _remove(self, playtracks):
+        for p in playtracks:
+            self.record(u'remove', pid=p.storeID)
+            self.unloaded.discard(p.storeID)
+            if p is self.pending:
+                self.pending = None
+            p.deleteFromStore()
+
+    def unavailable(self, playtrack):
+        """ Take a track its provider no longer has out of the queue. """
+        log.msg("%s is no longer available" % playtrack.tid, system="squeal.playlist.service.Playlist")
+        self.remove(playtrack)
+
+    def move(self, playtrack, after=None):
+        """ Move the PlayTrack so it follows the PlayTrack after, or is at
+        the start if after is None. """
+        self.store.transact(self._move, playtrack, after)
+        for r in self.store.powerupsFor(isqueal.IEventReactor):
+            r.fireEvent(PlaylistChangeEvent(changed=[playtrack]))
+
+    def _move(self, playtrack, after):
+        if after is playtrack:
+            return
+        positions = self.positions(after, 1)
+        if positions is None:
+            self.rebalance(after, 1)
+            positions = self.positions(after, 1)
+        if playtrack.position == self.current:
+            self.current = positions[0]
+            self.record(u'current', position=self.current)
+        self.record(u'remove', pid=playtrack.storeID)
+        playtrack.position = positions[0]
+        self.recordInsert(playtrack)
+
     def playfirst(self, *tracks):
         """ Replace the currently playing track with this new one, but keep
         the rest of the queue the same """
-        pt = []
-        for current in self.store.query(PlayTrack, PlayTrack.position==self.current):
-            current.deleteFromStore()
-        # bump existing tracks up the queue
-        for existing in self.store.query(PlayTrack, PlayTrack.position > self.current):
-            existing.position += len(tracks)
-        for i, track in enumerate(tracks):
-            track = isqueal.ITrack(track)
-            log.msg("enqueing %r first at %d" % (track.track_id, self.maxposition), system="squeal.playlist.service.Playlist")
-            pt.append(PlayTrack(store=self.store, position=self.current + i, tid=track.track_id, provider=track.provider))
-        self.maxposition += len(tracks)
+        pt = self.store.transact(self._playfirst, tracks)
         self.load(pt[0])
         for r in self.store.powerupsFor(isqueal.IEventReactor):
             r.fireEvent(PlaylistChangeEvent(added=pt))
 
+    def _playfirst(self, tracks):
+        after = None
+        current = self.get_current_track()
+        if current is not None:
+            after = self.get_previous_track(current)
+            self.record(u'remove', pid=current.storeID)
+            current.deleteFromStore()
+        elif self.current != -1:
+            after = self.store.findFirst(PlayTrack, PlayTrack.position < self.current,
+                                         sort=PlayTrack.position.descending)
+        return self.insert(tracks, after)
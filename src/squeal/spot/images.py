@@ -0,0 +1,130 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Caching spotify's cover images. An image is only fetched from spotify
+once, however many requests for it arrive while it is loading. When it
+arrives it is scaled to each of a few sizes in the image pool, and those and
+the original are kept on disk. The most recently used are kept in memory as
+well. Requests for other sizes get the next size up. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+from StringIO import StringIO
+
+import Image
+
+from twisted.internet import defer
+
+from squeal.util import LRUCache
+from squeal import imaging
+
+class ImageCache(object):
+
+    """ Cover images by their spotify image id, kept in directory. fetch is
+    called with an image id and returns a deferred that fires with the JPEG
+    data from spotify. """
+
+    # the sizes images are scaled to
+    sizes = (32, 64, 128, 256, 512)
+
+    def __init__(self, directory, fetch, size=512):
+        self.directory = directory
+        if not directory.exists():
+            directory.makedirs()
+        self.fetch = fetch
+        self.memory = LRUCache(size)
+        # image id to the deferreds waiting for it to load
+        self.pending = {}
+
+    def bucket(self, size):
+        """ The smallest size images are scaled to that is at least size, or
+        None for the original. """
+        if size is None:
+            return None
+        for s in self.sizes:
+            if s >= size:
+                return s
+        return None
+
+    def path(self, image_id, size=None):
+        name = image_id.encode("hex")
+        return self.directory.child(str(size or "original")).child(name[:2]).child(name)
+
+    def get(self, image_id, size=None):
+        """ Return a deferred that fires with the image, at least size pixels
+        square if size is given. """
+        key = (image_id, self.bucket(size))
+        data = self.memory.get(key)
+        if data is not None:
+            return defer.succeed(data)
+        path = self.path(*key)
+        if path.exists():
+            data = path.getContent()
+            self.memory.put(key, data)
+            return defer.succeed(data)
+        return self.load(image_id).addCallback(lambda images: images[key[1]])
+
+    def load(self, image_id):
+        """ Fetch the image, and render and store all of its sizes. Returns a
+        deferred that fires with a dictionary of them by size. """
+        d = defer.Deferred()
+        if image_id in self.pending:
+            self.pending[image_id].append(d)
+            return d
+        self.pending[image_id] = [d]
+        def _store(images):
+            for size, data in images.items():
+                self.memory.put((image_id, size), data)
+            return images
+        def _done(result):
+            for waiting in self.pending.pop(image_id):
+                waiting.callback(result)
+        l = self.fetch(image_id)
+        l.addCallback(lambda data: imaging.pool.run(self.render, image_id, data))
+        l.addCallback(_store)
+        l.addBoth(_done)
+        return d
+
+    def render(self, image_id, data):
+        """ Scale the image to every size, and write them all to disk. This
+        runs in the image pool. """
+        images = {None: data}
+        original = Image.open(StringIO(data))
+        if original.mode != "RGB":
+            original = original.convert("RGB")
+        for size in self.sizes:
+            image = original.copy()
+            image.thumbnail([size, size], Image.ANTIALIAS)
+            s = StringIO()
+            image.save(s, "JPEG")
+            images[size] = s.getvalue()
+        for size, data in images.items():
+            self.write(self.path(image_id, size), data)
+        return images
+
+    def write(self, path, data):
+        """ Put data in path in one go, so that it is never read half
+        written. """
+        parent = path.parent()
+        if not parent.exists():
+            try:
+                parent.makedirs()
+            except OSError:
+                # another thread got there first
+                pass
+        temp = path.temporarySibling()
+        temp.setContent(data)
+        temp.moveTo(path)
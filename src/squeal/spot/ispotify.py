@@ -73,6 +73,10 @@ class ISpotifyService(Interface):
     def image(image_id):
         pass
 
+    def cover(image_id, size=None):
+        """ Returns a deferred that fires with the JPEG image, scaled to at
+        least size pixels square if size is given. """
+
     def search(query):
         pass
 
@@ -109,8 +109,10 @@ class SpotifyManager(SpotifySessionManager):
         try:
             if self.consumer is None:
                 return 0
-            frames = frames[:] # copy the frame data out, because it will be free()ed when this function returns
-            reactor.callFromThread(self.consumer.write, frames)
+            # the frames are copied into the consumer's buffer, because they
+            # will be free()ed when this function returns. Spotify delivers
+            # again whatever does not fit.
+            return self.consumer.deliver(frames, frame_size, sample_rate) / frame_size
         except:
             traceback.print_exc()
 
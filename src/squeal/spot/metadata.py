@@ -0,0 +1,106 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Keeping what spotify tells us about tracks. Spotify only knows a track's
+details once the session has loaded them, which after a restart can be a
+while for every track in the queue. Once a track has loaded its details are
+kept in the store, by the track's link, and are used from then on instead of
+asking the session. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+from axiom.item import Item
+from axiom.attributes import text, integer, bytes
+
+def describe(track):
+    """ The details of a spotify.Track that has loaded, as TrackMetadata
+    keeps them. """
+    album = track.album()
+    return {
+        'title': track.name().decode("utf-8"),
+        'artist': u",".join(x.name().decode("utf-8") for x in track.artists()),
+        'album': album.name().decode("utf-8"),
+        'duration': track.duration(),
+        'image': album.cover(),
+    }
+
+class TrackMetadata(Item):
+
+    """ The details of a spotify track, as they were when it loaded. """
+
+    link = text(indexed=True)
+    title = text()
+    artist = text()
+    album = text()
+    duration = integer(default=0)
+    # the spotify image id of the album cover
+    image = bytes()
+
+class Details(object):
+
+    """ The same details as a TrackMetadata, for tracks that have no store
+    to keep them in. """
+
+    def __init__(self, title, artist, album, duration, image):
+        self.title = title
+        self.artist = artist
+        self.album = album
+        self.duration = duration
+        self.image = image
+
+class MetadataCache(object):
+
+    """ The metadata of spotify tracks, kept in the store. Tracks that have
+    not loaded when they are looked up are kept an eye on, and their
+    metadata is stored as soon as spotify says it has some more. """
+
+    def __init__(self, store):
+        self.store = store
+        # link to the spotify.Track, for tracks that had not loaded
+        self.waiting = {}
+
+    def get(self, track):
+        """ The TrackMetadata for the SpotifyTrack, or None if spotify has
+        not loaded it yet. """
+        link = track.track_id
+        if link not in self.waiting:
+            metadata = self.store.findFirst(TrackMetadata, TrackMetadata.link == link)
+            if metadata is not None:
+                return metadata
+        if not track.track.is_loaded():
+            self.waiting[link] = track.track
+            return None
+        self.waiting.pop(link, None)
+        return self.remember(link, track.track)
+
+    def remember(self, link, track):
+        """ Store the metadata of the spotify.Track, which has loaded. """
+        return self.store.transact(self._remember, link, track)
+
+    def _remember(self, link, track):
+        return TrackMetadata(store=self.store, link=link, **describe(track))
+
+    def updated(self, ev):
+        """ Called when spotify has new metadata. Stores it for the tracks
+        that were waiting for it. """
+        loaded = [(link, track) for link, track in self.waiting.items() if track.is_loaded()]
+        if loaded:
+            self.store.transact(self._updated, loaded)
+
+    def _updated(self, loaded):
+        for link, track in loaded:
+            del self.waiting[link]
+            self.remember(link, track)
@@ -0,0 +1,91 @@
+# Copyright 2010 Doug Winter
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Buffering PCM on its way from spotify to the squeezeboxes. Spotify
+delivers audio in its own thread, and it is written straight into a ring
+buffer of fixed size. The reactor reads it back out for each squeezebox, which
+has its own position in the stream. Positions are counted in bytes from the
+start of the track, so they do not change as the ring wraps around. When the
+buffer is full spotify is told that nothing was taken, and it delivers the
+same audio again later. """
+
+__author__ = "Doug Winter <doug.winter@isotoma.com>"
+__docformat__ = "restructuredtext en"
+__version__ = "$Revision$"[11:-2]
+
+import threading
+
+class RingBuffer(object):
+
+    """ A fixed amount of PCM, written by one thread and read by another.
+    The buffer holds the stream from start up to end. """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = bytearray(size)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Empty the buffer, ready for a new track. """
+        with self.lock:
+            self.start = 0
+            self.end = 0
+            # whether the reader has been told there is something to read
+            self.waiting = False
+
+    def space(self):
+        return self.size - (self.end - self.start)
+
+    def write(self, data, unit=1):
+        """ Copy as much of data as there is room for, in whole multiples of
+        unit, and return how many bytes were taken and whether the reader
+        needs waking up to deal with them. It only needs waking once until it
+        calls woken. """
+        with self.lock:
+            space = self.size - (self.end - self.start)
+            length = min(len(data), space - space % unit)
+            offset = self.end % self.size
+            first = min(length, self.size - offset)
+            self.data[offset:offset + first] = buffer(data, 0, first)
+            if length > first:
+                self.data[:length - first] = buffer(data, first, length - first)
+            self.end += length
+            wake = not self.waiting
+            self.waiting = True
+            return length, wake
+
+    def woken(self):
+        """ The reader is about to look at the buffer again. """
+        with self.lock:
+            self.waiting = False
+
+    def read(self, position, limit):
+        """ Up to limit bytes from position in the stream. Less is returned
+        where the data wraps round the end of the ring, and the rest comes
+        from the next read. """
+        with self.lock:
+            end = self.end
+        assert position >= self.start, "%d has already been released" % position
+        offset = position % self.size
+        length = min(limit, end - position, self.size - offset)
+        if length <= 0:
+            return ""
+        return str(buffer(self.data, offset, length))
+
+    def release(self, position):
+        """ Everything before position has been read, and can be written
+        over. """
+        with self.lock:
+            self.start = max(self.start, min(position, self.end))
@@ -33,6 +33,9 @@ import ispotify
 from event import *
 from track import SpotifyTrack
 from manager import SpotifyManager
+import pcm
+from images import ImageCache
+from metadata import MetadataCache
 from spotify import Link
 import json
 import sys
@@ -51,7 +54,9 @@ class SqueezeboxStreamer(object):
 
 
     """ Manages the streaming to a single squeezebox. One of these objects is
-    created for each squeezebox that we know about. """
+    created for each squeezebox that we know about. The squeezebox's
+    connection tells us when it cannot take any more, and this stops reading
+    from the buffer for it until it can. """
 
     implements(IProducer, IPushProducer)
 
@@ -61,12 +66,17 @@ class SqueezeboxStreamer(object):
         # track id requested.  probably not required.
         self.player = player
         self.streamer = streamer
+        # how far into the track this squeezebox has been sent
+        self.position = 0
+        self.paused = False
 
-    def new_request(self, request):
+    def new_request(self, request, position=0):
         if self.request is not None:
             log.err("New request received, while we still have an existing request!", system="squeal.spot.service.SqueezeboxStreamer")
             return
         self.request = request
+        self.position = position
+        self.paused = False
         self.request.registerProducer(self, 1)
 
     def write(self, data):
@@ -78,40 +88,64 @@ class SqueezeboxStreamer(object):
         self.request = None
 
     def pauseProducing(self):
-        #self.streamer.pauseProducing()
-        pass
+        self.paused = True
 
     def resumeProducing(self):
-        #self.streamer.resumeProducing()
-        pass
+        self.paused = False
+        self.streamer.flush()
 
     def stopProducing(self):
-        #self.streamer.stopProducing()
-        pass
+        # the squeezebox has gone away
+        self.request = None
+        self.streamer.flush()
 
 
 class SpotifyStreamer(object):
 
     """ Manages streaming music to multiple squeezeboxes. Handles connections
     and disconnections of squeezeboxes, and ensures they remain synchronised.
-    """
+    Spotify writes into a ring buffer (see squeal.spot.pcm), which is sent on
+    to the squeezeboxes a chunk at a time. If the buffer fills up because a
+    squeezebox is not keeping up, spotify is paused until it has drained.
+
+    A track starts once every squeezebox has asked for it. A squeezebox that
+    asks after that, because it has only just connected, joins the stream at
+    the point the others are playing, worked out from how long the track has
+    been playing. To make that possible the last twenty or so seconds already
+    sent are kept in the buffer. """
 
     implements(IConsumer)
 
+    # 44.1kHz 16 bit stereo is 176400 bytes a second, so this is about
+    # thirty five seconds of audio
+    buffer_size = 6 << 20
+    # the most sent to a squeezebox in one go
+    chunk_size = 64 << 10
+    # spotify is paused when there is less room than this in the buffer, and
+    # resumed when there is more than low_water
+    high_water = 64 << 10
+    low_water = 1 << 20
+    # how much of what has been sent is kept for squeezeboxes that join late.
+    # This needs to be more than a squeezebox buffers ahead of what it plays.
+    retention = 4 << 20
+
     def __init__(self, service):
         self.sb = []
         self.service = service
-        self.data = []
-        self.paused = False
+        self.buffer = pcm.RingBuffer(self.buffer_size)
         self.finished = False
         self.all_connected = False
         self.producer = None
-        self.written = 0
+        self.producer_paused = False
+        # the size of a frame, and how many bytes spotify sends a second
+        self.unit = 4
+        self.rate = 44100 * 4
         self.service.evreactor.subscribe(self.player_state_changed, isqueal.IPlayerStateChange)
 
     def registerProducer(self, producer, streaming):
         log.msg("registerProducer", system="squeal.spot.sfy.SpotifyTransfer")
         self.producer = producer
+        self.producer_paused = False
 
     def unregisterProducer(self):
         """ Called by the spotify service when the end of track is reached. We
@@ -120,44 +154,86 @@ class SpotifyStreamer(object):
         log.msg("unregisterProducer", system="squeal.spot.sfy.SpotifyTransfer")
         self.producer = None
         self.finished = True
-
-    def pauseProducing(self):
-        if 'SQUEAL_DEBUG' in os.environ:
-            log.msg("pauseProducing", system="squeal.spot.sfy.SpotifyTransfer")
-        self.paused = True
-
-    def stopProducing(self):
-        if 'SQUEAL_DEBUG' in os.environ:
-            log.msg("stopProducing", system="squeal.spot.sfy.SpotifyTransfer")
-
-    def resumeProducing(self):
-        log.msg("resumeProducing", system="squeal.spot.sfy.SpotifyTransfer")
-        if self.data:
-            for s in self.sb:
-                s.write("".join(self.data))
-            self.data = []
-        if self.finished:
-            for s in self.sb:
-                s.finish()
-            self.written = 0
-        self.paused = False
-        self.all_connected = False
+        self.flush()
 
     def play(self, track):
         """ Called when we wish to start playing.  The squeezeboxes will shortly request this track from us. """
         log.msg("Requesting %s from spotify" % track.track_id, system="squeal.spot.service.SpotifyStreamer")
+        # anything still being sent is from a track that has been abandoned
+        for s in self.sb:
+            if s.request is not None:
+                s.finish()
+        self.buffer.reset()
+        self.finished = False
+        self.all_connected = False
         self.service.registerConsumer(self, track)
 
-    def write(self, data):
-        """ Data received from spotify, to send to all the squeezeboxen """
-        self.written += len(data)
-        if self.all_connected and not self.paused:
+    def deliver(self, data, unit, sample_rate=44100):
+        """ Called in the spotify thread with audio, in frames of unit bytes.
+        Returns how many bytes were taken, which is none at all if the buffer
+        is full. """
+        self.unit = unit
+        self.rate = unit * sample_rate
+        written, wake = self.buffer.write(data, unit)
+        if wake:
+            reactor.callFromThread(self.flush)
+        return written
+
+    def flush(self):
+        """ Send each squeezebox as much of what has arrived as it will take,
+        and make room in the buffer for more. """
+        self.buffer.woken()
+        if self.all_connected:
             for s in self.sb:
-                s.write(data)
-        else:
-            self.data.append(data)
+                while s.request is not None and not s.paused:
+                    data = self.buffer.read(s.position, self.chunk_size)
+                    if not data:
+                        if self.finished:
+                            s.finish()
+                        break
+                    s.position += len(data)
+                    s.write(data)
+            positions = [s.position for s in self.sb if s.request is not None]
+            if positions:
+                self.buffer.release(min(min(positions), max(positions) - self.retention))
+        self.throttle()
+
+    def throttle(self):
+        """ Pause spotify if the buffer is nearly full, and resume it once
+        there is plenty of room again. """
+        if self.producer is None:
+            return
+        space = self.buffer.space()
+        if not self.producer_paused and space < self.high_water:
+            self.producer_paused = True
+            self.producer.pauseProducing()
+        elif self.producer_paused and space > self.low_water:
+            self.producer_paused = False
+            self.producer.resumeProducing()
+
+    def elapsed(self):
+        """ How many seconds of the track have been played. """
+        for p in self.service.store.powerupsFor(isqueal.IPlaylist):
+            return p.time_played() / 1000.0
+        return 0
+
+    def join_position(self):
+        """ Where a squeezebox joining part way through the track starts, as
+        near as the buffer allows to what the others are playing. """
+        position = int(self.elapsed() * self.rate)
+        position -= position % self.unit
+        return min(max(position, self.buffer.start), self.buffer.end)
 
     def squeezebox_request(self, request, pid):
+        if self.all_connected:
+            # the track has started without this squeezebox
+            for s in self.sb:
+                if str(id(s.player)) == pid:
+                    position = self.join_position()
+                    log.msg("Squeezebox %s joining at %d" % (pid, position), system="squeal.spot.service.SpotifyStreamer")
+                    s.new_request(request, position)
+            self.flush()
+            return
         connected = 0
         for s in self.sb:
             if str(id(s.player)) == pid:
@@ -167,6 +243,7 @@ class SpotifyStreamer(object):
         if connected == len(self.sb):
             self.all_connected = True
             log.msg("All squeezeboxes connected and ready to receive data", system="squeal.spot.service.SpotifyStreamer")
+            self.flush()
 
     def player_state_changed(self, ev):
         if ev.state == ev.State.ESTABLISHED:
@@ -212,6 +289,8 @@ class Spotify(Item, service.Service):
     mgr = inmemory()
     playing = inmemory()
     streamer = inmemory()
+    images = inmemory()
+    metadata = inmemory()
     setup_form = setup_form
 
     label = "Spotify"
@@ -229,6 +308,9 @@ class Spotify(Item, service.Service):
     def activate(self):
         self.playing = None
         self.streamer = SpotifyStreamer(self)
+        self.images = ImageCache(self.store.newFilePath("spotify", "images"), self.fetch_image)
+        self.metadata = MetadataCache(self.store)
+        self.evreactor.subscribe(self.metadata.updated, ispotify.ISpotifyMetadataUpdatedEvent)
 
     def sigint(self, handler, frame):
         # filthy hack!
@@ -244,7 +326,12 @@ class Spotify(Item, service.Service):
     def play(self, track):
         log.msg("Play called with %r" % track.track_id, system="squeal.spot.service.Spotify")
         self.streamer.play(track)
-        return 0 # we don't actually play the music, we just prepare it
+        return [] # we don't actually play the music, we just prepare it
+
+    def queue(self, track):
+        # the players have had all of the track before, so the next one can
+        # be loaded straight away
+        return self.play(track)
 
     def registerConsumer(self, consumer, track):
         log.msg("registering consumer %r on %r" % (consumer, self), system="squeal.spot.service.Spotify")
@@ -265,6 +352,12 @@ class Spotify(Item, service.Service):
     def image(self, image_id):
         return self.mgr.image(image_id)
 
+    def fetch_image(self, image_id):
+        return self.image(image_id).addCallback(lambda image: str(image.data()))
+
+    def cover(self, image_id, size=None):
+        return self.images.get(image_id, size)
+
     def search(self, query):
         self.mgr.search(query)
 
@@ -296,8 +389,8 @@ class Spotify(Item, service.Service):
     #isqueal.TrackSource
 
     def get_track(self, tid):
-        track = Link.from_string(tid).as_track()
-        return SpotifyTrack(track, self)
+        # the spotify.Track is only needed if its metadata is not cached
+        return SpotifyTrack(None, self, tid)
 
     def wrap_tracks(self, *tracks):
         for t in tracks:
@@ -20,16 +20,15 @@ __version__ = "$Revision$"[11:-2]
 
 from zope.interface import implements
 from twisted.python import log
+from twisted.web import http
 from nevow import rend
 from nevow import inevow
 from squeal.isqueal import *
+from squeal import imaging
 import ispotify
 
 import os
 
-import Image
-from StringIO import StringIO
-
 class SpotifyStreamingPage(rend.Page):
 
     def __init__(self, original, pid):
@@ -44,6 +43,12 @@ class SpotifyStreamingPage(rend.Page):
 
 class SpotifyImage(rend.Page):
 
+    """ A cover image, scaled to at least size pixels square if size is
+    given. Spotify never changes the image behind an id, so browsers can keep
+    it for as long as they like. """
+
+    max_age = 365 * 24 * 60 * 60
+
     def __init__(self, original, image_id, size=None):
         self.original = original
         self.image_id = image_id
@@ -51,18 +56,22 @@ class SpotifyImage(rend.Page):
 
     def renderHTTP(self, ctx):
         request = inevow.IRequest(ctx)
-        def _(image):
-            request.setHeader("content-type", "image/jpeg")
-            if self.size is not None:
-                s = StringIO(image.data())
-                i = Image.open(s)
-                i.thumbnail([int(self.size), int(self.size)], Image.ANTIALIAS)
-                s2 = StringIO()
-                i.save(s2, "JPEG")
-                return s2.getvalue()
-            return str(image.data())
+        size = None
+        if self.size is not None:
+            size = int(self.size)
+        request.setHeader("cache-control", "public, max-age=%d" % self.max_age)
         for service in self.original.store.powerupsFor(ispotify.ISpotifyService):
-            d = service.image(self.image_id)
-            d.addCallback(_)
-            return d
+            etag = '"%s-%s"' % (self.image_id.encode("hex"), service.images.bucket(size) or "original")
+            if request.setETag(etag) is http.CACHED:
+                return ""
+            def _(data):
+                request.setHeader("content-type", "image/jpeg")
+                return data
+            def _busy(failure):
+                failure.trap(imaging.Busy)
+                request.setResponseCode(http.SERVICE_UNAVAILABLE)
+                request.setHeader("cache-control", "no-cache")
+                request.setHeader("retry-after", "1")
+                return ""
+            return service.cover(self.image_id, size).addCallbacks(_, _busy)
 
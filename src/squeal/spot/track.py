@@ -6,64 +6,88 @@ from zope.interface import implements
 
 from squeal import isqueal
 from spotify import Link, Track
+from metadata import Details, describe
 
 
 class SpotifyTrack(object):
 
     """ A wrapper for spotify.Track that conforms to ITrack. Generally you'd
-    get this from the spotify service's get_track method. """
+    get this from the spotify service's get_track method. Its details come
+    from the spotify service's metadata cache if it has one, so that tracks
+    that have been seen before need nothing from the session. """
 
     implements(isqueal.ITrack)
 
     # all spotify tracks are played as raw PCM
-    type = 3
+    track_type = 3
 
-    def __init__(self, track, provider=None):
+    def __init__(self, track=None, provider=None, track_id=None):
         self.provider = provider
-        self.track = track
+        self._track = track
+        self._track_id = track_id
+        self._metadata = None
+
+    @property
+    def track(self):
+        """ The spotify.Track, which is only found from the id when it is
+        needed. """
+        if self._track is None:
+            self._track = Link.from_string(self._track_id).as_track()
+        return self._track
 
     @property
     def track_id(self):
         """ Return the id of the track within the provider namespace. """
-        return unicode(Link.from_track(self.track, 0))
+        if self._track_id is None:
+            self._track_id = unicode(Link.from_track(self.track, 0))
+        return self._track_id
+
+    @property
+    def metadata(self):
+        """ The details of the track, or None if they are not known yet. """
+        if self._metadata is None:
+            if self.provider is not None:
+                self._metadata = self.provider.metadata.get(self)
+            elif self.track.is_loaded():
+                self._metadata = Details(**describe(self.track))
+        return self._metadata
 
     @property
     def is_loaded(self):
-        return self.track.is_loaded()
+        return self.metadata is not None
 
     @property
     def title(self):
         if self.is_loaded:
-            return self.track.name().decode("utf-8")
+            return self.metadata.title
         else:
             return u"Loading..."
 
     @property
     def artist(self):
         if self.is_loaded:
-            artists = self.track.artists()
-            return ",".join(x.name().decode("utf-8") for x in artists)
+            return self.metadata.artist
         else:
             return u"Loading..."
 
     @property
     def album(self):
         if self.is_loaded:
-            return self.track.album().name().decode("utf-8")
+            return self.metadata.album
         else:
             return u"Loading..."
 
     @property
     def duration(self):
         if self.is_loaded:
-            return self.track.duration()
+            return self.metadata.duration
         else:
             return 0
 
     @property
     def image_uri(self):
         if self.is_loaded:
-            return u"/spotify/image?%s" % (urllib.urlencode({"image": self.track.album().cover()}))
+            return u"/spotify/image?%s" % (urllib.urlencode({"image": self.metadata.image}))
         else:
             return u''
 
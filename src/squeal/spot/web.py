@@ -69,7 +69,7 @@ class Playlists(base.BaseElement):
     @athena.expose
     def goingLive(self):
         self.callRemote("reload");
-        self.evreactor.subscribe(self.reload, ispotify.ISpotifyMetadataUpdatedEvent)
+        self.evreactor.subscribe(self.reload, ispotify.ISpotifyMetadataUpdatedEvent, interval=self.reload_interval)
 
     @athena.expose
     def play(self, playlistID):
@@ -0,0 +1,55 @@
+from twisted.internet import task
+from twisted.trial import unittest
+
+from squeal.player.animation import Animator
+from squeal.player.display import window
+
+class Screen(object):
+
+    def __init__(self):
+        self.frames = []
+
+    def updateDisplay(self, bitmap):
+        self.frames.append(bitmap)
+
+class TestAnimator(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.animator = Animator()
+        self.animator.loop.clock = self.clock
+        # 400 columns, each word holding its column number
+        self.strip = "".join("%04d" % i for i in range(400))
+
+    def advance(self, frames):
+        for i in range(frames):
+            self.clock.advance(1.0 / self.animator.rate)
+
+    def test_window(self):
+        self.assertEqual(window(self.strip, 0), self.strip[:1280])
+        w = window(self.strip, 390)
+        self.assertEqual(len(w), 1280)
+        self.assertEqual(w[:4], "0390")
+        self.assertEqual(w[40:44], "0000")
+
+    def test_scroll(self):
+        screen = Screen()
+        self.animator.scroll(screen, self.strip)
+        self.assertEqual(screen.frames, [self.strip[:1280]])
+        hold = self.animator.hold * self.animator.rate
+        self.advance(hold)
+        self.assertEqual(len(screen.frames), 1)
+        self.advance(2)
+        self.assertEqual([f[:4] for f in screen.frames[1:]], ["0002", "0004"])
+
+    def test_one_timer(self):
+        screens = [Screen() for i in range(3)]
+        for s in screens:
+            self.animator.scroll(s, self.strip)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.advance(self.animator.hold * self.animator.rate + 1)
+        self.assertEqual([len(s.frames) for s in screens], [2, 2, 2])
+        for s in screens:
+            self.animator.stop(s)
+        self.assertFalse(self.animator.loop.running)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
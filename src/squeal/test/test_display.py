@@ -0,0 +1,66 @@
+import struct
+
+from twisted.trial import unittest
+
+from squeal import imaging
+from squeal.player.display import Display
+
+class TestDisplay(unittest.TestCase):
+
+    def setUp(self):
+        self.display = Display()
+
+    def words(self):
+        return struct.unpack("!320I", self.display.frame())
+
+    def test_frame(self):
+        pixels = self.display.image.load()
+        pixels[0, 0] = 1
+        pixels[1, 31] = 1
+        pixels[319, 1] = 1
+        words = self.words()
+        self.assertEqual(words[0], 1 << 31)
+        self.assertEqual(words[1], 1)
+        self.assertEqual(words[319], 1 << 30)
+        self.assertEqual(sum(words[2:319]), 0)
+
+    def test_render(self):
+        pool = imaging.ImagePool(size=1)
+        self.patch(imaging, "pool", pool)
+        self.addCleanup(pool.stop)
+        text = u"Rendered away from the reactor"
+        font = self.display.fonts["DejaVu-Sans"]
+        def _frame((kind, frame)):
+            self.assertEqual(kind, 'frame')
+            self.assertEqual(frame, self.display.layout(font, text, 12, 40)[1])
+            self.assertEqual(self.display.frame(), frame)
+            # laid out already
+            self.assertEqual(self.display.render(text, "DejaVu-Sans", 12).result, ('frame', frame))
+            return self.display.render(text * 4, "DejaVu-Sans", 12)
+        def _strip((kind, strip)):
+            self.assertEqual(kind, 'strip')
+            self.assertEqual(strip, self.display.layout(font, text * 4, 12, 40)[0])
+            self.assertEqual(pool.submitted, 2)
+        d = self.display.render(text, "DejaVu-Sans", 12)
+        return d.addCallback(_frame).addCallback(_strip)
+
+    def test_render_busy(self):
+        pool = imaging.ImagePool(size=1, limit=0)
+        self.patch(imaging, "pool", pool)
+        self.addCleanup(pool.stop)
+        text = u"Rendered while the pool is full"
+        d = self.display.render(text, "DejaVu-Sans", 12)
+        kind, frame = d.result
+        self.assertEqual(kind, 'frame')
+        self.assertEqual(self.display.frame(), frame)
+        self.assertEqual(pool.rejected, 1)
+
+    def test_fonts_per_thread(self):
+        pool = imaging.ImagePool(size=1)
+        self.patch(imaging, "pool", pool)
+        self.addCleanup(pool.stop)
+        font = self.display.fonts["DejaVu-Sans"]
+        mine = font.truetype(12)
+        self.assertIdentical(font.truetype(12), mine)
+        d = pool.run(font.truetype, 12)
+        return d.addCallback(lambda theirs: self.assertNotIdentical(theirs, mine))
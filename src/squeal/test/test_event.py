@@ -0,0 +1,112 @@
+from zope.interface import Interface, implements
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from axiom.store import Store
+
+from squeal.event import EventReactor, ChangeEvent
+
+class IFoo(Interface):
+    pass
+
+class IFooBar(IFoo):
+    pass
+
+class IBaz(Interface):
+    pass
+
+class Foo(object):
+    implements(IFoo)
+
+class FooBar(object):
+    implements(IFooBar)
+
+class Change(ChangeEvent):
+    implements(IFoo)
+
+class TestEventReactor(unittest.TestCase):
+
+    def setUp(self):
+        self.evr = EventReactor(store=Store())
+        self.received = []
+
+    def handler(self, name):
+        def _handler(ev):
+            self.received.append((name, ev.__class__.__name__))
+        return _handler
+
+    def test_dispatch(self):
+        self.evr.subscribe(self.handler("foo"), IFoo)
+        self.evr.subscribe(self.handler("foobar"), IFooBar)
+        self.evr.subscribe(self.handler("foobaz"), IFoo, IBaz)
+        self.evr._fireEvent(Foo())
+        self.evr._fireEvent(FooBar())
+        self.evr._fireEvent(Foo(), IBaz)
+        self.assertEqual(self.received, [
+            ("foo", "Foo"),
+            ("foo", "FooBar"), ("foobar", "FooBar"),
+            ("foo", "Foo"), ("foobaz", "Foo"),
+            ])
+
+    def test_unsubscribe(self):
+        s = self.evr.subscribe(self.handler("foo"), IFoo)
+        self.evr._fireEvent(Foo())
+        s.unsubscribe()
+        self.evr._fireEvent(Foo())
+        self.evr.subscribe(self.handler("again"), IFoo)
+        self.evr._fireEvent(Foo())
+        self.assertEqual([name for name, ev in self.received], ["foo", "again"])
+
+    def test_errors(self):
+        def broken(ev):
+            raise ValueError("broken")
+        self.evr.subscribe(broken, IFoo)
+        self.evr.subscribe(self.handler("foo"), IFoo)
+        self.evr._fireEvent(Foo())
+        self.assertEqual(self.received, [("foo", "Foo")])
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+
+    def test_deferred_handlers(self):
+        self.assertEqual(self.evr._fireEvent(Foo()), None)
+        waiting = defer.Deferred()
+        self.evr.subscribe(lambda ev: waiting, IFoo)
+        self.evr.subscribe(self.handler("foo"), IFoo)
+        d = self.evr._fireEvent(Foo())
+        # the second handler is not held up by the first
+        self.assertEqual(self.received, [("foo", "Foo")])
+        waiting.callback(None)
+        return d
+
+    def test_coalesced(self):
+        clock = task.Clock()
+        received = []
+        s = self.evr.subscribe(received.append, IFoo, interval=1)
+        s.clock = clock
+        self.evr._fireEvent(Change(added=[1]))
+        self.assertEqual(len(received), 1)
+        self.evr._fireEvent(Change(added=[2], removed=[3]))
+        self.evr._fireEvent(Change(added=[2, 4], changed=[5]))
+        self.assertEqual(len(received), 1)
+        clock.advance(1)
+        self.assertEqual(len(received), 2)
+        merged = received[1]
+        self.assertEqual((merged.added, merged.removed, merged.changed), ([2, 4], [3], [5]))
+        # nothing more was fired, so nothing more is delivered
+        clock.advance(1)
+        self.assertEqual(len(received), 2)
+        self.evr._fireEvent(Foo())
+        self.evr._fireEvent(FooBar())
+        self.assertEqual(len(received), 3)
+        s.unsubscribe()
+        self.assertEqual(clock.getDelayedCalls(), [])
+
+    def test_latest_wins(self):
+        clock = task.Clock()
+        received = []
+        s = self.evr.subscribe(received.append, IFoo, interval=1)
+        s.clock = clock
+        first, second, third = Foo(), Foo(), FooBar()
+        for ev in first, second, third:
+            self.evr._fireEvent(ev)
+        clock.advance(1)
+        self.assertEqual(received, [first, third])
@@ -0,0 +1,73 @@
+from StringIO import StringIO
+
+import Image
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.python.filepath import FilePath
+
+from squeal import imaging
+from squeal.spot.images import ImageCache
+
+def jpeg(size=300):
+    s = StringIO()
+    Image.new("RGB", (size, size), "red").save(s, "JPEG")
+    return s.getvalue()
+
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        pool = imaging.ImagePool(size=1)
+        self.patch(imaging, "pool", pool)
+        self.addCleanup(pool.stop)
+        self.directory = FilePath(self.mktemp())
+        self.fetched = []
+        self.cache = ImageCache(self.directory, self.fetch)
+
+    def fetch(self, image_id):
+        d = defer.Deferred()
+        self.fetched.append((image_id, d))
+        return d
+
+    def test_coalesce(self):
+        image_id = "x" * 20
+        d1 = self.cache.get(image_id, 100)
+        d2 = self.cache.get(image_id, 40)
+        d3 = self.cache.get(image_id)
+        self.assertEqual(len(self.fetched), 1)
+        original = jpeg()
+        self.fetched[0][1].callback(original)
+        d = defer.gatherResults([d1, d2, d3])
+        def _check((thumbnail, small, full)):
+            self.assertEqual(Image.open(StringIO(thumbnail)).size, (128, 128))
+            self.assertEqual(Image.open(StringIO(small)).size, (64, 64))
+            self.assertEqual(full, original)
+            # from memory now
+            self.assertEqual(self.cache.get(image_id, 128).result, thumbnail)
+            self.assertEqual(len(self.fetched), 1)
+        return d.addCallback(_check)
+
+    def test_disk(self):
+        image_id = "y" * 20
+        d = self.cache.get(image_id, 256)
+        self.fetched[0][1].callback(jpeg())
+        def _check(data):
+            # a new cache, as after a restart, finds every size on disk
+            cache = ImageCache(self.directory, self.fetch)
+            for size in cache.sizes:
+                cache.get(image_id, size)
+            self.assertEqual(cache.get(image_id, 256).result, data)
+            self.assertEqual(len(self.fetched), 1)
+        return d.addCallback(_check)
+
+    def test_failure(self):
+        image_id = "z" * 20
+        d1 = self.cache.get(image_id, 100)
+        d2 = self.cache.get(image_id, 100)
+        self.fetched[0][1].errback(ValueError("no such image"))
+        self.assertFailure(d1, ValueError)
+        self.assertFailure(d2, ValueError)
+        def _again(ignored):
+            self.cache.get(image_id, 100)
+            self.assertEqual(len(self.fetched), 2)
+        return defer.gatherResults([d1, d2]).addCallback(_again)
@@ -0,0 +1,61 @@
+import threading
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from squeal import imaging
+
+class TestImagePool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = imaging.ImagePool(size=2, limit=3)
+        self.addCleanup(self.pool.stop)
+
+    def test_run(self):
+        caller = threading.currentThread()
+        def _work(a, b=0):
+            self.assertNotIdentical(threading.currentThread(), caller)
+            return a + b
+        def _check(result):
+            self.assertEqual(result, 3)
+            metrics = self.pool.metrics()
+            self.assertEqual(metrics['completed'], 1)
+            self.assertEqual(metrics['queued'], 0)
+        return self.pool.run(_work, 1, b=2).addCallback(_check)
+
+    def test_failure(self):
+        def _work():
+            raise ValueError("broken image")
+        d = self.assertFailure(self.pool.run(_work), ValueError)
+        return d.addCallback(lambda ignored: self.assertEqual(self.pool.failed, 1))
+
+    def test_busy(self):
+        release = threading.Event()
+        running = [self.pool.run(release.wait) for i in range(3)]
+        self.assertEqual(self.pool.queued, 3)
+        d = self.assertFailure(self.pool.run(release.wait), imaging.Busy)
+        def _release(ignored):
+            self.assertEqual(self.pool.rejected, 1)
+            release.set()
+            return defer.gatherResults(running)
+        def _check(ignored):
+            self.assertEqual(self.pool.peak, 3)
+            self.assertEqual(self.pool.completed, 3)
+            return self.pool.run(int, "4")
+        return d.addCallback(_release).addCallback(_check)
+
+    def test_once(self):
+        release = threading.Event()
+        calls = []
+        def _work():
+            calls.append(1)
+            release.wait()
+            return "thumbnail"
+        d1 = self.pool.once("key", _work)
+        d2 = self.pool.once("key", _work)
+        release.set()
+        def _check(results):
+            self.assertEqual(results, ["thumbnail", "thumbnail"])
+            self.assertEqual(calls, [1])
+            self.assertEqual(self.pool.pending, {})
+        return defer.gatherResults([d1, d2]).addCallback(_check)
@@ -0,0 +1,90 @@
+from twisted.trial import unittest
+
+from axiom.store import Store
+
+from squeal.spot.metadata import MetadataCache, TrackMetadata, Details, describe
+
+class FakeNamed(object):
+
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+class FakeAlbum(FakeNamed):
+
+    def cover(self):
+        return "\x01" * 20
+
+class FakeTrack(object):
+
+    """ Looks like a spotify.Track """
+
+    loaded = False
+
+    def is_loaded(self):
+        return self.loaded
+
+    def name(self):
+        return "Hej D\xc3\xa5"
+
+    def artists(self):
+        return [FakeNamed("Ein"), FakeNamed("Zwei")]
+
+    def album(self):
+        return FakeAlbum("Drei")
+
+    def duration(self):
+        return 180000
+
+class FakeSpotifyTrack(object):
+
+    """ Looks like a SpotifyTrack """
+
+    def __init__(self, link):
+        self.track_id = link
+        self.track = FakeTrack()
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        self.cache = MetadataCache(self.store)
+
+    def test_loaded(self):
+        track = FakeSpotifyTrack(u"spotify:track:a")
+        track.track.loaded = True
+        metadata = self.cache.get(track)
+        self.assertEqual((metadata.title, metadata.artist, metadata.album, metadata.duration, metadata.image),
+                         (u"Hej D\xe5", u"Ein,Zwei", u"Drei", 180000, "\x01" * 20))
+        # without the session, as after a restart
+        track.track = None
+        self.assertEqual(MetadataCache(self.store).get(track), metadata)
+
+    def test_transaction(self):
+        transactions = []
+        def transact(f, *a, **kw):
+            transactions.append(f)
+            return Store.transact(self.store, f, *a, **kw)
+        self.patch(self.store, "transact", transact)
+        track = FakeSpotifyTrack(u"spotify:track:c")
+        track.track.loaded = True
+        self.cache.get(track)
+        # the row is made inside it
+        self.assertIn(self.cache._remember, transactions)
+
+    def test_details(self):
+        details = Details(**describe(FakeTrack()))
+        self.assertEqual((details.title, details.artist, details.duration), (u"Hej D\xe5", u"Ein,Zwei", 180000))
+
+    def test_waiting(self):
+        track = FakeSpotifyTrack(u"spotify:track:b")
+        self.assertEqual(self.cache.get(track), None)
+        self.cache.updated(None)
+        self.assertEqual(self.store.query(TrackMetadata).count(), 0)
+        track.track.loaded = True
+        self.cache.updated(None)
+        self.assertEqual(self.cache.waiting, {})
+        self.assertEqual(self.cache.get(track).title, u"Hej D\xe5")
+        self.assertEqual(self.store.query(TrackMetadata).count(), 1)
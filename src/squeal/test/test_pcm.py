@@ -0,0 +1,41 @@
+from twisted.trial import unittest
+
+from squeal.spot.pcm import RingBuffer
+
+class TestRingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.buffer = RingBuffer(8)
+
+    def test_read(self):
+        self.assertEqual(self.buffer.write("abcd"), (4, True))
+        self.assertEqual(self.buffer.read(0, 3), "abc")
+        self.assertEqual(self.buffer.read(3, 3), "d")
+        self.assertEqual(self.buffer.read(4, 3), "")
+
+    def test_full(self):
+        self.assertEqual(self.buffer.write("abcdef"), (6, True))
+        # only whole units are taken
+        self.assertEqual(self.buffer.write("ghijkl", 4), (0, False))
+        self.assertEqual(self.buffer.space(), 2)
+        self.buffer.release(4)
+        self.assertEqual(self.buffer.write("ghijkl", 4), (4, False))
+        self.assertEqual(self.buffer.space(), 2)
+
+    def test_wrap(self):
+        self.buffer.write("abcdef")
+        self.buffer.release(6)
+        self.buffer.write("ghijkl")
+        self.assertEqual(self.buffer.read(6, 8), "gh")
+        self.assertEqual(self.buffer.read(8, 8), "ijkl")
+
+    def test_wake(self):
+        self.assertEqual(self.buffer.write("ab")[1], True)
+        self.assertEqual(self.buffer.write("cd")[1], False)
+        self.buffer.woken()
+        self.assertEqual(self.buffer.write("ef")[1], True)
+
+    def test_released(self):
+        self.buffer.write("abcd")
+        self.buffer.release(2)
+        self.assertRaises(AssertionError, self.buffer.read, 1, 1)
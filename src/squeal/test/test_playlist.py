@@ -0,0 +1,371 @@
+from zope.interface import implements
+from twisted.trial import unittest
+from twisted.internet import task
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer
+
+from squeal import isqueal
+from squeal.event import EventReactor, ChangeEvent
+from squeal.net.slimproto import StateChanged
+from squeal.playlist import service
+from squeal.playlist.service import Playlist, TrackCache
+
+class FakeTrack(object):
+    implements(isqueal.ITrack)
+
+    def __init__(self, provider, tid):
+        self.provider = provider
+        self.track_id = tid
+        self.is_loaded = provider.loaded
+        self.title = tid
+        self.artist = self.album = self.image_uri = None
+        self.duration = provider.duration
+
+class FakeLibraryChangeEvent(ChangeEvent):
+
+    def __init__(self, provider, **kw):
+        ChangeEvent.__init__(self, **kw)
+        self.provider = provider
+
+class FakeProvider(Item):
+
+    implements(isqueal.ITrackPrefetcher)
+
+    resolved = integer(default=0)
+    loaded = True
+    duration = 0
+    prefetched = []
+
+    def get_track(self, tid):
+        self.resolved += 1
+        return FakeTrack(self, tid)
+
+    def prefetch(self, tid):
+        self.prefetched.append(tid)
+
+class FakePlayers(Item):
+
+    implements(isqueal.IPlayMusic)
+    powerupInterfaces = (isqueal.IPlayMusic,)
+
+    players = integer(default=2)
+    calls = []
+
+    def play(self, track):
+        self.calls.append(('play', track.track_id))
+        return range(1, self.players + 1)
+
+    def queue(self, track):
+        self.calls.append(('queue', track.track_id))
+        return range(1, self.players + 1)
+
+class TestChangeLog(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        EventReactor(store=self.store)
+        self.playlist = Playlist(store=self.store)
+
+    def test_changes_since(self):
+        p = self.playlist
+        self.assertEqual(p.changes_since(0), [])
+        p.record(u'current', position=3)
+        p.clear()
+        self.assertEqual(p.version, 2)
+        self.assertEqual(p.changes_since(0), [{u'op': u'current', u'position': 3}, {u'op': u'clear'}])
+        self.assertEqual(p.changes_since(1), [{u'op': u'clear'}])
+        self.assertEqual(p.changes_since(2), [])
+        # a version we have never had
+        self.assertEqual(p.changes_since(3), None)
+
+    def test_log_size(self):
+        p = self.playlist
+        self.patch(Playlist, "changelog_size", 3)
+        for i in range(5):
+            p.record(u'current', position=i)
+        self.assertEqual(len(p.changelog), 3)
+        self.assertEqual(p.changes_since(1), None)
+        self.assertEqual([c[u'position'] for c in p.changes_since(2)], [2, 3, 4])
+
+    def test_snapshot(self):
+        self.playlist.record(u'clear')
+        self.assertEqual(self.playlist.snapshot(), {u'version': 1, u'items': [], u'current': -1})
+
+class TestQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        EventReactor(store=self.store)
+        self.playlist = Playlist(store=self.store)
+        self.playlist.activate()
+        self.provider = FakeProvider(store=self.store)
+
+    def tracks(self, *tids):
+        return [FakeTrack(self.provider, tid) for tid in tids]
+
+    def queue(self):
+        return [p.tid for p in self.playlist]
+
+    def test_enqueue(self):
+        self.playlist.enqueue(*self.tracks(u"a", u"b"))
+        self.playlist.enqueue(*self.tracks(u"c"))
+        self.assertEqual(self.queue(), [u"a", u"b", u"c"])
+        self.assertEqual([c[u'op'] for c in self.playlist.changes_since(0)], [u'insert'] * 3)
+
+    def test_enqueue_many(self):
+        self.patch(Playlist, "window", 2)
+        self.playlist.enqueue(*self.tracks(u"a", u"b", u"c"))
+        self.assertEqual(self.queue(), [u"a", u"b", u"c"])
+        # clients reload rather than being sent every track
+        self.assertEqual(self.playlist.changes_since(0), None)
+        self.assertEqual(self.provider.resolved, 0)
+        items = self.playlist.snapshot()[u'items']
+        self.assertEqual([i.get(u'title') for i in items], [u"a", u"b", None])
+        self.assertEqual(self.provider.resolved, 2)
+        details = self.playlist.details([items[2][u'pid'], self.provider.storeID])
+        self.assertEqual([i[u'title'] for i in details], [u"c"])
+
+    def test_snapshot_unloaded(self):
+        self.patch(Playlist, "window", 1)
+        self.patch(FakeProvider, "loaded", False)
+        self.playlist.enqueue(*self.tracks(u"a"))
+        self.playlist.enqueue(*self.tracks(u"b"))
+        a, b = self.playlist
+        self.playlist.snapshot()
+        # clients sent b when it was inserted still need its update
+        self.assertEqual(self.playlist.unloaded, set([a.storeID, b.storeID]))
+
+    def test_insert(self):
+        a, b = self.playlist.insert(self.tracks(u"a", u"b"))
+        positions = a.position, b.position
+        self.playlist.insert(self.tracks(u"c", u"d"), a)
+        self.playlist.insert(self.tracks(u"e"))
+        self.assertEqual(self.queue(), [u"e", u"a", u"c", u"d", u"b"])
+        self.assertEqual((a.position, b.position), positions)
+
+    def test_rebalance(self):
+        self.patch(Playlist, "spacing", 2)
+        a, b, c = self.playlist.insert(self.tracks(u"a", u"b", u"c"))
+        self.playlist.current = b.position
+        version = self.playlist.version
+        self.playlist.insert(self.tracks(u"d", u"e"), a)
+        self.assertEqual(self.queue(), [u"a", u"d", u"e", u"b", u"c"])
+        self.assertEqual(self.playlist.get_current_track(), b)
+        self.assertEqual(self.playlist.changes_since(version), None)
+
+    def test_remove_current(self):
+        a, b, c = self.playlist.insert(self.tracks(u"a", u"b", u"c"))
+        self.playlist.current = b.position
+        self.playlist.remove(b)
+        self.assertEqual(self.queue(), [u"a", u"c"])
+        self.assertEqual(self.playlist.get_current_track(), None)
+        self.assertEqual(self.playlist.get_next_track(), c)
+
+    def test_move(self):
+        a, b, c = self.playlist.insert(self.tracks(u"a", u"b", u"c"))
+        self.playlist.move(c, a)
+        self.assertEqual(self.queue(), [u"a", u"c", u"b"])
+        self.playlist.move(b)
+        self.assertEqual(self.queue(), [u"b", u"a", u"c"])
+
+    def test_playfirst(self):
+        a, b, c = self.playlist.insert(self.tracks(u"a", u"b", u"c"))
+        self.playlist.current = b.position
+        self.playlist.playfirst(*self.tracks(u"d", u"e"))
+        self.assertEqual(self.queue(), [u"a", u"d", u"e", u"c"])
+
+    def test_library_changed(self):
+        a, b, c = self.playlist.insert(self.tracks(u"a", u"b", u"a"))
+        version = self.playlist.version
+        resolved = self.provider.resolved
+        ev = FakeLibraryChangeEvent(self.provider, changed=self.tracks(u"a"))
+        self.playlist.tracks.libraryChanged(ev)
+        self.playlist.libraryChanged(ev)
+        self.assertEqual([(ch[u'op'], ch[u'item'][u'pid']) for ch in self.playlist.changes_since(version)],
+                         [(u'update', a.storeID), (u'update', c.storeID)])
+        # sent the track as it is now
+        self.assertEqual(self.provider.resolved, resolved + 1)
+        self.playlist.libraryChanged(FakeLibraryChangeEvent(self.provider, changed=[]))
+        self.assertEqual(len(self.playlist.changes_since(version)), 2)
+
+    def test_library_removed(self):
+        a, b, c = self.playlist.insert(self.tracks(u"a", u"b", u"a"))
+        self.playlist.libraryChanged(FakeLibraryChangeEvent(self.provider, removed=self.tracks(u"a")))
+        self.assertEqual(self.queue(), [u"b"])
+
+    def test_clear(self):
+        self.playlist.enqueue(*self.tracks(u"a", u"b"))
+        self.playlist.clear()
+        self.assertEqual(self.queue(), [])
+        self.playlist.enqueue(*self.tracks(u"c"))
+        self.assertEqual(self.queue(), [u"c"])
+
+class FakePlayer(object):
+
+    def __init__(self):
+        self.played = []
+
+    def play(self, track):
+        self.played.append(track.track_id)
+
+class TestNextTrack(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        EventReactor(store=self.store)
+        self.playlist = Playlist(store=self.store)
+        self.playlist.activate()
+        self.provider = FakeProvider(store=self.store)
+        self.players = FakePlayers(store=self.store)
+        self.store.powerUp(self.players, isqueal.IPlayMusic)
+        self.clock = task.Clock()
+        self.patch(Playlist, "clock", self.clock)
+        self.patch(FakeProvider, "duration", 60000)
+        self.patch(FakeProvider, "prefetched", [])
+        self.patch(FakePlayers, "calls", [])
+        self.a, self.b = self.playlist.insert([FakeTrack(self.provider, u"a"),
+                                               FakeTrack(self.provider, u"b")])
+
+    def state(self, state, player=None):
+        self.playlist.playerState(StateChanged(player, state))
+
+    def test_gapless(self):
+        self.playlist.play()
+        self.state(StateChanged.State.STARTED, 1)
+        self.state(StateChanged.State.READY, 1)
+        # waits for every player's decoder
+        self.assertEqual(self.players.calls, [('play', u'a')])
+        self.state(StateChanged.State.READY, 2)
+        self.assertEqual(self.players.calls, [('play', u'a'), ('queue', u'b')])
+        self.assertEqual(self.provider.prefetched, [u'b'])
+        self.assertEqual(self.playlist.get_current_track(), self.a)
+        self.state(StateChanged.State.STARTED, 1)
+        self.state(StateChanged.State.STARTED, 2)
+        self.assertEqual(self.playlist.get_current_track(), self.b)
+        self.assertEqual(self.players.calls, [('play', u'a'), ('queue', u'b')])
+
+    def test_prefetch_before_end(self):
+        self.playlist.play()
+        self.state(StateChanged.State.STARTED, 1)
+        self.clock.advance(60 - Playlist.prefetch_lead - 1)
+        self.assertEqual(self.provider.prefetched, [])
+        self.clock.advance(1)
+        self.assertEqual(self.provider.prefetched, [u'b'])
+        # not asked again when the decoder is ready
+        self.state(StateChanged.State.READY, 1)
+        self.state(StateChanged.State.READY, 2)
+        self.assertEqual(self.provider.prefetched, [u'b'])
+
+    def test_player_joins(self):
+        player = FakePlayer()
+        self.state(StateChanged.State.ESTABLISHED, player)
+        self.assertEqual(player.played, [])
+        self.playlist.play()
+        self.state(StateChanged.State.STARTED, 1)
+        self.state(StateChanged.State.ESTABLISHED, player)
+        self.assertEqual(player.played, [u'a'])
+        # waits for the new player too
+        self.state(StateChanged.State.READY, 1)
+        self.state(StateChanged.State.READY, 2)
+        self.assertEqual(self.playlist.pending, None)
+        self.state(StateChanged.State.READY, player)
+        self.assertEqual(self.playlist.pending, self.b)
+
+    def test_player_joins_clock(self):
+        self.playlist.play()
+        self.state(StateChanged.State.STARTED, 1)
+        self.playlist.previous_playtime = 10
+        started = self.playlist.last_started
+        player = FakePlayer()
+        self.state(StateChanged.State.ESTABLISHED, player)
+        self.state(StateChanged.State.STARTED, player)
+        # the others are still playing the same track
+        self.assertEqual(self.playlist.previous_playtime, 10)
+        self.assertEqual(self.playlist.last_started, started)
+        self.assertTrue(self.playlist.time_played() >= 10000)
+        self.assertEqual(self.playlist.get_current_track(), self.a)
+        self.state(StateChanged.State.STARTED, 1)
+        self.assertEqual(self.playlist.previous_playtime, 0)
+
+    def test_resume(self):
+        self.playlist.play()
+        self.state(StateChanged.State.STARTED, 1)
+        self.state(StateChanged.State.READY, 1)
+        self.state(StateChanged.State.READY, 2)
+        self.assertEqual(self.playlist.pending, self.b)
+        self.playlist.players_paused()
+        played = self.playlist.previous_playtime
+        # resuming the track that was playing does not move on to the queued one
+        self.state(StateChanged.State.PLAYING, 1)
+        self.assertEqual(self.playlist.get_current_track(), self.a)
+        self.assertEqual(self.playlist.pending, self.b)
+        self.assertEqual(self.playlist.previous_playtime, played)
+        self.state(StateChanged.State.STARTED, 1)
+        self.assertEqual(self.playlist.get_current_track(), self.b)
+        self.assertEqual(self.playlist.previous_playtime, 0)
+
+    def test_other_player_leaves(self):
+        player = FakePlayer()
+        self.state(StateChanged.State.ESTABLISHED, player)
+        self.playlist.play()
+        self.state(StateChanged.State.STARTED, 1)
+        # a player that was never sent the track
+        self.state(StateChanged.State.DISCONNECTED, player)
+        self.state(StateChanged.State.READY, 1)
+        self.assertEqual(self.playlist.pending, None)
+        self.state(StateChanged.State.READY, 2)
+        self.assertEqual(self.playlist.pending, self.b)
+
+    def test_player_leaves(self):
+        self.playlist.play()
+        self.state(StateChanged.State.STARTED, 1)
+        self.state(StateChanged.State.READY, 1)
+        self.state(StateChanged.State.DISCONNECTED, 2)
+        self.assertEqual(self.playlist.pending, self.b)
+
+    def test_underrun(self):
+        self.playlist.play()
+        self.state(StateChanged.State.STARTED, 1)
+        self.state(StateChanged.State.UNDERRUN, 1)
+        self.state(StateChanged.State.UNDERRUN, 2)
+        self.assertEqual(self.players.calls, [('play', u'a'), ('play', u'b')])
+        self.assertEqual(self.playlist.get_current_track(), self.b)
+        self.assertFalse(self.clock.getDelayedCalls())
+
+class TestTrackCache(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        self.provider = FakeProvider(store=self.store)
+        self.cache = TrackCache(size=2)
+
+    def test_get(self):
+        t = self.cache.get(self.provider, u"1")
+        self.assertIdentical(self.cache.get(self.provider, u"1"), t)
+        self.assertEqual(self.provider.resolved, 1)
+        self.cache.get(self.provider, u"2")
+        self.cache.get(self.provider, u"3")
+        self.cache.get(self.provider, u"1")
+        self.assertEqual(self.provider.resolved, 4)
+
+    def test_library_changed(self):
+        t = self.cache.get(self.provider, u"1")
+        self.cache.libraryChanged(FakeLibraryChangeEvent(self.provider, changed=[t]))
+        self.cache.get(self.provider, u"1")
+        self.assertEqual(self.provider.resolved, 2)
+
+    def test_per_store(self):
+        other = Store()
+        self.assertIdentical(service.track_cache(self.store), service.track_cache(self.store))
+        self.assertNotIdentical(service.track_cache(other), service.track_cache(self.store))
+
+    def test_metadata_changed(self):
+        self.cache.get(self.provider, u"1")
+        self.patch(FakeProvider, "loaded", False)
+        self.cache.get(self.provider, u"2")
+        self.cache.metadataChanged(None)
+        self.cache.get(self.provider, u"1")
+        self.cache.get(self.provider, u"2")
+        self.assertEqual(self.provider.resolved, 3)
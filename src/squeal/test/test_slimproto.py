@@ -0,0 +1,86 @@
+import struct
+
+from twisted.trial import unittest
+from twisted.test import proto_helpers
+
+from squeal.net import slimproto
+
+def frame(operation, data):
+    return operation + struct.pack('!I', len(data)) + data
+
+class RecordingPlayer(slimproto.Player):
+
+    def __init__(self):
+        self.received = []
+        slimproto.Player.__init__(self)
+
+    def process_STAT(self, data):
+        self.received.append(('STAT', data))
+
+    def process_IR(self, data):
+        self.received.append(('IR', data))
+
+class TestFraming(unittest.TestCase):
+
+    def setUp(self):
+        self.player = RecordingPlayer()
+        self.stat = frame('STAT', 'STMt' + '\x00' * 10)
+        self.ir = frame('IR  ', struct.pack('!IxxI', 1, 2))
+
+    def test_several_frames(self):
+        self.player.dataReceived(self.stat + self.ir + self.stat)
+        self.assertEqual([op for op, data in self.player.received], ['STAT', 'IR', 'STAT'])
+        self.assertEqual(len(self.player.buffer), 0)
+
+    def test_split_frames(self):
+        data = self.stat + self.ir
+        for i in range(len(data)):
+            self.player.dataReceived(data[i])
+        self.assertEqual(self.player.received,
+                         [('STAT', 'STMt' + '\x00' * 10),
+                          ('IR', struct.pack('!IxxI', 1, 2))])
+
+    def test_unknown_operation(self):
+        self.assertRaises(NotImplementedError, self.player.dataReceived,
+                          frame('XXXX', '') + self.stat)
+        self.assertEqual(self.player.received, [])
+        self.player.dataReceived('')
+        self.assertEqual([op for op, data in self.player.received], ['STAT'])
+
+class FakeTrack(object):
+
+    track_type = 2
+
+    def player_uri(self, player_id):
+        return "/library/stream?tid=1&pid=%s" % player_id
+
+class TestFormats(unittest.TestCase):
+
+    def setUp(self):
+        self.player = slimproto.Player()
+        self.player.transport = proto_helpers.StringTransport()
+        self.track = FakeTrack()
+
+    def sent(self):
+        data = self.player.transport.value()
+        self.player.transport.clear()
+        # the format byte, and the request
+        return data[8], data[data.index("GET"):].split()[1]
+
+    def test_supported(self):
+        self.player.stream(self.track)
+        self.assertEqual(self.sent(), ('f', "/library/stream?tid=1&pid=%d" % id(self.player)))
+
+    def test_unsupported(self):
+        self.player.formats = set('mp')
+        self.player.stream(self.track)
+        self.assertEqual(self.sent(), ('m', "/library/stream?tid=1&pid=%d&format=mp3" % id(self.player)))
+
+    def test_decoder_refuses(self):
+        self.player.stream(self.track)
+        self.sent()
+        self.player.dataReceived(frame('STAT', 'STMn' + '\x00' * 10))
+        self.assertEqual(self.sent(), ('m', "/library/stream?tid=1&pid=%d&format=mp3" % id(self.player)))
+        # there is nothing else to try
+        self.player.dataReceived(frame('STAT', 'STMn' + '\x00' * 10))
+        self.assertEqual(self.player.transport.value(), "")
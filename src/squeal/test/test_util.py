@@ -0,0 +1,40 @@
+from twisted.trial import unittest
+
+from squeal.util import LRUCache
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        c = LRUCache(2)
+        c.put('a', 1)
+        c.put('b', 2)
+        self.assertEqual(c.get('a'), 1)
+        c.put('c', 3)
+        self.assertEqual(len(c), 2)
+        self.assertFalse('b' in c)
+        self.assertEqual(c.get('b', 'missing'), 'missing')
+        self.assertEqual(c.get('a'), 1)
+        self.assertEqual(c.get('c'), 3)
+
+    def test_replace(self):
+        c = LRUCache(2)
+        c.put('a', 1)
+        c.put('a', 2)
+        self.assertEqual(len(c), 1)
+        self.assertEqual(c.get('a'), 2)
+        c.remove('a')
+        c.remove('a')
+        self.assertEqual(len(c), 0)
+
+    def test_evicted(self):
+        evicted = []
+        c = LRUCache(2, evicted.append)
+        c.put('a', 1)
+        c.put('b', 2)
+        c.put('c', 3)
+        self.assertEqual(evicted, [1])
+        c.put('b', 4)
+        c.remove('c')
+        self.assertEqual(evicted, [1, 2, 3])
+        c.clear()
+        self.assertEqual(evicted, [1, 2, 3, 4])
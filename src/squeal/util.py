@@ -25,6 +25,10 @@ import struct
 import socket
 import fcntl
 import simplejson
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
 from squeal.isqueal import *
 
 def all_interfaces():
@@ -53,3 +57,50 @@ def guess_ip():
     if candidates:
         return candidates[0]
 
+class LRUCache(object):
+
+    """ A dictionary that holds at most size items, forgetting the least
+    recently used when it is full. If given, evicted is called with each value
+    that is forgotten or removed. """
+
+    def __init__(self, size=100, evicted=None):
+        self.size = size
+        self.items = OrderedDict()
+        self.evicted = evicted
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            return default
+        self.items[key] = value
+        return value
+
+    def put(self, key, value):
+        old = self.items.pop(key, None)
+        if old is not None and old is not value:
+            self._evict(old)
+        self.items[key] = value
+        while len(self.items) > self.size:
+            self._evict(self.items.popitem(last=False)[1])
+
+    def remove(self, key):
+        value = self.items.pop(key, None)
+        if value is not None:
+            self._evict(value)
+
+    def clear(self):
+        values = self.items.values()
+        self.items.clear()
+        for value in values:
+            self._evict(value)
+
+    def _evict(self, value):
+        if self.evicted is not None:
+            self.evicted(value)
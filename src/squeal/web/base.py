@@ -41,6 +41,10 @@ def xmltemplate(name, template_dir=template_dir):
 
 class BaseElement(athena.LiveElement):
 
+    # the least time between reloads caused by events, in seconds. Pass it as
+    # the interval when subscribing handlers that reload the element.
+    reload_interval = 0.5
+
     def __init__(self, *a, **kw):
         log.msg("Initializing", system=self.__class__.__name__)
         super(BaseElement, self).__init__(*a, **kw)
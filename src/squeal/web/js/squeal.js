@@ -80,6 +80,15 @@ Squeal.Source.methods(
 );
 
 Squeal.Playlist.methods(
+    function __init__(self, widgetNode) {
+        Squeal.Playlist.upcall(self, "__init__", widgetNode);
+        // the pids of tracks whose details have been asked for
+        self.asking = {};
+        $(window).scroll(function () {
+            self.fill();
+        });
+    },
+
     function registerW(self) {
         Squeal.W.playlist = self;
     },
@@ -89,10 +98,68 @@ Squeal.Playlist.methods(
     },
 
     function reload(self, data) {
-        var items = data['items'];
-        var current = data['current'];
+        // the whole playlist
+        self.version = data['version'];
+        self.items = data['items'];
+        self.current = data['current'];
         var ctr = self.nodeById("queue-items");
         ctr.innerHTML = "";
+        _.each(self.items, function (p) {
+            $(ctr).append(self.render(p));
+        });
+        self.asking = {};
+        self.fill();
+    },
+
+    function fill(self) {
+        // ask for the details of the tracks in view that were sent without
+        var top = $(window).scrollTop();
+        var bottom = top + $(window).height();
+        var pids = [];
+        for(var i = 0; i < self.items.length; i++) {
+            var p = self.items[i];
+            if(p.title !== undefined || self.asking[p.pid]) {
+                continue;
+            }
+            var li = $('#playtrack-' + p.pid);
+            var y = li.offset().top;
+            if(y > bottom) {
+                break;
+            }
+            if(y + li.height() >= top) {
+                self.asking[p.pid] = true;
+                pids.push(p.pid);
+            }
+        }
+        if(pids.length > 0) {
+            self.callRemote("details", pids).addCallback(function (items) {
+                _.each(items, function (item) {
+                    delete self.asking[item.pid];
+                    self.change_update({item: item});
+                });
+            });
+        }
+    },
+
+    function apply(self, data) {
+        // changes since the version we have
+        if(data['from'] != self.version) {
+            self.callRemote("reload");
+            return;
+        }
+        _.each(data['changes'], function (change) {
+            self['change_' + change.op](change);
+        });
+        self.version = data['version'];
+        self.fill();
+    },
+
+    function render(self, p) {
+        if(p.title === undefined) {
+            // sent without its details, see fill
+            p = _.extend({title: 'Loading...', artist: '', album: '',
+                          image_uri: '', user: '', length: ''}, p);
+        }
         var t = $.template('<li ${class}> \
                             <p class="track"> \
                                 <span class="cover-art" style="background-image: url(${image_uri}&size=${size})"></span>\
@@ -105,16 +172,75 @@ Squeal.Playlist.methods(
                               <span class="length">${length}</span>\
                             </p>\
                             </li>');
-        _.each(items, function (p) {
-            if(p.position == current) {
-                p.class = 'class="current"';
-                p.size = 65;
-            } else {
-                p.class = '';
-                p.size = 50;
+        if(p.position == self.current) {
+            p.class = 'class="current"';
+            p.size = 65;
+        } else {
+            p.class = '';
+            p.size = 50;
+        }
+        return $('<div></div>').append(t, p).children().attr('id', 'playtrack-' + p.pid);
+    },
+
+    function indexOf(self, pid) {
+        for(var i = 0; i < self.items.length; i++) {
+            if(self.items[i].pid == pid) {
+                return i;
             }
-            $(ctr).append(t, p);
-        });
+        }
+        return -1;
+    },
+
+    function rerender(self, i) {
+        var p = self.items[i];
+        $('#playtrack-' + p.pid).replaceWith(self.render(p));
+    },
+
+    function change_insert(self, change) {
+        var p = change.item;
+        var i = 0;
+        while(i < self.items.length && self.items[i].position <= p.position) {
+            i++;
+        }
+        self.items.splice(i, 0, p);
+        var li = self.render(p);
+        if(i == self.items.length - 1) {
+            $(self.nodeById("queue-items")).append(li);
+        } else {
+            $('#playtrack-' + self.items[i + 1].pid).before(li);
+        }
+    },
+
+    function change_remove(self, change) {
+        var i = self.indexOf(change.pid);
+        if(i != -1) {
+            self.items.splice(i, 1);
+            $('#playtrack-' + change.pid).remove();
+        }
+    },
+
+    function change_update(self, change) {
+        var i = self.indexOf(change.item.pid);
+        if(i != -1) {
+            self.items[i] = change.item;
+            self.rerender(i);
+        }
+    },
+
+    function change_current(self, change) {
+        var previous = self.current;
+        self.current = change.position;
+        for(var i = 0; i < self.items.length; i++) {
+            var position = self.items[i].position;
+            if(position == previous || position == self.current) {
+                self.rerender(i);
+            }
+        }
+    },
+
+    function change_clear(self, change) {
+        self.items = [];
+        self.nodeById("queue-items").innerHTML = "";
     }
 
 );
@@ -36,7 +36,6 @@ import base
 
 import ijukebox
 from squeal import isqueal
-from squeal.adaptivejson import simplify
 
 from formlet import widget
 from formlet import form
@@ -139,8 +138,8 @@ class Header(base.BaseElement):
             self.callRemote('start_progress', played, current.duration)
 
     def subscribe(self):
-        self.evreactor.subscribe(self.queueChange, isqueal.IPlaylistChangeEvent)
-        self.evreactor.subscribe(self.queueChange, isqueal.IMetadataChangeEvent)
+        self.evreactor.subscribe(self.queueChange, isqueal.IPlaylistChangeEvent, interval=self.reload_interval)
+        self.evreactor.subscribe(self.queueChange, isqueal.IMetadataChangeEvent, interval=self.reload_interval)
         self.evreactor.subscribe(self.player_change, isqueal.IPlayerStateChange)
         self.evreactor.subscribe(self.volume_change, isqueal.IVolumeChangeEvent)
 
@@ -159,10 +158,14 @@ class Header(base.BaseElement):
 
     def player_change(self, ev):
         current = self.playlist_service.get_current_track()
-        if ev.state == ev.State.PLAYING:
+        if ev.state == ev.State.STARTED:
             if 'SQUEAL_DEBUG' in os.environ:
                 log.msg("Player is playing, starting progress", system="squeal.web.jukebox.Header")
             self.callRemote('start_progress', 0, current.duration)
+        elif ev.state == ev.State.PLAYING:
+            if 'SQUEAL_DEBUG' in os.environ:
+                log.msg("Player has resumed, restarting progress", system="squeal.web.jukebox.Header")
+            self.callRemote('start_progress', self.playlist_service.time_played(), current.duration)
         elif ev.state == ev.State.PAUSED:
             self.callRemote('halt_progress')
             if 'SQUEAL_DEBUG' in os.environ:
@@ -257,7 +260,7 @@ class Players(base.BaseElement):
         self.subscribe()
 
     def subscribe(self):
-        self.evreactor.subscribe(self.playerChange, isqueal.IPlayerStateChange)
+        self.evreactor.subscribe(self.playerChange, isqueal.IPlayerStateChange, interval=self.reload_interval)
 
     def playerChange(self, ev):
         log.msg("Player state change noted", system="squeal.web.jukebox.Players")
@@ -289,17 +292,24 @@ class Players(base.BaseElement):
             yield T.li["%s (%s)" % (p.mac_address, p.device_type)]
 
 class Playlist(base.BaseElement):
+
+    """ The queue. The client is sent the whole playlist when it first goes
+    live, and after that only the changes since the version it has. """
+
     jsClass = u"Squeal.Playlist"
     docFactory = base.xmltemplate("playlist.html")
 
+    def __init__(self, *a, **kw):
+        super(Playlist, self).__init__(*a, **kw)
+        self.version = None
+
     @athena.expose
     def goingLive(self):
         self.subscribe()
         self.reload()
 
     def subscribe(self):
-        self.evreactor.subscribe(self.queueChange, isqueal.IPlaylistChangeEvent)
-        self.evreactor.subscribe(self.queueChange, isqueal.IMetadataChangeEvent)
+        self.evreactor.subscribe(self.queueChange, isqueal.IPlaylistChangeEvent, interval=self.reload_interval)
 
     @property
     def playlist_service(self):
@@ -307,21 +317,39 @@ class Playlist(base.BaseElement):
             return queue
 
     def queueChange(self, ev):
-        self.reload()
+        queue = self.playlist_service
+        changes = None
+        if self.version is not None:
+            changes = queue.changes_since(self.version)
+        if changes is None:
+            self.reload()
+        elif changes:
+            previous, self.version = self.version, queue.version
+            self.callRemote("apply", {
+                u'from': previous,
+                u'version': self.version,
+                u'changes': changes,
+            })
 
     @athena.expose
     def clear(self):
         log.msg("clear", system="squeal.web.jukebox.Queue")
         self.playlist_service.clear()
-        self.reload()
+        self.queueChange(None)
 
+    @athena.expose
     def reload(self):
-        queue = self.playlist_service
-        items = map(simplify, queue)
-        self.callRemote("reload", {
-            u'items': items,
-            u'current': queue.current,
-        })
+        """ Send the whole playlist. The client asks for this if it finds it
+        has missed some changes. """
+        snapshot = self.playlist_service.snapshot()
+        self.version = snapshot[u'version']
+        self.callRemote("reload", snapshot)
+
+    @athena.expose
+    def details(self, pids):
+        """ The details of tracks that were sent without them, which the
+        client asks for as they come into view. """
+        return self.playlist_service.details(pids)
 
     @athena.expose
     def queueTrack(self, namespace, tid):
@@ -384,7 +412,7 @@ class Connected(base.BaseElement):
 
     def subscribe(self):
         log.msg("Subscribing", system="squeal.web.jukebox.Connected")
-        self.evreactor.subscribe(self.playerChange, isqueal.IPlayerStateChange)
+        self.evreactor.subscribe(self.playerChange, isqueal.IPlayerStateChange, interval=self.reload_interval)
 
     def playerChange(self, ev):
         log.msg("Reloading players", system="squeal.web.jukebox.Connected")